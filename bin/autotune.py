@@ -0,0 +1,250 @@
+""" Short trials of slicer and stitcher on a sample region of the input, for a grid of block sizes,
+    worker counts and prefetch depths. The fastest configuration and cost model coefficients fitted to the trials
+    are saved to the local profile, that is read by later runs.
+"""
+
+import argparse
+import contextlib
+import io
+import os
+import os.path as osp
+import shutil
+import tempfile
+import time
+from datetime import datetime
+from typing import Dict, List
+
+import numpy as np
+import tifffile as tif
+import yaml
+
+import storage
+import tiling_planner
+from boundaries import get_boundaries
+
+DEFAULT_BLOCK_SIZES = [250, 500, 1000, 2000]
+DEFAULT_PREFETCH = [0, 2, 4]
+
+
+def get_default_workers() -> List[int]:
+    ncpus = os.cpu_count() or 1
+    return sorted({1, max(1, ncpus // 2), ncpus})
+
+
+def write_sample(img_path: str, out_path: str, channel: int, sample_size: int, sample_pages: int) -> tuple:
+    """ Central window of z-planes of the channel, returns its shape """
+    params = tiling_planner.get_image_params(img_path)
+    plane_shape = params['plane_shape']
+    num_z = params['num_z']
+    y0 = max(0, (plane_shape[0] - sample_size) // 2)
+    x0 = max(0, (plane_shape[1] - sample_size) // 2)
+    window = (slice(y0, y0 + sample_size), slice(x0, x0 + sample_size))
+    # planes are repeated if there are fewer z-planes than sample pages
+    pages = [channel * num_z + k % num_z for k in range(0, sample_pages)]
+    with storage.open_tiff(img_path) as TF:
+        sample = np.stack([TF.pages[p].asarray()[window] for p in pages])
+    tif.imwrite(out_path, sample, photometric='minisblack')
+    return sample.shape
+
+
+def write_label_tiles(sample_path: str, out_dir: str, block_size: int, overlap: int) -> dict:
+    """ Labels of thresholded first sample page split into tiles with Cytokit names and mask pages,
+        as segmentation output that stitcher reads. Returns padding of the tile grid.
+    """
+    from scipy import ndimage as ndi
+    import slicer
+
+    plane = tif.imread(sample_path, key=0)
+    threshold = slicer.otsu_threshold(plane)
+    blocks, _ = slicer.split_by_size(plane, 1, 0, 0, block_size, block_size, overlap)
+    x_nblocks, y_nblocks = slicer.get_nblocks(plane.shape, block_size, block_size)
+    os.makedirs(out_dir)
+    for n, block in enumerate(blocks):
+        labels = ndi.label(block > threshold)[0].astype(np.uint32)
+        boundaries = get_boundaries(labels)
+        name = 'R001_X{:03d}_Y{:03d}.tif'.format(n % x_nblocks + 1, n // x_nblocks + 1)
+        tif.imwrite(osp.join(out_dir, name), np.stack([labels, labels, boundaries, boundaries]),
+                    photometric='minisblack')
+    return {'left': 0, 'right': x_nblocks * block_size - plane.shape[1],
+            'top': 0, 'bottom': y_nblocks * block_size - plane.shape[0]}
+
+
+def time_call(func, repeat: int, cleanup=None) -> float:
+    """ Median wall time in seconds, output of the call is hidden """
+    timings = []
+    for _ in range(0, repeat):
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            func()
+        timings.append(time.perf_counter() - start)
+        if cleanup is not None:
+            cleanup()
+    return sorted(timings)[len(timings) // 2]
+
+
+def run_trials(sample_path: str, work_dir: str, overlap: int, block_sizes: List[int], workers: List[int],
+               prefetch_depths: List[int], repeat: int) -> List[dict]:
+    # slicer, stitcher and dask are imported only when trials run
+    import dask
+    import slicer
+    import stitcher
+
+    sample_shape = tif.imread(sample_path).shape
+    trials = []
+    for block_size in block_sizes:
+        x_nblocks, y_nblocks = slicer.get_nblocks(sample_shape, block_size, block_size)
+        label_dir = osp.join(work_dir, 'labels_' + str(block_size))
+        padding = write_label_tiles(sample_path, label_dir, block_size, overlap)
+        padding_str = ','.join(str(padding[k]) for k in ('left', 'right', 'top', 'bottom'))
+        tiles_dir = osp.join(work_dir, 'tiles')
+        stitched_path = osp.join(work_dir, 'stitched.tif')
+
+        for nworkers in workers:
+            for depth in prefetch_depths:
+                with dask.config.set(num_workers=nworkers):
+                    os.makedirs(tiles_dir, exist_ok=True)
+                    slicer_s = time_call(
+                        lambda: slicer.split_tiff(sample_path, tiles_dir, block_size, 0, overlap, 1, 1,
+                                                  sample_shape[0], 1, [0], depth),
+                        repeat, cleanup=lambda: (shutil.rmtree(tiles_dir), os.makedirs(tiles_dir)))
+                    stitcher_s = time_call(
+                        lambda: stitcher.main(label_dir, stitched_path, overlap, padding_str, prefetch_depth=depth),
+                        repeat)
+                trial = {'block_size': block_size, 'num_workers': nworkers, 'prefetch': depth,
+                         'ntiles': x_nblocks * y_nblocks, 'slicer_s': round(slicer_s, 4),
+                         'stitcher_s': round(stitcher_s, 4)}
+                print(*trial.values(), sep='\t')
+                trials.append(trial)
+        shutil.rmtree(label_dir)
+    return trials
+
+
+def select_stage_config(trials: List[dict], stage: str) -> dict:
+    """ Workers and prefetch depth with the smallest total time over all block sizes """
+    totals = dict()
+    for t in trials:
+        key = (t['num_workers'], t['prefetch'])
+        totals[key] = totals.get(key, 0) + t[stage + '_s']
+    num_workers, prefetch = min(totals, key=lambda k: (totals[k], k))
+    return {'num_workers': num_workers, 'prefetch': prefetch}
+
+
+def fit_cost_model(trials: List[dict], slicer_config: dict, stitcher_config: dict, sample_shape: tuple,
+                   overlap: int) -> dict:
+    """ Coefficients of tiling_planner cost model from trials with the selected configuration """
+    import slicer
+
+    slicer_rates = []
+    stitcher_rows = []
+    stitcher_times = []
+    for t in trials:
+        tile_px = (t['block_size'] + overlap * 2) ** 2
+        if t['num_workers'] == slicer_config['num_workers'] and t['prefetch'] == slicer_config['prefetch']:
+            slicer_rates.append(t['slicer_s'] / (t['ntiles'] * tile_px * sample_shape[0] / 1e6))
+        if t['num_workers'] == stitcher_config['num_workers'] and t['prefetch'] == stitcher_config['prefetch']:
+            x_nblocks, y_nblocks = slicer.get_nblocks(sample_shape, t['block_size'], t['block_size'])
+            padded_px = x_nblocks * y_nblocks * t['block_size'] ** 2
+            stitcher_rows.append([padded_px * tiling_planner.NUM_MASK_PAGES / 1e6, t['ntiles']])
+            stitcher_times.append(t['stitcher_s'])
+    model = {'slicer_s_per_mpx': float(np.median(slicer_rates))}
+    # time = per_mpx * mpx + per_tile * ntiles, both terms are kept non-negative
+    if len(stitcher_rows) > 1:
+        coef = np.linalg.lstsq(np.array(stitcher_rows), np.array(stitcher_times), rcond=None)[0]
+        per_mpx, per_tile = max(float(coef[0]), 0.0), max(float(coef[1]), 0.0)
+        if per_mpx == 0 and per_tile == 0:
+            per_tile = float(np.mean([t / r[1] for t, r in zip(stitcher_times, stitcher_rows)]))
+    else:
+        per_mpx = stitcher_times[0] / stitcher_rows[0][0]
+        per_tile = 0.0
+    model['stitcher_s_per_mpx'] = per_mpx
+    model['stitcher_s_per_tile'] = per_tile
+    return {key: float('{:.4g}'.format(val)) for key, val in model.items()}
+
+
+def save_profile(profile: dict, profile_path: str = None):
+    path = tiling_planner.DEFAULT_PROFILE_PATH if profile_path is None else profile_path
+    with open(path, 'w') as s:
+        yaml.safe_dump(profile, s, default_flow_style=False, sort_keys=False)
+
+
+def update_profile(result: dict, profile_path: str = None) -> dict:
+    """ Keeps other keys of the existing profile, e.g. coefficients of segmentation """
+    path = tiling_planner.DEFAULT_PROFILE_PATH if profile_path is None else profile_path
+    profile = tiling_planner.load_profile(path) if osp.exists(path) else {}
+    profile.setdefault('cost_model', {}).update(result['cost_model'])
+    profile['slicer'] = result['slicer']
+    profile['stitcher'] = result['stitcher']
+    profile['autotune'] = result['autotune']
+    save_profile(profile, path)
+    return profile
+
+
+def autotune(img_path: str, overlap: int, work_dir: str = None, channel: int = 0, sample_size: int = 2048,
+             sample_pages: int = 2, block_sizes: List[int] = None, workers: List[int] = None,
+             prefetch_depths: List[int] = None, repeat: int = 1) -> Dict[str, dict]:
+    """ work_dir should be on the same storage as directories of pipeline runs, tiles are written there """
+    block_sizes = DEFAULT_BLOCK_SIZES if block_sizes is None else block_sizes
+    workers = get_default_workers() if workers is None else workers
+    prefetch_depths = DEFAULT_PREFETCH if prefetch_depths is None else prefetch_depths
+
+    work_dir = tempfile.mkdtemp(prefix='autotune_', dir=work_dir)
+    try:
+        sample_path = osp.join(work_dir, 'sample.tif')
+        sample_shape = write_sample(img_path, sample_path, channel, sample_size, sample_pages)
+        # tiles larger than the sample only add padding
+        block_sizes = [b for b in block_sizes if b > overlap * 2 and b < max(sample_shape[-2:]) + min(block_sizes)]
+        if block_sizes == []:
+            raise ValueError('No block size is smaller than the sample, increase sample_size')
+        print('sample', sample_shape, 'from', img_path)
+        print('block', 'workers', 'prefetch', 'tiles', 'slicer_s', 'stitcher_s', sep='\t')
+        trials = run_trials(sample_path, work_dir, overlap, block_sizes, workers, prefetch_depths, repeat)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    slicer_config = select_stage_config(trials, 'slicer')
+    stitcher_config = select_stage_config(trials, 'stitcher')
+    cost_model = fit_cost_model(trials, slicer_config, stitcher_config, sample_shape, overlap)
+    fastest = min(trials, key=lambda t: t['slicer_s'] + t['stitcher_s'])
+    return {'slicer': slicer_config, 'stitcher': stitcher_config, 'cost_model': cost_model,
+            'autotune': {'date': datetime.now().isoformat(timespec='seconds'),
+                         'img_path': img_path,
+                         'sample_shape': [int(s) for s in sample_shape],
+                         'overlap': overlap,
+                         'fastest_block_size': fastest['block_size'],
+                         'trials': trials}}
+
+
+def main(img_path: str, overlap: int, work_dir: str = None, channel: int = 0, sample_size: int = 2048,
+         sample_pages: int = 2, block_sizes: List[int] = None, workers: List[int] = None,
+         prefetch_depths: List[int] = None, repeat: int = 1, profile_path: str = None):
+    result = autotune(img_path, overlap, work_dir, channel, sample_size, sample_pages, block_sizes, workers,
+                      prefetch_depths, repeat)
+    update_profile(result, profile_path)
+    print('slicer:', result['slicer'])
+    print('stitcher:', result['stitcher'])
+    print('cost model:', result['cost_model'])
+    print('profile saved to', tiling_planner.DEFAULT_PROFILE_PATH if profile_path is None else profile_path)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--img_path', type=str, required=True, help='path to MxIF OME-TIFF that will be sliced')
+    parser.add_argument('--overlap', type=int, required=True, help='overlap of one edge, as in submission')
+    parser.add_argument('--work_dir', type=str, default=None,
+                        help='directory for trial tiles, should be on the storage of pipeline runs. Default: temp')
+    parser.add_argument('--channel', type=int, default=0, help='channel of the sample, default 0')
+    parser.add_argument('--sample_size', type=int, default=2048, help='side of the sample window, default 2048')
+    parser.add_argument('--sample_pages', type=int, default=2, help='number of planes in the sample, default 2')
+    parser.add_argument('--block_sizes', type=int, nargs='+', default=None,
+                        help='block sizes to try, default ' + ' '.join(str(b) for b in DEFAULT_BLOCK_SIZES))
+    parser.add_argument('--workers', type=int, nargs='+', default=None,
+                        help='numbers of dask workers to try, default: 1, half and all cores')
+    parser.add_argument('--prefetch', type=int, nargs='+', default=None,
+                        help='prefetch depths to try, default ' + ' '.join(str(p) for p in DEFAULT_PREFETCH))
+    parser.add_argument('--repeat', type=int, default=1, help='runs of every trial, median is used, default 1')
+    parser.add_argument('--profile', type=str, default=None,
+                        help='path to profile to update, default ' + tiling_planner.DEFAULT_PROFILE_PATH)
+    args = parser.parse_args()
+
+    main(args.img_path, args.overlap, args.work_dir, args.channel, args.sample_size, args.sample_pages,
+         args.block_sizes, args.workers, args.prefetch, args.repeat, args.profile)
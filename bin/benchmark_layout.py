@@ -0,0 +1,105 @@
+import argparse
+import time
+from typing import Callable, List, Tuple
+
+import numpy as np
+import tifffile as tif
+
+from object_features import get_page_reader
+from interleaved_output import read_tiff_window
+
+Image = np.ndarray
+
+
+def get_random_windows(shape: tuple, window_size: int, nwindows: int, seed: int = 0) -> List[Tuple[slice, slice]]:
+    rng = np.random.default_rng(seed)
+    windows = []
+    for _ in range(0, nwindows):
+        y = int(rng.integers(0, max(shape[0] - window_size, 0) + 1))
+        x = int(rng.integers(0, max(shape[1] - window_size, 0) + 1))
+        windows.append((slice(y, y + window_size), slice(x, x + window_size)))
+    return windows
+
+
+def get_planar_readers(path: str) -> Tuple[Callable, Callable, tuple, int]:
+    """ Returns functions that read all channels of a window and one whole channel of planar file """
+    with tif.TiffFile(path) as TF:
+        nchannels = len(TF.pages)
+        shape = TF.pages[0].shape
+
+    def read_window(window):
+        return np.stack([np.asarray(get_page_reader(path, c)[window]) for c in range(0, nchannels)], axis=-1)
+
+    def read_channel(c):
+        return np.asarray(get_page_reader(path, c))
+
+    return read_window, read_channel, shape, nchannels
+
+
+def get_interleaved_readers(path: str) -> Tuple[Callable, Callable, tuple, int]:
+    if path.endswith('.zarr'):
+        import zarr
+        arr = zarr.open(path, mode='r')
+        shape, nchannels = arr.shape[:2], arr.shape[2]
+
+        def read_window(window):
+            return arr[window[0], window[1], :]
+
+        def read_channel(c):
+            return arr[:, :, c]
+    else:
+        with tif.TiffFile(path) as TF:
+            shape, nchannels = TF.pages[0].shape[:2], TF.pages[0].shape[2]
+
+        def read_window(window):
+            return read_tiff_window(path, window)
+
+        def read_channel(c):
+            return read_tiff_window(path, (slice(0, shape[0]), slice(0, shape[1])))[:, :, c]
+
+    return read_window, read_channel, shape, nchannels
+
+
+def time_calls(func: Callable, args: list, repeat: int) -> float:
+    """ Median over repeats of total time of calling func for every argument, in seconds """
+    timings = []
+    for _ in range(0, repeat):
+        start = time.perf_counter()
+        for arg in args:
+            func(arg)
+        timings.append(time.perf_counter() - start)
+    return float(np.median(timings))
+
+
+def main(planar_path: str, interleaved_path: str, window_size: int, nwindows: int, repeat: int):
+    """ Compares reading all channels of random windows (per-cell quantification)
+        and reading whole channels (per-channel analysis) from both layouts.
+        Files are read through the page cache, so run on cold cache for disk-bound numbers.
+    """
+    layouts = {'planar': get_planar_readers(planar_path), 'interleaved': get_interleaved_readers(interleaved_path)}
+    shape, nchannels = layouts['planar'][2], layouts['planar'][3]
+    windows = get_random_windows(shape, window_size, nwindows)
+    channels = list(range(0, nchannels))
+
+    read_window, read_channel = layouts['planar'][0], layouts['interleaved'][0]
+    if not all(np.array_equal(read_window(w), read_channel(w)) for w in windows[:2]):
+        raise ValueError('Files contain different data')
+
+    print('layout', 'all channels of ' + str(nwindows) + ' windows ' + str(window_size) + 'px, s',
+          'every channel whole, s', sep='\t')
+    for name, (read_window, read_channel, _, _) in layouts.items():
+        print(name, '{:.4f}'.format(time_calls(read_window, windows, repeat)),
+              '{:.4f}'.format(time_calls(read_channel, channels, repeat)), sep='\t')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--planar_path', type=str, required=True, help='path to combined MxIF with planar layout')
+    parser.add_argument('--interleaved_path', type=str, required=True,
+                        help='path to the same image with interleaved layout, .ome.tiff or .zarr')
+    parser.add_argument('--window_size', type=int, default=256, help='size of read window, default 256')
+    parser.add_argument('--nwindows', type=int, default=100, help='number of random windows, default 100')
+    parser.add_argument('--repeat', type=int, default=3, help='number of repeats, median is reported, default 3')
+    args = parser.parse_args()
+
+    main(args.planar_path, args.interleaved_path, args.window_size, args.nwindows, args.repeat)
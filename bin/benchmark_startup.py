@@ -0,0 +1,86 @@
+import argparse
+import json
+import os.path as osp
+import subprocess
+import sys
+import time
+from typing import List
+
+from ims_pipeline import COMMANDS
+
+PIPELINE_CLI = osp.join(osp.dirname(osp.abspath(__file__)), 'ims_pipeline.py')
+
+# seconds over startup of bare interpreter, commands that need only numpy and tifffile to start fit into it,
+# commands that import dask or scipy at module level do not
+DEFAULT_BUDGET_S = 0.3
+
+
+def time_command(args: List[str], repeat: int) -> float:
+    """ Median wall time of running the command in a fresh interpreter, in seconds """
+    timings = []
+    for _ in range(0, repeat):
+        start = time.perf_counter()
+        subprocess.run(args, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        timings.append(time.perf_counter() - start)
+    return sorted(timings)[len(timings) // 2]
+
+
+def get_slowest_imports(command: str, top: int) -> List[tuple]:
+    """ Top level imports with the largest cumulative time from python -X importtime, in seconds """
+    res = subprocess.run([sys.executable, '-X', 'importtime', PIPELINE_CLI, command, '--help'],
+                         stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, check=True)
+    imports = []
+    for line in res.stderr.decode('utf-8').splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        # nested imports are indented, only top level imports are kept
+        if not name.startswith('  '):
+            imports.append((name.strip(), int(cumulative) / 1e6))
+    return sorted(imports, key=lambda i: i[1], reverse=True)[:top]
+
+
+def main(commands: List[str] = None, repeat: int = 5, out_path: str = None, show_imports: int = 0,
+         budget: float = DEFAULT_BUDGET_S) -> List[str]:
+    """ Startup time of every command is measured with --help, so only imports and argument parsing are timed.
+        Returns commands that start slower than bare interpreter plus budget seconds.
+    """
+    commands = list(COMMANDS.keys()) if commands is None else commands
+    results = {'python': time_command([sys.executable, '-c', 'pass'], repeat),
+               'ims_pipeline': time_command([sys.executable, PIPELINE_CLI, '--help'], repeat)}
+    for command in commands:
+        results[command] = time_command([sys.executable, PIPELINE_CLI, command, '--help'], repeat)
+    over_budget = [command for command, seconds in results.items() if seconds - results['python'] > budget]
+
+    print('command', 'startup_s', 'budget_s', sep='\t')
+    for command, seconds in results.items():
+        print(command, '{:.3f}'.format(seconds), '{:.3f}'.format(results['python'] + budget),
+              'OVER' if command in over_budget else '', sep='\t')
+        if show_imports > 0 and command in COMMANDS:
+            for name, cumulative in get_slowest_imports(command, show_imports):
+                print('', name, '{:.3f}'.format(cumulative), sep='\t')
+    print(len(over_budget), 'commands over budget of', budget, 's over interpreter startup')
+
+    if out_path is not None:
+        with open(out_path, 'w') as s:
+            json.dump({'python_version': sys.version.split()[0], 'repeat': repeat, 'budget_s': budget,
+                       'startup_s': results, 'over_budget': over_budget}, s, indent=4)
+    return over_budget
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--commands', type=str, nargs='+', default=None, choices=list(COMMANDS.keys()),
+                        help='commands to measure, default all')
+    parser.add_argument('--repeat', type=int, default=5, help='number of runs, median is reported, default 5')
+    parser.add_argument('--out_path', type=str, default=None, help='path to JSON file to save results')
+    parser.add_argument('--show_imports', type=int, default=0,
+                        help='show this number of the slowest top level imports of every command')
+    parser.add_argument('--budget', type=float, default=DEFAULT_BUDGET_S,
+                        help='allowed startup time of a command over bare interpreter, in seconds, ' +
+                             'exit code is 1 if any command is over it. Default: ' + str(DEFAULT_BUDGET_S))
+    args = parser.parse_args()
+
+    over_budget = main(args.commands, args.repeat, args.out_path, args.show_imports, args.budget)
+    sys.exit(1 if over_budget else 0)
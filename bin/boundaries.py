@@ -0,0 +1,14 @@
+""" Boundaries of label images, shared by segmentation backends and stitcher """
+
+import numpy as np
+
+Image = np.ndarray
+
+
+def get_boundaries(labels: Image) -> Image:
+    """ Keeps label values only on pixels that touch another label or background """
+    padded = np.pad(labels, 1, mode='edge')
+    center = padded[1:-1, 1:-1]
+    is_boundary = ((center != padded[:-2, 1:-1]) | (center != padded[2:, 1:-1]) |
+                   (center != padded[1:-1, :-2]) | (center != padded[1:-1, 2:]))
+    return np.where(is_boundary, labels, 0).astype(labels.dtype)
@@ -0,0 +1,139 @@
+import argparse
+import json
+import os.path as osp
+import re
+import xml.etree.ElementTree as ET
+from typing import List, Union
+
+import numpy as np
+
+import storage
+
+Image = np.ndarray
+
+# ims_combined_multilayer.ome.tiff -> ims_combined_multilayer.channel_index.json
+INDEX_SUFFIX = '.channel_index.json'
+
+MZ_PATTERN = re.compile(r'^\s*(?:m/?z\s*)?([0-9]*\.?[0-9]+)\s*$', re.IGNORECASE)
+
+
+def get_index_path(tiff_path: str) -> str:
+    return storage.get_sidecar_path(tiff_path, INDEX_SUFFIX)
+
+
+def get_channel_names_from_ome(ome_meta: str) -> List[str]:
+    xml = ET.fromstring(ome_meta.encode('utf-8') if isinstance(ome_meta, str) else ome_meta)
+    return [el.get('Name') for el in xml.iter() if el.tag.rpartition('}')[2] == 'Channel']
+
+
+def parse_mz(name: str) -> Union[float, None]:
+    """ IMS channels are named by m/z value, e.g. 885.5498 or mz 885.5498 """
+    if name is None:
+        return None
+    match = MZ_PATTERN.match(name)
+    return float(match.group(1)) if match is not None else None
+
+
+def create_channel_index(tiff_path: str, channel_names: List[str], stats: List[dict] = None) -> dict:
+    """ Collects position of every page in the file, only IFDs are read, pixel data is not touched.
+        stats - optional statistics of every channel computed while the file was written
+    """
+    channels = []
+    with storage.open_tiff(tiff_path) as TF:
+        byteorder = TF.byteorder
+        if len(TF.pages) != len(channel_names):
+            raise ValueError('File has ' + str(len(TF.pages)) + ' pages, but ' + str(len(channel_names)) +
+                             ' channel names are given')
+        for ifd, (page, name) in enumerate(zip(TF.pages, channel_names)):
+            channels.append({'name': name,
+                             'mz': parse_mz(name),
+                             'ifd': ifd,
+                             'shape': list(page.shape),
+                             'dtype': page.dtype.str.lstrip('<>|='),
+                             'compression': int(page.compression),
+                             'contiguous': bool(page.is_memmappable),
+                             'offsets': [int(o) for o in page.dataoffsets],
+                             'bytecounts': [int(b) for b in page.databytecounts]
+                             })
+            if stats is not None:
+                channels[-1]['stats'] = stats[ifd]
+    index = {'file': osp.basename(tiff_path), 'byteorder': byteorder, 'channels': channels}
+    return index
+
+
+def write_channel_index(index: dict, out_path: str):
+    with open(out_path, 'w') as s:
+        json.dump(index, s, separators=(',', ':'))
+
+
+def read_channel_index(path: str) -> dict:
+    with storage.open_file(path, 'r') as s:
+        index = json.load(s)
+    return index
+
+
+def write_index_for_file(tiff_path: str, channel_names: List[str], stats: List[dict] = None) -> str:
+    index_path = get_index_path(tiff_path)
+    write_channel_index(create_channel_index(tiff_path, channel_names, stats), index_path)
+    return index_path
+
+
+def find_channel(index: dict, channel: Union[str, float], tolerance: float = 0.001) -> dict:
+    """ channel - channel name or m/z value, the closest m/z within tolerance is taken """
+    if isinstance(channel, str):
+        for ch in index['channels']:
+            if ch['name'] == channel:
+                return ch
+        raise KeyError('Channel ' + channel + ' is not in the index')
+
+    mz_channels = [ch for ch in index['channels'] if ch['mz'] is not None]
+    if mz_channels != []:
+        closest = min(mz_channels, key=lambda ch: abs(ch['mz'] - channel))
+        if abs(closest['mz'] - channel) <= tolerance:
+            return closest
+    raise KeyError('No channel with m/z ' + str(channel) + ' +- ' + str(tolerance))
+
+
+def read_channel_stats(tiff_path: str, channel: Union[str, float], index: dict = None,
+                       tolerance: float = 0.001) -> dict:
+    """ Returns min, max, mean, quantiles and histogram saved when the file was combined """
+    if index is None:
+        index = read_channel_index(get_index_path(tiff_path))
+    ch = find_channel(index, channel, tolerance)
+    if 'stats' not in ch:
+        raise KeyError('Channel index has no statistics')
+    return ch['stats']
+
+
+def read_channel(tiff_path: str, channel: Union[str, float], index: dict = None, tolerance: float = 0.001) -> Image:
+    """ Returns one channel of the combined file without parsing OME-XML or other IFDs.
+        Uncompressed contiguous pages are memory-mapped, or read with one ranged request from object store,
+        other pages are decoded with tifffile.
+    """
+    if index is None:
+        index = read_channel_index(get_index_path(tiff_path))
+    ch = find_channel(index, channel, tolerance)
+    if ch['contiguous']:
+        dtype = np.dtype(ch['dtype']).newbyteorder(index['byteorder'])
+        if storage.is_remote(tiff_path):
+            with storage.open_file(tiff_path, 'rb') as s:
+                s.seek(ch['offsets'][0])
+                data = s.read(int(np.prod(ch['shape'])) * dtype.itemsize)
+            return np.frombuffer(data, dtype=dtype).reshape(ch['shape'])
+        return np.memmap(tiff_path, dtype=dtype, mode='r', offset=ch['offsets'][0], shape=tuple(ch['shape']))
+    return storage.imread(tiff_path, key=ch['ifd'])
+
+
+def main(tiff_path: str):
+    with storage.open_tiff(tiff_path) as TF:
+        channel_names = get_channel_names_from_ome(TF.pages[0].description)
+    index_path = write_index_for_file(tiff_path, channel_names)
+    print('channel index written to', index_path)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-i', type=str, required=True, help='path to OME-TIFF, e.g. ims_combined_multilayer.ome.tiff')
+    args = parser.parse_args()
+
+    main(args.i)
@@ -0,0 +1,97 @@
+from typing import List
+from xml.sax.saxutils import escape
+
+import numpy as np
+import tifffile as tif
+
+Image = np.ndarray
+
+HISTOGRAM_BINS = 256
+QUANTILES = [0.01, 0.05, 0.5, 0.95, 0.99]
+STATS_NAMESPACE = 'ims_pipeline/channel_stats'
+
+
+def get_channel_stats(img: Image, nbins: int = HISTOGRAM_BINS) -> dict:
+    """ Min, max, mean and histogram of one channel, quantiles are approximated from the histogram.
+        Computed from the page that is already in memory for writing, so no extra read is needed.
+    """
+    img_min = float(img.min())
+    img_max = float(img.max())
+    counts, _ = np.histogram(img, bins=nbins, range=(img_min, img_max if img_max > img_min else img_min + 1))
+    stats = {'min': img_min,
+             'max': img_max,
+             'mean': float(img.mean(dtype=np.float64)),
+             'quantiles': get_quantiles_from_histogram(counts, img_min, img_max, QUANTILES),
+             'histogram': {'range': [img_min, img_max], 'counts': counts.tolist()}
+             }
+    return stats
+
+
+def get_quantiles_from_histogram(counts: np.ndarray, hist_min: float, hist_max: float, quantiles: List[float]) -> dict:
+    """ Linear interpolation inside the bin where cumulative count reaches the quantile """
+    cumulative = np.cumsum(counts) / max(counts.sum(), 1)
+    bin_width = (hist_max - hist_min) / len(counts)
+    values = dict()
+    for q in quantiles:
+        b = min(int(np.searchsorted(cumulative, q)), len(counts) - 1)
+        previous = cumulative[b - 1] if b > 0 else 0.0
+        fraction = (q - previous) / (cumulative[b] - previous) if cumulative[b] > previous else 0.0
+        values[str(q)] = float(hist_min + (b + fraction) * bin_width)
+    return values
+
+
+def format_value(value: float) -> str:
+    return '{:.9g}'.format(value)
+
+
+def get_stats_annotations(channel_names: List[str], stats: List[dict]) -> str:
+    """ One OME MapAnnotation per channel, histogram is only stored in the channel index """
+    annotations = []
+    for c, (name, ch_stats) in enumerate(zip(channel_names, stats)):
+        values = [('channel', 'Channel:0:' + str(c)), ('name', escape(str(name)))]
+        values.extend((key, format_value(ch_stats[key])) for key in ('min', 'max', 'mean'))
+        values.extend(('q' + q, format_value(v)) for q, v in ch_stats['quantiles'].items())
+        annotations.append('<MapAnnotation ID="Annotation:ChannelStats:{c}" Namespace="{ns}"><Value>{values}</Value>'
+                           '</MapAnnotation>'.format(c=c, ns=STATS_NAMESPACE,
+                                                     values=''.join('<M K="{k}">{v}</M>'.format(k=k, v=v)
+                                                                    for k, v in values)))
+    return ''.join(annotations)
+
+
+def add_stats_to_ome(ome_meta: str, channel_names: List[str], stats: List[dict]) -> str:
+    annotations = get_stats_annotations(channel_names, stats)
+    end = ome_meta.rfind('</StructuredAnnotations>')
+    if end != -1:
+        return ome_meta[:end] + annotations + ome_meta[end:]
+    end = ome_meta.rfind('</OME>')
+    return ome_meta[:end] + '<StructuredAnnotations>' + annotations + '</StructuredAnnotations>' + ome_meta[end:]
+
+
+def get_placeholder_stats() -> dict:
+    """ Statistics with the longest possible text representation """
+    longest = -1.23456789e-300
+    return {'min': longest, 'max': longest, 'mean': longest, 'quantiles': {str(q): longest for q in QUANTILES}}
+
+
+def reserve_ome_meta(ome_meta: str, channel_names: List[str]) -> str:
+    """ OME-XML padded with spaces, so it can be replaced with OME-XML with statistics after all pages are written """
+    nbytes = len(add_stats_to_ome(ome_meta, channel_names, [get_placeholder_stats()] * len(channel_names)).encode())
+    return ome_meta + ' ' * (nbytes - len(ome_meta.encode()))
+
+
+def overwrite_ome_meta(path: str, ome_meta: str):
+    """ Replaces ImageDescription of the first page in place, new description must fit into the reserved one """
+    with tif.TiffFile(path) as TF:
+        tag = TF.pages[0].tags['ImageDescription']
+        offset, count = tag.valueoffset, tag.count
+    new_value = ome_meta.encode('ascii', errors='ignore')
+    # last byte of the tag is the null terminator
+    if len(new_value) > count - 1:
+        raise ValueError('New OME-XML is longer than the reserved space')
+    with open(path, 'r+b') as f:
+        f.seek(offset)
+        f.write(new_value.ljust(count - 1, b' '))
+
+
+def write_stats_to_ome(path: str, ome_meta: str, channel_names: List[str], stats: List[dict]):
+    overwrite_ome_meta(path, add_stats_to_ome(ome_meta, channel_names, stats))
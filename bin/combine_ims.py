@@ -1,25 +1,14 @@
 import argparse
 import xml.etree.ElementTree as ET
-from io import StringIO
 import copy
 
 import tifffile as tif
 
-
-def read_ome_meta(path: str):
-    with tif.TiffFile(path) as TF:
-        # ims_shape = TF.series[0].shape
-        ims_ome_meta = TF.ome_metadata
-
-    return ims_ome_meta
-
-
-def strip_namespace(xmlstr: str):
-    it = ET.iterparse(StringIO(xmlstr))
-    for _, el in it:
-        _, _, el.tag = el.tag.rpartition('}')
-    root = it.root
-    return root
+from memmap_output import create_memmap_output, copy_pages_to_memmap, get_plane_shape_and_dtype
+from ome_meta import read_ome_meta, strip_namespace
+from channel_index import write_index_for_file
+from channel_stats import get_channel_stats, reserve_ome_meta, write_stats_to_ome
+import storage
 
 
 def get_all_channels_and_tiffdata(xml):
@@ -34,7 +23,8 @@ def create_new_xml_from_combined_metadata(positive_xml, negative_xml):
     num_neg_ch, neg_ch = get_all_channels_and_tiffdata(negative_xml)
     combined_xml = copy.copy(positive_xml)
 
-    for child_node in combined_xml.find('Image').find('Pixels'):
+    # list is needed, removing children while iterating over the element skips every second child
+    for child_node in list(combined_xml.find('Image').find('Pixels')):
         combined_xml.find('Image').find('Pixels').remove(child_node)
 
     total_channels = num_pos_ch + num_neg_ch
@@ -55,7 +45,7 @@ def create_new_xml_from_combined_metadata(positive_xml, negative_xml):
     tiff_data_list = []
     for ch_id in range(0, total_channels):
         new_id = str(ch_id)
-        new_tiff_data = copy.copy(tiff_data)
+        new_tiff_data = copy.deepcopy(tiff_data)
         new_tiff_data.set('FirstC', new_id)
         new_tiff_data.set('IFD', new_id)
         tiff_data_list.append(new_tiff_data)
@@ -73,23 +63,42 @@ def create_new_xml_from_combined_metadata(positive_xml, negative_xml):
     final_combined_xml_str = combined_xml_str.decode('ascii', errors='ignore')
     final_combined_xml_str = xml_declaration + final_combined_xml_str
 
-    return final_combined_xml_str, num_pos_ch, num_neg_ch
+    channel_names = [c.get('Name') for c in pos_ch]
+    return final_combined_xml_str, num_pos_ch, num_neg_ch, channel_names
 
 
-def main(ims_pos_path: str, ims_neg_path: str, ims_combined_out_path: str):
+def main(ims_pos_path: str, ims_neg_path: str, ims_combined_out_path: str, use_memmap: bool = False):
     pos_xml_str = read_ome_meta(ims_pos_path)
     neg_xml_str = read_ome_meta(ims_neg_path)
 
     pos_xml = strip_namespace(pos_xml_str)
     neg_xml = strip_namespace(neg_xml_str)
 
-    combined_xml, num_pos_ch, num_neg_ch = create_new_xml_from_combined_metadata(pos_xml, neg_xml)
-
-    with tif.TiffWriter(ims_combined_out_path, bigtiff=True) as TW:
-        for i in range(0, num_pos_ch):
-            TW.save(tif.imread(ims_pos_path, key=i), photometric='minisblack', description=combined_xml)
-        for i in range(0, num_neg_ch):
-            TW.save(tif.imread(ims_neg_path, key=i), photometric='minisblack', description=combined_xml)
+    combined_xml, num_pos_ch, num_neg_ch, channel_names = create_new_xml_from_combined_metadata(pos_xml, neg_xml)
+
+    page_list = [(ims_pos_path, i) for i in range(0, num_pos_ch)]
+    page_list.extend([(ims_neg_path, i) for i in range(0, num_neg_ch)])
+    # statistics are added to OME-XML of the first page after all pages are written
+    reserved_xml = reserve_ome_meta(combined_xml, channel_names)
+
+    # TIFF is written with seeks, so output for object store is written locally and uploaded with sidecars
+    with storage.local_output(ims_combined_out_path) as out_path:
+        if use_memmap:
+            plane_shape, dtype = get_plane_shape_and_dtype(ims_pos_path)
+            # returned memory map is not kept, pages are filled by the workers
+            create_memmap_output(out_path, (len(page_list),) + plane_shape, dtype, reserved_xml)
+            stats = copy_pages_to_memmap(page_list, out_path, compute_stats=True)
+        else:
+            stats = []
+            with tif.TiffWriter(out_path, bigtiff=True) as TW:
+                for n, (path, page) in enumerate(page_list):
+                    img = storage.imread(path, key=page)
+                    TW.save(img, photometric='minisblack', description=reserved_xml if n == 0 else combined_xml)
+                    stats.append(get_channel_stats(img))
+
+        write_stats_to_ome(out_path, combined_xml, channel_names, stats)
+        # sidecar with position and statistics of every channel in the file
+        write_index_for_file(out_path, channel_names, stats)
 
 
 if __name__ == '__main__':
@@ -98,6 +107,8 @@ if __name__ == '__main__':
     parser.add_argument('--ims_neg_path', type=str, help='path to negative IMS OME-TIFF')
     parser.add_argument('--ims_combined_out_path', type=str,
                         help='path to output combined positive and negative OME-TIFF')
+    parser.add_argument('--memmap', action='store_true',
+                        help='copy pages directly into memory-mapped uncompressed output file')
     args = parser.parse_args()
 
-    main(args.ims_pos_path, args.ims_neg_path, args.ims_combined_out_path)
+    main(args.ims_pos_path, args.ims_neg_path, args.ims_combined_out_path, args.memmap)
@@ -1,25 +1,19 @@
 import argparse
 import xml.etree.ElementTree as ET
-from io import StringIO
 import copy
 
 import tifffile as tif
 
+from memmap_output import create_memmap_output, copy_pages_to_memmap, get_plane_shape_and_dtype
+from ome_meta import read_ome_meta, strip_namespace
+from channel_index import write_index_for_file
+from channel_stats import get_channel_stats, reserve_ome_meta, write_stats_to_ome
+from interleaved_output import write_interleaved_tiff, write_interleaved_zarr
+import storage
 
-def read_ome_meta(path: str):
-    with tif.TiffFile(path) as TF:
-        # ims_shape = TF.series[0].shape
-        ims_ome_meta = TF.ome_metadata
-
-    return ims_ome_meta
-
-
-def strip_namespace(xmlstr: str):
-    it = ET.iterparse(StringIO(xmlstr))
-    for _, el in it:
-        _, _, el.tag = el.tag.rpartition('}')
-    root = it.root
-    return root
+# planar - one page per channel, interleaved - tiled page with all channels of a tile next to each other,
+# zarr - Zarr array with (tile_y, tile_x, channel) chunks
+LAYOUTS = ['planar', 'interleaved', 'zarr']
 
 
 def get_all_channels_and_tiffdata(xml):
@@ -60,7 +54,8 @@ def create_new_xml_from_combined_metadata(old_xml, metadata_per_cycle):
 
     for attr, val in proper_ome_attribs.items():
         combined_xml.set(attr, val)
-    for child_node in combined_xml.find('Image').find('Pixels'):
+    # list is needed, removing children while iterating over the element skips every second child
+    for child_node in list(combined_xml.find('Image').find('Pixels')):
         combined_xml.find('Image').find('Pixels').remove(child_node)
 
     tiff_data = ET.Element('TiffData', dict(FirstC="0", FirstT="0", FirstZ="0", IFD="0", PlaneCount="1"))
@@ -113,12 +108,13 @@ def get_values_from_sorted_dict(dictionary: dict):
 
 
 def get_number_of_tiff_pages(file_path):
-    with tif.TiffFile(file_path) as TF:
+    with storage.open_tiff(file_path) as TF:
         npages = len(TF.pages)
     return npages
 
 
-def main(pipeline_config: dict, mxif_data_paths: list, mxif_combined_out_path: str):
+def main(pipeline_config: dict, mxif_data_paths: list, mxif_combined_out_path: str, use_memmap: bool = False,
+         layout: str = 'planar'):
 
     nuclei_channel_id_per_cycle = pipeline_config['submission']['nuclei_channel_id_per_cycle']
     nuclei_channel_id_list = get_values_from_sorted_dict(nuclei_channel_id_per_cycle)
@@ -127,14 +123,45 @@ def main(pipeline_config: dict, mxif_data_paths: list, mxif_combined_out_path: s
     first_cycle_xml = strip_namespace(read_ome_meta(mxif_data_paths[0]))
     metadata_per_cycle = filter_redundant_nuclei_channels(mxif_data_paths, nuclei_channel_id_list)
     combined_xml, combined_meta = create_new_xml_from_combined_metadata(first_cycle_xml, metadata_per_cycle)
+    channel_names = [c.get('Name') for meta in combined_meta for c in meta['channels']]
 
-    with tif.TiffWriter(mxif_combined_out_path, bigtiff=True) as TW:
-        for i, data_path in enumerate(mxif_data_paths):
-            npages = get_number_of_tiff_pages(data_path)
-            redundant_nuclei_channel_id = nuclei_channel_id_list[i]
-            for page in range(0, npages):
-                if page != redundant_nuclei_channel_id:
-                    TW.save(tif.imread(data_path, key=page), photometric='minisblack', description=combined_xml)
+    page_list = []
+    for i, data_path in enumerate(mxif_data_paths):
+        npages = get_number_of_tiff_pages(data_path)
+        redundant_nuclei_channel_id = nuclei_channel_id_list[i]
+        page_list.extend([(data_path, page) for page in range(0, npages) if page != redundant_nuclei_channel_id])
+
+    # TIFF is written with seeks, so output for object store is written locally and uploaded with sidecars
+    with storage.local_output(mxif_combined_out_path) as out_path:
+        # channel index and statistics describe one page per channel, they are written only for planar layout
+        if layout == 'interleaved':
+            write_interleaved_tiff(page_list, out_path, combined_xml)
+            return
+        elif layout == 'zarr':
+            write_interleaved_zarr(page_list, out_path, channel_names)
+            return
+        elif layout != 'planar':
+            raise ValueError('Unknown layout ' + layout + ', available: ' + ', '.join(LAYOUTS))
+
+        # statistics are added to OME-XML of the first page after all pages are written
+        reserved_xml = reserve_ome_meta(combined_xml, channel_names)
+
+        if use_memmap:
+            plane_shape, dtype = get_plane_shape_and_dtype(mxif_data_paths[0])
+            # returned memory map is not kept, pages are filled by the workers
+            create_memmap_output(out_path, (len(page_list),) + plane_shape, dtype, reserved_xml)
+            stats = copy_pages_to_memmap(page_list, out_path, compute_stats=True)
+        else:
+            stats = []
+            with tif.TiffWriter(out_path, bigtiff=True) as TW:
+                for n, (data_path, page) in enumerate(page_list):
+                    img = storage.imread(data_path, key=page)
+                    TW.save(img, photometric='minisblack', description=reserved_xml if n == 0 else combined_xml)
+                    stats.append(get_channel_stats(img))
+
+        write_stats_to_ome(out_path, combined_xml, channel_names, stats)
+        # sidecar with position and statistics of every channel in the file
+        write_index_for_file(out_path, channel_names, stats)
 
 
 if __name__ == '__main__':
@@ -1,32 +1,32 @@
-import os
-import os.path as osp
 import re
 
+import storage
+
 
 def get_proc_micro_file_location(dataset_dir: str):
     allowed_extensions = ('.tif', '.tiff')
-    file_list = [fn for fn in os.listdir(dataset_dir) if fn.endswith(allowed_extensions)]
+    file_list = [fn for fn in storage.listdir(dataset_dir) if fn.endswith(allowed_extensions)]
     if file_list == []:
         return None
     else:
-        return osp.join(dataset_dir, file_list[0])
+        return storage.join(dataset_dir, file_list[0])
 
 
 def get_file_locations(base_dir: str):
-    proc_micro_path = osp.join(base_dir, 'processedMicroscopy')
-    raw_micro_path = osp.join(base_dir, 'rawMicroscopy')
+    proc_micro_path = storage.join(base_dir, 'processedMicroscopy')
+    raw_micro_path = storage.join(base_dir, 'rawMicroscopy')
 
-    proc_micro_dirs = os.listdir(proc_micro_path)
-    raw_micro_files = os.listdir(raw_micro_path)
+    proc_micro_dirs = storage.listdir(proc_micro_path)
+    raw_micro_files = storage.listdir(raw_micro_path)
     # current naming patterns:
     # processedMicroscopy/VAN0003-LK-32-22-MxIF_cyc1_images/VAN0003-LK-32-22-MxIF_cyc1_registered.ome.tiff
     # rawMicroscopy/VAN0003-LK-32-22-MxIF_cyc1_unregistered.czi
-    full_path_proc_micro_dirs = [osp.join(base_dir, 'processedMicroscopy', path) for path in proc_micro_dirs if
+    full_path_proc_micro_dirs = [storage.join(base_dir, 'processedMicroscopy', path) for path in proc_micro_dirs if
                                  'images' in path]
     full_path_proc_micro_files = [get_proc_micro_file_location(path) for path in full_path_proc_micro_dirs]
     full_path_proc_micro_files = [path for path in full_path_proc_micro_files if path is not None]
 
-    full_path_raw_micro_files = [osp.join(base_dir, 'rawMicroscopy', path) for path in raw_micro_files if path.lower().endswith('czi')]
+    full_path_raw_micro_files = [storage.join(base_dir, 'rawMicroscopy', path) for path in raw_micro_files if path.lower().endswith('czi')]
 
     return full_path_proc_micro_files, full_path_raw_micro_files
 
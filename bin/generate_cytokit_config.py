@@ -1,8 +1,11 @@
+import copy
 import datetime
 import argparse
 
 import yaml
 
+from shards import get_shard_config_path, get_local_tile_indexes
+
 
 def read_slicer_meta(slicer_meta: dict):
 
@@ -85,6 +88,10 @@ def main(pipeline_config_path: str, cytokit_config_path: str):
     acq_meta.update(slicer_meta)
     acq_meta.update(ome_meta)
 
+    # slicer already selected one z-plane per tile
+    if 'best_focus_z' in pipeline_config['slicer_meta']:
+        acq_meta['num_z_planes'] = 1
+
     submission = pipeline_config['submission']
 
     head_meta = {"name": submission['experiment_name'],
@@ -92,6 +99,13 @@ def main(pipeline_config_path: str, cytokit_config_path: str):
                  "environemnt": {"path_formats": "keyence_multi_cycle_v01"}}
 
     processor_meta = generate_processor_meta(acq_meta, submission)
+
+    # process only tiles with tissue, tile indexes in cytokit are 0-based
+    empty_tiles = set(pipeline_config['slicer_meta'].get('empty_tiles', []))
+    if empty_tiles != set():
+        ntiles = slicer_meta['region_width'] * slicer_meta['region_height']
+        tile_indexes = [t - 1 for t in range(1, ntiles + 1) if t not in empty_tiles]
+        processor_meta['processor']['args']['tile_indexes'] = tile_indexes
     acquisition_meta = {'acquisition': acq_meta}
 
     cytokit_config = dict()
@@ -102,6 +116,19 @@ def main(pipeline_config_path: str, cytokit_config_path: str):
     with open(cytokit_config_path, 'w') as s:
         yaml.safe_dump(cytokit_config, stream=s, default_flow_style=False, indent=4, sort_keys=False)
 
+    # every shard is a separate tile grid with its own config
+    shard_rows = pipeline_config['slicer_meta'].get('shards', [])
+    for shard, (row_start, row_stop) in enumerate(shard_rows):
+        shard_config = copy.deepcopy(cytokit_config)
+        shard_config['acquisition']['region_height'] = row_stop - row_start
+        shard_config['processor']['args'].pop('tile_indexes', None)
+        if empty_tiles != set():
+            tile_indexes = get_local_tile_indexes(list(empty_tiles), slicer_meta['region_width'], row_start, row_stop)
+            shard_config['processor']['args']['tile_indexes'] = tile_indexes
+
+        with open(get_shard_config_path(cytokit_config_path, shard), 'w') as s:
+            yaml.safe_dump(shard_config, stream=s, default_flow_style=False, indent=4, sort_keys=False)
+
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
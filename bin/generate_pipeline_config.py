@@ -4,27 +4,21 @@ import os
 import os.path as osp
 import argparse
 import re
-import xml.etree.ElementTree as ET
-from io import StringIO
 
 import yaml
-import tifffile as tif
 
 from extract_meta import run_extract_meta
 from extract_from_names import extract_cycle_info_from_names
-
-
-def strip_namespace(xmlstr: str):
-    it = ET.iterparse(StringIO(xmlstr))
-    for _, el in it:
-        _, _, el.tag = el.tag.rpartition('}')
-    root = it.root
-    return root
+from ome_meta import strip_namespace
+import shards
+from tile_manifest import SEGMENTATION_REGION
+import tiling_planner
+import storage
 
 
 def get_img_info(img_path, block_size):
     if img_path.endswith(('tif', 'tiff')):
-        with tif.TiffFile(img_path) as TF:
+        with storage.open_tiff(img_path) as TF:
             npages = len(TF.pages)
             plane_shape = TF.series[0].shape
             try:
@@ -126,7 +120,8 @@ def extract_from_raw_meta(path: str):  #  ncycles: int, nregions: int
 
 def get_raw_meta(raw_img_path, meta_output_dir):
     raw_meta_path = osp.join(meta_output_dir, 'raw_meta.xml')
-    run_extract_meta.main(raw_img_path, raw_meta_path)
+    # bioformats reads only local files
+    run_extract_meta.main(storage.get_local_copy(raw_img_path, meta_output_dir), raw_meta_path)
     extracted_raw_meta = extract_from_raw_meta(raw_meta_path)
     return extracted_raw_meta
 
@@ -138,9 +133,49 @@ def get_slicer_meta(proc_img_path, cycle, region, block_size, overlap):
     return slicer_meta
 
 
-def get_meta_for_each_cycle(per_cycle_info, base_pipeline_dir, block_size, overlap):
+def get_empty_tiles(proc_img_path: str, nuclei_page: int, block_size: int, overlap: int) -> list:
+    import slicer
+
+    print('detecting tiles without tissue')
+    nuclei_plane = storage.imread(proc_img_path, key=nuclei_page)
+    empty_tiles = slicer.get_empty_tiles(nuclei_plane, block_size, block_size, overlap)
+    print('found', len(empty_tiles), 'tiles without tissue')
+    return empty_tiles
+
+
+def get_best_focus_z(proc_img_path: str, nuclei_channel_id: int, num_z_planes: int, block_size: int) -> list:
+    import slicer
+
+    print('selecting best focus z-plane for every tile')
+    best_focus_z = slicer.get_best_focus_z(proc_img_path, nuclei_channel_id, num_z_planes, block_size, block_size)
+    return best_focus_z
+
+
+def get_region(submission: dict, per_cycle_info: dict) -> int:
+    """ Region given in submission, or the first region of the first cycle """
+    first_cycle = min(list(per_cycle_info.keys()))
+    region = submission.get('region', None)
+    if region is None:
+        region = min(list(per_cycle_info[first_cycle].keys()))
+    for cycle, this_cycle_info in per_cycle_info.items():
+        if region not in this_cycle_info:
+            raise ValueError('Region ' + str(region) + ' is not found in cycle ' + str(cycle))
+    return region
+
+
+def get_tiling_plan(submission: dict, proc_img_path: str) -> dict:
+    """ Selects block size for the image and limits of the machine given in submission """
+    print('planning block size')
+    machine = tiling_planner.get_machine_limits(submission.get('max_ram_gb', None),
+                                                submission.get('gpu_memory_gb', None),
+                                                submission.get('ngpus', 1))
+    plan = tiling_planner.plan_tiling(proc_img_path, submission['overlap'], machine)
+    tiling_planner.print_plans(plan['plans'], plan['selected'])
+    return {'selected': plan['selected'], 'machine': machine}
+
+
+def get_meta_for_each_cycle(per_cycle_info, base_pipeline_dir, block_size, overlap, region=1):
     cycles = per_cycle_info.keys()
-    region = 1
 
     raw_meta_per_cycle = dict()
     slicer_meta_per_cycle = dict()
@@ -170,9 +205,18 @@ def main(submission: dict, base_pipeline_dir: str,  pipeline_config_path: str):
     mxif_dir = submission['mxif_dataset_dir_path']
 
     per_cycle_info = extract_cycle_info_from_names(mxif_dir)
-
-    raw_meta_per_cycle, slicer_meta_per_cycle = get_meta_for_each_cycle(per_cycle_info, base_pipeline_dir, block_size, overlap)
-    num_regions_for_segmentation = 1  # all data so far had only one region
+    region = get_region(submission, per_cycle_info)
+
+    # block size is selected by the planner and recorded in the submission part of pipeline config
+    tiling_plan = None
+    if submission.get('auto_block_size', False):
+        first_cycle = min(list(per_cycle_info.keys()))
+        tiling_plan = get_tiling_plan(submission, per_cycle_info[first_cycle][region]['proc_path'])
+        block_size = tiling_plan['selected']['block_size']
+        submission['block_size'] = block_size
+
+    raw_meta_per_cycle, slicer_meta_per_cycle = get_meta_for_each_cycle(per_cycle_info, base_pipeline_dir, block_size,
+                                                                         overlap, region)
     num_cycles_for_segmentation = 1
     cycles = per_cycle_info.keys()
     first_cycle = min(list(cycles))
@@ -192,35 +236,55 @@ def main(submission: dict, base_pipeline_dir: str,  pipeline_config_path: str):
     first_cycle_nuclei_channel_id = nuclei_channel_id_per_cycle[first_cycle]
     nuclei_channel_name = 'CH' + str(first_cycle_nuclei_channel_id + 1)
 
-    # collect paths of all mxif datasets
+    # collect paths of all mxif datasets of the region
     mxif_data_paths = []
     total_cycles = list(per_cycle_info.keys())
     for c in total_cycles:
-        this_cycle_info = per_cycle_info[c]
-        regions = list(this_cycle_info.keys())
-        for r in regions:
-            proc_img_path = this_cycle_info[r]['proc_path']
-            mxif_data_paths.append(proc_img_path)
+        proc_img_path = per_cycle_info[c][region]['proc_path']
+        mxif_data_paths.append(proc_img_path)
 
     # create general slicer meta
     remove_keys = ['image_name', 'cycle', 'region']
     general_slicer_meta = {key: val for key, val in first_cycle_slicer_meta.items() if key not in remove_keys}
 
+    # tiles without tissue will not be sliced, segmented and read by stitcher
+    if submission.get('skip_empty_tiles', False):
+        nuclei_page = first_cycle_nuclei_channel_id * first_cycle_raw_meta['num_z_planes']
+        general_slicer_meta['empty_tiles'] = get_empty_tiles(per_cycle_info[first_cycle][region]['proc_path'],
+                                                             nuclei_page, block_size, overlap)
+
+    # slicer will write only the sharpest z-plane of every tile, instead of Cytokit best focus on GPU
+    num_z_planes = first_cycle_raw_meta['num_z_planes']
+    if submission.get('preselect_best_focus', False) and num_z_planes > 1:
+        general_slicer_meta['best_focus_z'] = get_best_focus_z(per_cycle_info[first_cycle][region]['proc_path'],
+                                                               first_cycle_nuclei_channel_id, num_z_planes, block_size)
+
+    # tile rows are partitioned into shards, each shard is segmented with its own Cytokit config
+    nshards = submission.get('nshards', 1)
+    if nshards is not None and nshards > 1:
+        shard_rows = shards.get_shard_rows(general_slicer_meta['nblocks']['y'], nshards)
+        general_slicer_meta['shards'] = [list(rows) for rows in shard_rows]
+
     # create general ome meta
     general_ome_meta = first_cycle_raw_meta
     general_ome_meta['channel_names'] = [submission['nuclei_channel']]
     general_ome_meta['per_cycle_channel_names'] = [nuclei_channel_name]
     general_ome_meta['emission_wavelengths'] = [first_cycle_raw_meta['emission_wavelengths'][first_cycle_nuclei_channel_id]]
-    general_ome_meta['region_names'] = ['reg' + str(i) for i in range(1, num_regions_for_segmentation + 1)]
+    # one region per pipeline run, other regions are processed in separate runs,
+    # selected region is sliced as the only region of Cytokit config
+    general_ome_meta['region_names'] = ['reg' + str(SEGMENTATION_REGION)]
     general_ome_meta['num_cycles'] = num_cycles_for_segmentation
 
     submission['nuclei_channel_id_per_cycle'] = nuclei_channel_id_per_cycle
+    submission['region'] = region
 
     # combine all metadata into pipeline config
     pipeline_config = dict()
     pipeline_config['submission'] = submission
     pipeline_config['ome_meta'] = general_ome_meta
     pipeline_config['slicer_meta'] = general_slicer_meta
+    if tiling_plan is not None:
+        pipeline_config['tiling_plan'] = tiling_plan
 
     with open(pipeline_config_path, 'w') as s:
         yaml.safe_dump(pipeline_config, stream=s, default_flow_style=False, indent=4, sort_keys=False)
@@ -0,0 +1,58 @@
+""" Single entry point for all pipeline steps: python ims_pipeline.py <command> [arguments of the command].
+    Only the module of the selected command is imported, so every command starts as fast as its own script.
+"""
+
+import os.path as osp
+import runpy
+import sys
+
+# command: (module in bin, description)
+COMMANDS = {'preflight': ('preflight', 'check headers of all inputs of submission before running'),
+            'initiate': ('initiate_pipeline', 'generate pipeline and Cytokit configs from submission'),
+            'slice': ('run_slicer', 'split nuclei channel into tiles for segmentation'),
+            'segment': ('segmentation', 'segment tiles on CPU'),
+            'run_shards': ('run_shards', 'run segmentation command for every shard'),
+            'stitch': ('run_stitcher', 'stitch segmented tiles into mask'),
+            'combine_ims': ('run_combine_ims', 'combine positive and negative IMS'),
+            'combine_mxif': ('run_combine_mxif', 'combine MxIF cycles'),
+            'batch': ('run_batch', 'run pipeline for several submissions and regions'),
+            'plan': ('tiling_planner', 'recommend block size for image and machine'),
+            'autotune': ('autotune', 'tune workers and prefetch of slicer and stitcher, save to profile'),
+            'restitch': ('incremental_stitcher', 'stitch changed tiles into existing mask'),
+            'rle': ('label_rle', 'run-length encode label mask with object index'),
+            'features': ('object_features', 'per-cell mean intensity of multichannel image'),
+            'ims_features': ('ims_resampling', 'per-cell mean IMS values on mask grid'),
+            'spectra': ('ims_spectra', 'store tissue pixels of IMS as sparse spectra'),
+            'channel_index': ('channel_index', 'write channel index sidecar for OME-TIFF'),
+            'benchmark_layout': ('benchmark_layout', 'compare planar and interleaved MxIF layouts'),
+            'benchmark_startup': ('benchmark_startup', 'measure startup time of commands'),
+            }
+
+
+def print_usage():
+    print('usage: ims_pipeline.py <command> [arguments]\n\ncommands:')
+    for command, (_, description) in COMMANDS.items():
+        print('  {:<18}{}'.format(command, description))
+
+
+def main(argv: list):
+    if len(argv) == 0 or argv[0] in ('-h', '--help'):
+        print_usage()
+        return 0
+    command = argv[0]
+    if command not in COMMANDS:
+        print('unknown command ' + command + '\n')
+        print_usage()
+        return 2
+    module = COMMANDS[command][0]
+    bin_dir = osp.dirname(osp.abspath(__file__))
+    if bin_dir not in sys.path:
+        sys.path.insert(0, bin_dir)
+    # command script parses sys.argv as if it was called directly
+    sys.argv = [osp.join(bin_dir, module + '.py')] + argv[1:]
+    runpy.run_module(module, run_name='__main__', alter_sys=True)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,174 @@
+import argparse
+import os.path as osp
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+from ome_meta import read_ome_meta, strip_namespace
+from object_features import iter_windows, get_page_reader, get_channel_names, write_table
+import storage
+
+Image = np.ndarray
+
+
+def get_physical_size(path: str) -> Tuple[float, float]:
+    """ Returns PhysicalSizeY and PhysicalSizeX of the OME-TIFF.
+        Units are removed from combined files, so both images are expected to use the same unit.
+    """
+    pixels = strip_namespace(read_ome_meta(path)).find('Image').find('Pixels')
+    size_y, size_x = pixels.get('PhysicalSizeY'), pixels.get('PhysicalSizeX')
+    if size_y is None or size_x is None:
+        raise ValueError('No PhysicalSizeX and PhysicalSizeY in OME-XML of ' + path)
+    return float(size_y), float(size_x)
+
+
+def read_affine(path: str) -> np.ndarray:
+    """ Text file with 2x3 or 3x3 matrix that maps physical (y, x) coordinates of the mask
+        to physical (y, x) coordinates of IMS
+    """
+    affine = np.loadtxt(path, dtype=np.float64, ndmin=2)
+    if affine.shape == (2, 3):
+        affine = np.vstack([affine, [0, 0, 1]])
+    if affine.shape != (3, 3):
+        raise ValueError('Affine transform must be 2x3 or 3x3 matrix, got ' + str(affine.shape))
+    return affine
+
+
+def get_pixel_transform(mask_pixel_size: Tuple[float, float], ims_pixel_size: Tuple[float, float],
+                        affine: np.ndarray = None) -> np.ndarray:
+    """ 3x3 matrix that maps (y, x, 1) of mask pixel to fractional (y, x) pixel coordinates of IMS.
+        Center of the mask pixel is mapped, so the IMS pixel that covers it is floor of the result.
+    """
+    to_physical = np.array([[mask_pixel_size[0], 0, 0.5 * mask_pixel_size[0]],
+                            [0, mask_pixel_size[1], 0.5 * mask_pixel_size[1]],
+                            [0, 0, 1]], dtype=np.float64)
+    to_ims = np.diag([1 / ims_pixel_size[0], 1 / ims_pixel_size[1], 1])
+    affine = np.eye(3) if affine is None else affine
+    return to_ims @ affine @ to_physical
+
+
+def get_ims_indices(window: Tuple[slice, slice], transform: np.ndarray,
+                    ims_shape: Tuple[int, int]) -> Tuple[Image, Image, Image]:
+    """ IMS row and column of every mask pixel in the window and mask of pixels that fall inside IMS """
+    ys = np.arange(window[0].start, window[0].stop, dtype=np.float64)[:, None]
+    xs = np.arange(window[1].start, window[1].stop, dtype=np.float64)[None, :]
+    iy = np.floor(transform[0, 0] * ys + transform[0, 1] * xs + transform[0, 2]).astype(np.int64)
+    ix = np.floor(transform[1, 0] * ys + transform[1, 1] * xs + transform[1, 2]).astype(np.int64)
+    iy, ix = np.broadcast_arrays(iy, ix)
+    inside = (iy >= 0) & (iy < ims_shape[0]) & (ix >= 0) & (ix < ims_shape[1])
+    return iy, ix, inside
+
+
+def get_ims_window(ims_channels: List[Image], window: Tuple[slice, slice], transform: np.ndarray) -> Image:
+    """ Values of IMS channels resampled onto the mask window with nearest neighbour, 0 outside IMS.
+        Only the IMS region under the window is read, so channels can be memory-mapped pages.
+    """
+    ims_shape = ims_channels[0].shape
+    iy, ix, inside = get_ims_indices(window, transform, ims_shape)
+    out = np.zeros((len(ims_channels),) + iy.shape, dtype=ims_channels[0].dtype)
+    if not inside.any():
+        return out
+    y0, y1 = iy[inside].min(), iy[inside].max() + 1
+    x0, x1 = ix[inside].min(), ix[inside].max() + 1
+    for c, channel in enumerate(ims_channels):
+        region = np.asarray(channel[y0:y1, x0:x1])
+        out[c][inside] = region[iy[inside] - y0, ix[inside] - x0]
+    return out
+
+
+def get_overlap_weights(mask: Image, transform: np.ndarray, ims_shape: Tuple[int, int],
+                        tile_shape: tuple) -> Dict[str, np.ndarray]:
+    """ Number of mask pixels of every label that fall into every IMS pixel.
+        Mask is read one tile at a time, pairs from all tiles are merged at the end.
+    """
+    npixels = ims_shape[0] * ims_shape[1]
+    tile_keys = []
+    tile_counts = []
+    for window in iter_windows(mask.shape, tile_shape):
+        labels = np.asarray(mask[window])
+        iy, ix, inside = get_ims_indices(window, transform, ims_shape)
+        is_object = inside & (labels != 0)
+        keys = labels[is_object].astype(np.int64) * npixels + iy[is_object] * ims_shape[1] + ix[is_object]
+        keys, counts = np.unique(keys, return_counts=True)
+        tile_keys.append(keys)
+        tile_counts.append(counts)
+
+    keys, inverse = np.unique(np.concatenate(tile_keys), return_inverse=True)
+    counts = np.bincount(inverse, weights=np.concatenate(tile_counts)).astype(np.int64)
+    labels, ims_pixel = np.divmod(keys, npixels)
+    return {'label': labels, 'ims_pixel': ims_pixel, 'count': counts, 'ims_shape': np.array(ims_shape)}
+
+
+def save_overlap_weights(weights: Dict[str, np.ndarray], path: str):
+    np.savez_compressed(path, **weights)
+
+
+def load_overlap_weights(path: str) -> Dict[str, np.ndarray]:
+    with np.load(path) as f:
+        weights = {key: f[key] for key in f.files}
+    return weights
+
+
+def get_cell_means(weights: Dict[str, np.ndarray], ims_channels: List[Image],
+                   channel_names: List[str]) -> Dict[str, np.ndarray]:
+    """ Mean IMS value of every cell, weighted by the number of cell pixels inside every IMS pixel.
+        IMS channels are read whole, they are small compared to the mask.
+    """
+    if tuple(weights['ims_shape']) != ims_channels[0].shape:
+        raise ValueError('Overlap weights were computed for IMS of shape ' + str(tuple(weights['ims_shape'])))
+    labels, inverse = np.unique(weights['label'], return_inverse=True)
+    counts = weights['count'].astype(np.float64)
+    area = np.bincount(inverse, weights=counts, minlength=len(labels))
+    table = {'label': labels, 'area': area.astype(np.int64)}
+    for name, channel in zip(channel_names, ims_channels):
+        values = np.asarray(channel).ravel()[weights['ims_pixel']].astype(np.float64)
+        table[name] = np.bincount(inverse, weights=counts * values, minlength=len(labels)) / area
+    return table
+
+
+def main(mask_path: str, ims_path: str, out_path: str, ref_path: str = None, affine_path: str = None,
+         weights_path: str = None, tile_size: int = 1000):
+    """ ref_path - image on the same pixel grid as the mask with PhysicalSize in OME-XML,
+        e.g. mxif_combined_multilayer.ome.tiff, stitched mask has no physical size.
+        If weights_path exists, overlap weights are loaded from it, otherwise they are computed and saved there.
+    """
+    with storage.open_tiff(ims_path) as TF:
+        nchannels = len(TF.pages)
+    ims_channels = [get_page_reader(ims_path, c) for c in range(0, nchannels)]
+    channel_names = get_channel_names(ims_path, nchannels)
+
+    if weights_path is not None and osp.exists(weights_path):
+        print('loading overlap weights from', weights_path)
+        weights = load_overlap_weights(weights_path)
+    else:
+        mask_pixel_size = get_physical_size(mask_path if ref_path is None else ref_path)
+        affine = None if affine_path is None else read_affine(affine_path)
+        transform = get_pixel_transform(mask_pixel_size, get_physical_size(ims_path), affine)
+        mask = get_page_reader(mask_path, 0)
+        weights = get_overlap_weights(mask, transform, ims_channels[0].shape, (tile_size, tile_size))
+        if weights_path is not None:
+            save_overlap_weights(weights, weights_path)
+
+    table = get_cell_means(weights, ims_channels, channel_names)
+    print('quantified', len(table['label']), 'objects in', len(channel_names), 'IMS channels')
+    write_table(table, out_path)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--mask_path', type=str, required=True, help='path to stitched segmentation mask')
+    parser.add_argument('--ims_path', type=str, required=True, help='path to ims_combined_multilayer.ome.tiff')
+    parser.add_argument('--out_path', type=str, required=True, help='path to output table, .csv or .parquet')
+    parser.add_argument('--ref_path', type=str, default=None,
+                        help='path to image on the mask pixel grid with physical pixel size, ' +
+                             'e.g. mxif_combined_multilayer.ome.tiff. Default: mask_path')
+    parser.add_argument('--affine_path', type=str, default=None,
+                        help='path to text file with 2x3 or 3x3 affine matrix from mask to IMS ' +
+                             'physical (y, x) coordinates')
+    parser.add_argument('--weights_path', type=str, default=None,
+                        help='path to .npz with pixel to label overlap weights, loaded if exists, saved otherwise')
+    parser.add_argument('--tile_size', type=int, default=1000, help='size of mask tile read at once, default 1000')
+    args = parser.parse_args()
+
+    main(args.mask_path, args.ims_path, args.out_path, args.ref_path, args.affine_path, args.weights_path,
+         args.tile_size)
@@ -0,0 +1,112 @@
+import argparse
+from typing import Union
+
+import numpy as np
+
+from object_features import get_page_reader, get_channel_names
+import storage
+
+Image = np.ndarray
+
+# ims_combined_multilayer.ome.tiff -> ims_combined_multilayer.spectra.zarr
+SPECTRA_SUFFIX = '.spectra.zarr'
+
+
+def get_spectra_path(tiff_path: str) -> str:
+    return storage.get_sidecar_path(tiff_path, SPECTRA_SUFFIX)
+
+
+def get_tissue_pixels(tiff_path: str, nchannels: int) -> np.ndarray:
+    """ Linear indices of pixels that are not zero in at least one channel, in raster order.
+        Pages are decoded one at a time, only the mask is kept between them.
+    """
+    tissue = None
+    for c in range(0, nchannels):
+        channel = np.asarray(get_page_reader(tiff_path, c))
+        tissue = channel != 0 if tissue is None else tissue | (channel != 0)
+        del channel
+    return np.flatnonzero(tissue)
+
+
+def write_spectra(tiff_path: str, out_path: str, pixel_chunk: int = 16384, channel_chunk: int = 64) -> int:
+    """ Stores tissue pixels of all pages as (n_pixels x n_channels) Zarr array 'values'
+        and their linear indices in the plane as array 'pixel'.
+        Chunks hold a block of channels of a block of pixels, so one spectrum and one channel
+        are both read from a few chunks. Pages are decoded channel_chunk at a time.
+        Returns number of tissue pixels.
+    """
+    import zarr
+
+    with storage.open_tiff(tiff_path) as TF:
+        nchannels = len(TF.pages)
+        plane_shape = TF.pages[0].shape[-2:]
+        dtype = TF.pages[0].dtype
+    pixel = get_tissue_pixels(tiff_path, nchannels)
+    npixels = len(pixel)
+    channel_chunk = min(channel_chunk, nchannels)
+
+    root = zarr.open_group(out_path, mode='w')
+    root.attrs.update({'shape': list(plane_shape), 'channel_names': get_channel_names(tiff_path, nchannels)})
+    pixel_arr = root.zeros(name='pixel', shape=(npixels,), chunks=(max(min(pixel_chunk, npixels), 1),),
+                           dtype=np.int64)
+    pixel_arr[:] = pixel
+    values = root.zeros(name='values', shape=(npixels, nchannels),
+                        chunks=(max(min(pixel_chunk, npixels), 1), channel_chunk), dtype=dtype)
+    for c0 in range(0, nchannels, channel_chunk):
+        c1 = min(c0 + channel_chunk, nchannels)
+        values[:, c0:c1] = np.stack([np.asarray(get_page_reader(tiff_path, c)).ravel()[pixel]
+                                     for c in range(c0, c1)], axis=1)
+    return npixels
+
+
+def open_spectra(path: str):
+    import zarr
+    return zarr.open_group(path, mode='r')
+
+
+def get_coordinates(spectra) -> np.ndarray:
+    """ (y, x) of every stored pixel """
+    return np.stack(np.unravel_index(spectra['pixel'][:], tuple(spectra.attrs['shape'])), axis=1)
+
+
+def get_spectrum(spectra, y: int, x: int, pixel: np.ndarray = None) -> Image:
+    """ Values of all channels in one pixel, zeros for background pixels.
+        pixel - preloaded spectra['pixel'] when many spectra are queried
+    """
+    pixel = spectra['pixel'][:] if pixel is None else pixel
+    values = spectra['values']
+    linear = y * spectra.attrs['shape'][1] + x
+    row = int(np.searchsorted(pixel, linear))
+    if row == len(pixel) or pixel[row] != linear:
+        return np.zeros(values.shape[1], dtype=values.dtype)
+    return values[row, :]
+
+
+def get_channel_image(spectra, channel: Union[int, str]) -> Image:
+    """ Dense plane of one channel, channel is its position or name """
+    if isinstance(channel, str):
+        channel = spectra.attrs['channel_names'].index(channel)
+    values = spectra['values']
+    img = np.zeros(tuple(spectra.attrs['shape']), dtype=values.dtype)
+    img.ravel()[spectra['pixel'][:]] = values[:, channel]
+    return img
+
+
+def main(tiff_path: str, out_path: str = None, pixel_chunk: int = 16384, channel_chunk: int = 64):
+    out_path = get_spectra_path(tiff_path) if out_path is None else out_path
+    npixels = write_spectra(tiff_path, out_path, pixel_chunk, channel_chunk)
+    with storage.open_tiff(tiff_path) as TF:
+        total = TF.pages[0].shape[0] * TF.pages[0].shape[1]
+    print('stored', npixels, 'of', total, 'pixels in', out_path)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-i', type=str, required=True, help='path to ims_combined_multilayer.ome.tiff')
+    parser.add_argument('-o', type=str, default=None,
+                        help='path to output Zarr directory. Default: ims_combined_multilayer.spectra.zarr next to input')
+    parser.add_argument('--pixel_chunk', type=int, default=16384, help='pixels per chunk, default 16384')
+    parser.add_argument('--channel_chunk', type=int, default=64, help='channels per chunk, default 64')
+    args = parser.parse_args()
+
+    main(args.i, args.o, args.pixel_chunk, args.channel_chunk)
@@ -0,0 +1,173 @@
+import argparse
+from typing import List, Union
+
+import numpy as np
+import tifffile as tif
+
+from stitcher import (get_block_slices, get_seam_remapping, read_tile_edges, get_tile_remapping, read_tile_max,
+                      load_block, get_tile_grid_from_dir, get_tile_grid_from_manifest,
+                      read_label_table, write_label_table, derive_boundaries, BOUNDARY_PAGES)
+
+
+def get_neighbours(tile_id: int, x_nblocks: int, y_nblocks: int) -> dict:
+    i, j = divmod(tile_id, x_nblocks)
+    neighbours = {'left': tile_id - 1 if j > 0 else None,
+                  'right': tile_id + 1 if j < x_nblocks - 1 else None,
+                  'top': tile_id - x_nblocks if i > 0 else None,
+                  'bottom': tile_id + x_nblocks if i < y_nblocks - 1 else None}
+    return neighbours
+
+
+def get_seam(edges: dict, tile1_id: int, tile2_id: int, mode: str) -> dict:
+    """ Remapping of tile2 labels to tile1 labels, tile1 is left or top neighbour of tile2 """
+    if edges[tile1_id] is None or edges[tile2_id] is None:
+        return {}
+    if mode == 'horizontal':
+        return get_seam_remapping(edges[tile1_id]['right'], edges[tile2_id]['left'])
+    else:
+        return get_seam_remapping(edges[tile1_id]['bottom'], edges[tile2_id]['top'])
+
+
+def update_seams(remap_dict: dict, edges: dict, changed: List[int], x_nblocks: int, y_nblocks: int):
+    """ Recomputes only the seams of changed tiles with their four neighbours """
+    for tile_id in changed:
+        nb = get_neighbours(tile_id, x_nblocks, y_nblocks)
+        for tile1_id, tile2_id, mode in [(nb['left'], tile_id, 'horizontal'), (tile_id, nb['right'], 'horizontal'),
+                                         (nb['top'], tile_id, 'vertical'), (tile_id, nb['bottom'], 'vertical')]:
+            if tile1_id is None or tile2_id is None:
+                continue
+            remap_dict.setdefault(tile2_id, {'horizontal': {}, 'vertical': {}})
+            remap_dict[tile2_id][mode] = get_seam(edges, tile1_id, tile2_id, mode)
+
+
+def get_affected_tiles(changed: List[int], x_nblocks: int, y_nblocks: int) -> List[int]:
+    """ Labels of a tile are replaced only with labels of its left and top neighbours,
+        so besides changed tiles only their right and bottom neighbours have to be rewritten.
+    """
+    affected = set(changed)
+    for tile_id in changed:
+        nb = get_neighbours(tile_id, x_nblocks, y_nblocks)
+        affected.update(t for t in (nb['right'], nb['bottom']) if t is not None)
+    return sorted(affected)
+
+
+def get_tile_windows(tiles: List[int], table: dict, margin: int = 0) -> List[tuple]:
+    """ Returns slices of the stitched image covered by tiles, extended by margin pixels """
+    x_nblocks, y_nblocks = table['nblocks']['x'], table['nblocks']['y']
+    windows = []
+    for tile_id in tiles:
+        i, j = divmod(tile_id, x_nblocks)
+        big_image_slice = get_block_slices(i, j, x_nblocks, y_nblocks, table['block_shape'], table['overlap'],
+                                           table['padding'])[1]
+        windows.append(tuple(slice(max(s.start - margin, 0), s.stop + margin) for s in big_image_slice))
+    return windows
+
+
+def rewrite_tiles(out_path: str, page: int, path_list: List[str], tiles: List[int], table: dict):
+    """ Writes stitched tiles directly into the page of the existing uncompressed output file """
+    import dask
+
+    x_nblocks, y_nblocks = table['nblocks']['x'], table['nblocks']['y']
+    block_shape, overlap, padding = table['block_shape'], table['overlap'], table['padding']
+    page_id = table['pages'].index(page)
+    tile_additions = np.array(table['tile_additions'][page_id], dtype=np.int64).reshape((y_nblocks, x_nblocks))
+    dtype = np.uint32
+
+    out = tif.memmap(out_path, page=page, mode='r+')
+    task = []
+    slices = []
+    for tile_id in tiles:
+        i, j = divmod(tile_id, x_nblocks)
+        block_slice, big_image_slice = get_block_slices(i, j, x_nblocks, y_nblocks, block_shape, overlap, padding)
+        hor_remap, ver_remap = get_tile_remapping(table['remap'], tile_id)
+        left_tile_addition = tile_additions[i, j - 1] if j > 0 else 0
+        top_tile_addition = tile_additions[i - 1, j] if i > 0 else 0
+        task.append(dask.delayed(load_block)(path_list[tile_id], page, block_slice, dtype, tile_additions[i, j],
+                                             hor_remap, ver_remap, left_tile_addition, top_tile_addition))
+        slices.append(big_image_slice)
+    blocks = dask.compute(*task, scheduler='threads')
+    for big_image_slice, block in zip(slices, blocks):
+        out[big_image_slice] = block
+    out.flush()
+    del out
+
+
+def check_output(out_path: str, npages: int):
+    with tif.TiffFile(out_path) as TF:
+        if len(TF.pages) != npages:
+            raise ValueError('Output has ' + str(len(TF.pages)) + ' pages, tiles have ' + str(npages))
+        if not all(page.is_memmappable for page in TF.pages):
+            raise ValueError('Only uncompressed contiguous output can be updated in place, ' +
+                             'stitch it again without compression')
+
+
+def main(img_dir: Union[str, List[str]], out_path: str, label_table_path: str, changed_tiles: List[int], manifest_path: str = None):
+    """ Re-stitches only changed tiles into the existing mask.
+        changed_tiles - 1-based tile numbers in raster order, as in slicer output names.
+        Changed tiles get new labels after the last used label, so their label count may change.
+        Label table is updated in place. Object feature table has to be computed again if needed.
+    """
+    import dask
+
+    table = read_label_table(label_table_path)
+
+    if manifest_path is not None:
+        path_list, x_nblocks, y_nblocks, block_shape, npages = get_tile_grid_from_manifest(img_dir, manifest_path)
+    else:
+        path_list, x_nblocks, y_nblocks, block_shape, npages = get_tile_grid_from_dir(img_dir)
+    if (x_nblocks, y_nblocks) != (table['nblocks']['x'], table['nblocks']['y']):
+        raise ValueError('Tile grid does not match label table')
+    check_output(out_path, npages)
+
+    changed = sorted(set(t - 1 for t in changed_tiles))
+    if any(t < 0 or t >= len(path_list) for t in changed):
+        raise ValueError('Tile numbers must be between 1 and ' + str(len(path_list)))
+
+    # only changed tiles and their neighbours are read, tiles without overlap have no seams
+    if table['overlap'] > 0:
+        edge_tiles = set(changed)
+        for tile_id in changed:
+            edge_tiles.update(t for t in get_neighbours(tile_id, x_nblocks, y_nblocks).values() if t is not None)
+        edge_tiles = sorted(edge_tiles)
+        print('reading edges of', len(edge_tiles), 'tiles')
+        task = [dask.delayed(read_tile_edges)(path_list[t], table['overlap']) for t in edge_tiles]
+        edges = dict(zip(edge_tiles, dask.compute(*task, scheduler='processes')))
+        update_seams(table['remap'], edges, changed, x_nblocks, y_nblocks)
+
+    affected = get_affected_tiles(changed, x_nblocks, y_nblocks)
+    for page_id, p in enumerate(table['pages']):
+        print('page', p, 'rewriting', len(affected), 'tiles')
+        task = [dask.delayed(read_tile_max)(path_list[t], p) for t in changed]
+        for tile_id, tile_max in zip(changed, dask.compute(*task, scheduler='threads')):
+            table['tile_additions'][page_id][tile_id] = table['max_labels'][page_id]
+            table['max_labels'][page_id] += tile_max
+        rewrite_tiles(out_path, p, path_list, affected, table)
+
+    # boundaries that were derived from labels are derived again around rewritten tiles
+    for boundary_page, label_page in BOUNDARY_PAGES.items():
+        if boundary_page in table['pages'] or label_page not in table['pages']:
+            continue
+        print('page', boundary_page, 'deriving from page', label_page)
+        labels = tif.memmap(out_path, page=label_page, mode='r')
+        out = tif.memmap(out_path, page=boundary_page, mode='r+')
+        derive_boundaries(labels, out, get_tile_windows(affected, table, margin=1))
+        out.flush()
+        del labels, out
+
+    write_label_table(table, label_table_path)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-i', type=str, nargs='+', required=True,
+                        help='path to directory with images, one directory per shard if tiles were sharded')
+    parser.add_argument('-o', type=str, required=True, help='path to existing stitched mask, updated in place')
+    parser.add_argument('-t', type=str, required=True, help='path to label table saved by stitcher, updated in place')
+    parser.add_argument('-c', type=int, nargs='+', required=True,
+                        help='space separated 1-based numbers of changed tiles in raster order')
+    parser.add_argument('-m', type=str, default=None,
+                        help='path to tile manifest produced by slicer, if not provided image directory will be listed')
+    args = parser.parse_args()
+
+    img_dir = args.i[0] if len(args.i) == 1 else args.i
+    main(img_dir, args.o, args.t, args.c, args.m)
@@ -7,6 +7,7 @@ import yaml
 
 import generate_pipeline_config
 import generate_cytokit_config
+import preflight
 
 
 def create_base_dirs(out_dir: str):
@@ -23,7 +24,8 @@ def create_base_dirs(out_dir: str):
 
 def main(experiment_name, mxif_dataset_dir_path,
          multichannel_ims_ometiff_positive_path, multichannel_ims_ometiff_negative_path,
-         ngpus, nuclei_channel, block_size, overlap):
+         ngpus, nuclei_channel, block_size, overlap, skip_empty_tiles=False, preselect_best_focus=False,
+         nshards=1, region=None, auto_block_size=False, rle_mask=False):
 
     __location__ = osp.realpath(osp.join(os.getcwd(), osp.dirname(__file__)))
 
@@ -37,8 +39,17 @@ def main(experiment_name, mxif_dataset_dir_path,
                       ngpus=ngpus,
                       nuclei_channel=nuclei_channel,
                       block_size=block_size,
-                      overlap=overlap
+                      overlap=overlap,
+                      skip_empty_tiles=skip_empty_tiles,
+                      preselect_best_focus=preselect_best_focus,
+                      nshards=nshards,
+                      region=region,
+                      auto_block_size=auto_block_size,
+                      rle_mask=rle_mask
                       )
+    # headers of all inputs are checked before metadata extraction and slicing
+    preflight.run_preflight(submission)
+
     pipeline_config_path = osp.join(dir_paths['pipeline_output_dir'], 'pipeline_config.yaml')
     generate_pipeline_config.main(submission, base_pipeline_dir, pipeline_config_path)
 
@@ -59,8 +70,22 @@ if __name__ == '__main__':
     parser.add_argument('--nuclei_channel', type=str, help='Channel that will be used for nucleus segmentation')
     parser.add_argument('--block_size', type=int, help='size of one tile for image segmentation')
     parser.add_argument('--overlap', type=int, help='size of overlap for one edge (each image has 4 overlapping edges)')
+    parser.add_argument('--skip_empty_tiles', action='store_true',
+                        help='do not slice and segment tiles without tissue in the nuclei channel')
+    parser.add_argument('--preselect_best_focus', action='store_true',
+                        help='slice only the sharpest z-plane of every tile instead of running Cytokit best focus')
+    parser.add_argument('--nshards', type=int, default=1,
+                        help='number of shards of tile rows, that can be segmented on separate nodes. Default: 1')
+    parser.add_argument('--region', type=int, default=None,
+                        help='region of MxIF dataset to process. Default: first region')
+    parser.add_argument('--auto_block_size', action='store_true',
+                        help='select block size from image shape, GPU memory and RAM instead of --block_size')
+    parser.add_argument('--rle_mask', action='store_true',
+                        help='write run-length encoded stitched mask with object index next to the OME-TIFF')
     args = parser.parse_args()
 
     main(args.experiment_name, args.mxif_dataset_dir_path,
          args.multichannel_ims_ometiff_positive_path, args.multichannel_ims_ometiff_negative_path,
-         args.ngpus, args.nuclei_channel, args.block_size, args.overlap)
+         args.ngpus, args.nuclei_channel, args.block_size, args.overlap, args.skip_empty_tiles,
+         args.preselect_best_focus, args.nshards, args.region, args.auto_block_size,
+         args.rle_mask)
@@ -0,0 +1,104 @@
+import re
+from typing import List, Tuple
+
+import numpy as np
+import tifffile as tif
+
+import storage
+
+Image = np.ndarray
+
+INTERLEAVED_TILE_SHAPE = (512, 512)
+
+
+def get_interleaved_ome_meta(ome_meta: str) -> str:
+    """ All channels are samples of one tiled page, so there is a single TiffData for IFD 0 """
+    ome_meta = re.sub(r'\s+Interleaved="[^"]*"', '', ome_meta)
+    ome_meta = ome_meta.replace('<Pixels ', '<Pixels Interleaved="true" ', 1)
+    ome_meta = re.sub(r'<TiffData[^>]*/>', '', ome_meta)
+    tiff_data = '<TiffData FirstC="0" FirstT="0" FirstZ="0" IFD="0" PlaneCount="1" />'
+    return ome_meta.replace('</Pixels>', tiff_data + '</Pixels>', 1)
+
+
+def iter_interleaved_tiles(channels: List[Image], tile_shape: tuple):
+    """ Reads one row of tiles from every channel at a time and yields (tile_y, tile_x, channel) tiles
+        in raster order, tiles at the right and bottom border are padded with zeros.
+    """
+    height, width = channels[0].shape
+    for yf in range(0, height, tile_shape[0]):
+        rows = np.stack([np.asarray(ch[yf:yf + tile_shape[0], :]) for ch in channels], axis=-1)
+        for xf in range(0, width, tile_shape[1]):
+            tile = rows[:, xf:xf + tile_shape[1], :]
+            if tile.shape[:2] != tuple(tile_shape):
+                tile = np.pad(tile, ((0, tile_shape[0] - tile.shape[0]), (0, tile_shape[1] - tile.shape[1]), (0, 0)),
+                              mode='constant')
+            yield tile
+
+
+def get_channel_readers(page_list: List[Tuple[str, int]]) -> List[Image]:
+    """ Uncompressed source pages are memory-mapped, others are decoded whole """
+    readers = []
+    for path, page in page_list:
+        with storage.open_tiff(path) as TF:
+            is_memmappable = TF.pages[page].is_memmappable and not storage.is_remote(path)
+        readers.append(tif.memmap(path, page=page, mode='r') if is_memmappable else storage.imread(path, key=page))
+    return readers
+
+
+def write_interleaved_tiff(page_list: List[Tuple[str, int]], out_path: str, ome_meta: str,
+                           tile_shape: tuple = INTERLEAVED_TILE_SHAPE):
+    """ Writes all channels as samples of one uncompressed tiled page with planar-contiguous tiles,
+        so all channels of a window are stored next to each other
+    """
+    channels = get_channel_readers(page_list)
+    shape = channels[0].shape + (len(channels),)
+    with tif.TiffWriter(out_path, bigtiff=True) as TW:
+        TW.save(iter_interleaved_tiles(channels, tile_shape), shape=shape, dtype=channels[0].dtype,
+                tile=tile_shape, planarconfig='contig', photometric='minisblack',
+                description=get_interleaved_ome_meta(ome_meta))
+
+
+def write_interleaved_zarr(page_list: List[Tuple[str, int]], out_path: str, channel_names: List[str],
+                           tile_shape: tuple = INTERLEAVED_TILE_SHAPE):
+    """ Writes (y, x, channel) Zarr array chunked by (tile_y, tile_x, all channels) """
+    import zarr
+
+    channels = get_channel_readers(page_list)
+    height, width = channels[0].shape
+    target = zarr.open(out_path, mode='w', shape=(height, width, len(channels)), dtype=channels[0].dtype,
+                       chunks=tuple(tile_shape) + (len(channels),))
+    target.attrs['channel_names'] = channel_names
+    for yf in range(0, height, tile_shape[0]):
+        target[yf:yf + tile_shape[0], :, :] = np.stack([np.asarray(ch[yf:yf + tile_shape[0], :])
+                                                        for ch in channels], axis=-1)
+
+
+def read_tiff_window(path: str, window: Tuple[slice, slice]) -> Image:
+    """ Reads (y, x, channel) window of the interleaved tiled TIFF.
+        Every tile under the window is one contiguous read, only uncompressed files are supported.
+    """
+    with storage.open_tiff(path) as TF:
+        page = TF.pages[0]
+        if page.compression != 1 or not page.is_tiled or page.planarconfig != 1:
+            raise ValueError('Only uncompressed tiled interleaved TIFF is supported')
+        tile_h, tile_w = page.tilelength, page.tilewidth
+        height, width, nchannels = page.shape
+        dtype = page.dtype.newbyteorder(TF.byteorder)
+        ntiles_x = -(-width // tile_w)
+
+        y0, y1 = window[0].start, min(window[0].stop, height)
+        x0, x1 = window[1].start, min(window[1].stop, width)
+        out = np.empty((y1 - y0, x1 - x0, nchannels), dtype=page.dtype)
+        fh = TF.filehandle
+        for ty in range(y0 // tile_h, -(-y1 // tile_h)):
+            for tx in range(x0 // tile_w, -(-x1 // tile_w)):
+                t = ty * ntiles_x + tx
+                fh.seek(page.dataoffsets[t])
+                tile = np.frombuffer(fh.read(page.databytecounts[t]), dtype=dtype)
+                tile = tile.reshape(tile_h, tile_w, nchannels)
+                ty0, tx0 = ty * tile_h, tx * tile_w
+                ys = slice(max(y0, ty0), min(y1, ty0 + tile_h))
+                xs = slice(max(x0, tx0), min(x1, tx0 + tile_w))
+                out[ys.start - y0:ys.stop - y0, xs.start - x0:xs.stop - x0] = \
+                    tile[ys.start - ty0:ys.stop - ty0, xs.start - tx0:xs.stop - tx0]
+    return out
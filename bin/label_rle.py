@@ -0,0 +1,199 @@
+""" Row-wise run-length encoding of label masks.
+    Runs of every page are stored in raster order with a pointer to the first run of every row,
+    runs of one object are found through the object index: label, range in the label-sorted run order, bounding box.
+"""
+
+import argparse
+import os.path as osp
+from typing import Dict, Iterable, List, Tuple
+
+import numpy as np
+import tifffile as tif
+
+import storage
+
+Image = np.ndarray
+
+RLE_SUFFIX = '.rle.npz'
+
+
+def get_rle_path(tiff_path: str) -> str:
+    """ segmentation_mask_stitched.ome.tiff -> segmentation_mask_stitched.rle.npz """
+    return storage.get_sidecar_path(tiff_path, RLE_SUFFIX)
+
+
+def encode_rows(rows: Image) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """ Returns row, start, length and label of every run of non-zero labels in raster order """
+    width = rows.shape[-1]
+    change = np.ones(rows.shape, dtype=bool)
+    change[:, 1:] = rows[:, 1:] != rows[:, :-1]
+    run_rows, run_starts = np.nonzero(change)
+    run_labels = rows[run_rows, run_starts]
+    run_ends = np.full_like(run_starts, width)
+    same_row = run_rows[1:] == run_rows[:-1]
+    run_ends[:-1][same_row] = run_starts[1:][same_row]
+    keep = run_labels != 0
+    return run_rows[keep], run_starts[keep], (run_ends - run_starts)[keep], run_labels[keep]
+
+
+def encode_plane(rows_iter: Iterable[Image], height: int) -> Dict[str, np.ndarray]:
+    """ rows_iter yields consecutive strips of rows, so the plane does not have to be in memory at once """
+    rows, starts, lengths, labels = [], [], [], []
+    row_offset = 0
+    for strip in rows_iter:
+        r, s, l, lab = encode_rows(np.asarray(strip))
+        rows.append(r + row_offset)
+        starts.append(s)
+        lengths.append(l)
+        labels.append(lab)
+        row_offset += strip.shape[0]
+    rows = np.concatenate(rows) if rows else np.zeros(0, dtype=np.int64)
+    starts = np.concatenate(starts).astype(np.uint32) if starts else np.zeros(0, dtype=np.uint32)
+    lengths = np.concatenate(lengths).astype(np.uint32) if lengths else np.zeros(0, dtype=np.uint32)
+    labels = np.concatenate(labels).astype(np.uint32) if labels else np.zeros(0, dtype=np.uint32)
+
+    row_ptr = np.zeros(height + 1, dtype=np.int64)
+    np.cumsum(np.bincount(rows, minlength=height), out=row_ptr[1:])
+
+    # stable sort keeps runs of one object in raster order, so the first and last runs give rows of bounding box
+    order = np.argsort(labels, kind='stable')
+    object_labels, first, count = np.unique(labels[order], return_index=True, return_counts=True)
+    ends = starts.astype(np.int64) + lengths
+    if object_labels.size > 0:
+        bbox = np.stack([rows[order][first],
+                         np.minimum.reduceat(starts[order], first),
+                         rows[order][first + count - 1] + 1,
+                         np.maximum.reduceat(ends[order], first)], axis=1)
+    else:
+        bbox = np.zeros((0, 4), dtype=np.int64)
+    return {'row_ptr': row_ptr, 'starts': starts, 'lengths': lengths, 'labels': labels,
+            'order': order.astype(np.int64), 'object_labels': object_labels.astype(np.uint32),
+            'object_first': first.astype(np.int64), 'object_count': count.astype(np.int64),
+            'object_bbox': bbox.astype(np.int64)}
+
+
+def iter_page_strips(TF: tif.TiffFile, path: str, page: int, strip_rows: int) -> Iterable[Image]:
+    """ Uncompressed pages are memory-mapped and read by strips, other pages are decoded whole """
+    p = TF.pages[page]
+    if p.is_memmappable and not storage.is_remote(path):
+        img = tif.memmap(path, page=page, mode='r')
+    else:
+        img = p.asarray()
+    for y in range(0, img.shape[-2], strip_rows):
+        yield img[y:y + strip_rows]
+
+
+def write_rle(tiff_path: str, out_path: str = None, pages: List[int] = None, strip_rows: int = 1024) -> str:
+    """ Encodes label pages of the mask TIFF, by default all pages """
+    out_path = get_rle_path(tiff_path) if out_path is None else out_path
+    arrays = dict()
+    with storage.open_tiff(tiff_path) as TF:
+        pages = list(range(0, len(TF.pages))) if pages is None else pages
+        plane_shape = TF.pages[0].shape[-2:]
+        for p in pages:
+            encoded = encode_plane(iter_page_strips(TF, tiff_path, p, strip_rows), plane_shape[0])
+            arrays.update({'page' + str(p) + '_' + key: val for key, val in encoded.items()})
+    arrays['pages'] = np.array(pages, dtype=np.int64)
+    arrays['plane_shape'] = np.array(plane_shape, dtype=np.int64)
+    with storage.local_output(out_path) as local_path:
+        # np.savez adds .npz to paths without it
+        with open(local_path, 'wb') as s:
+            np.savez_compressed(s, **arrays)
+    return out_path
+
+
+def open_rle(path: str) -> Dict[str, np.ndarray]:
+    """ Runs and index of all pages are loaded at once, they are much smaller than the planes they encode,
+        and NpzFile would decompress an array again on every access
+    """
+    with storage.open_file(path, 'rb') as s:
+        with np.load(s) as npz:
+            return {key: npz[key] for key in npz.files}
+
+
+def get_page_array(rle: dict, page: int, key: str) -> np.ndarray:
+    return rle['page' + str(page) + '_' + key]
+
+
+def find_object(rle: dict, label: int, page: int = 0) -> int:
+    object_labels = get_page_array(rle, page, 'object_labels')
+    i = int(np.searchsorted(object_labels, label))
+    if i == object_labels.size or object_labels[i] != label:
+        raise KeyError('Label ' + str(label) + ' is not found in page ' + str(page))
+    return i
+
+
+def get_object_bbox(rle: dict, label: int, page: int = 0) -> Tuple[int, int, int, int]:
+    """ Returns y_min, x_min, y_max, x_max, max values are exclusive """
+    i = find_object(rle, label, page)
+    return tuple(int(v) for v in get_page_array(rle, page, 'object_bbox')[i])
+
+
+def get_object_runs(rle: dict, label: int, page: int = 0) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """ Returns row, start and length of every run of the object """
+    i = find_object(rle, label, page)
+    first = get_page_array(rle, page, 'object_first')[i]
+    count = get_page_array(rle, page, 'object_count')[i]
+    run_ids = get_page_array(rle, page, 'order')[first:first + count]
+    rows = np.searchsorted(get_page_array(rle, page, 'row_ptr'), run_ids, side='right') - 1
+    return rows, get_page_array(rle, page, 'starts')[run_ids], get_page_array(rle, page, 'lengths')[run_ids]
+
+
+def get_object_mask(rle: dict, label: int, page: int = 0) -> Tuple[Image, Tuple[int, int, int, int]]:
+    """ Returns boolean mask of the object cropped to its bounding box and the bounding box """
+    bbox = get_object_bbox(rle, label, page)
+    rows, starts, lengths = get_object_runs(rle, label, page)
+    mask = np.zeros((bbox[2] - bbox[0], bbox[3] - bbox[1]), dtype=bool)
+    for row, start, length in zip(rows - bbox[0], starts - bbox[1], lengths):
+        mask[row, start:start + length] = True
+    return mask, bbox
+
+
+def read_window(rle: dict, window: Tuple[slice, slice], page: int = 0) -> Image:
+    """ Rasterises labels inside the window, only runs of rows of the window are read """
+    plane_shape = rle['plane_shape']
+    y0, y1, _ = window[0].indices(int(plane_shape[0]))
+    x0, x1, _ = window[1].indices(int(plane_shape[1]))
+    out = np.zeros((max(0, y1 - y0), max(0, x1 - x0)), dtype=np.uint32)
+    if out.size == 0:
+        return out
+    row_ptr = get_page_array(rle, page, 'row_ptr')
+    first, last = row_ptr[y0], row_ptr[y1]
+    rows = np.repeat(np.arange(y0, y1), np.diff(row_ptr[y0:y1 + 1]))
+    starts = get_page_array(rle, page, 'starts')[first:last].astype(np.int64)
+    ends = starts + get_page_array(rle, page, 'lengths')[first:last]
+    labels = get_page_array(rle, page, 'labels')[first:last]
+    starts = np.clip(starts, x0, x1)
+    ends = np.clip(ends, x0, x1)
+    lengths = ends - starts
+    keep = lengths > 0
+    rows, starts, lengths, labels = rows[keep], starts[keep], lengths[keep], labels[keep]
+    # pixel positions of all runs at once: start of the run plus position inside the run
+    run_ids = np.repeat(np.arange(lengths.size), lengths)
+    offsets = np.arange(run_ids.size) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    out[rows[run_ids] - y0, starts[run_ids] + offsets - x0] = labels[run_ids]
+    return out
+
+
+def read_plane(rle: dict, page: int = 0) -> Image:
+    return read_window(rle, (slice(None), slice(None)), page)
+
+
+def main(tiff_path: str, out_path: str = None, pages: List[int] = None):
+    out_path = write_rle(tiff_path, out_path, pages)
+    rle = open_rle(out_path)
+    nobjects = {int(p): int(get_page_array(rle, p, 'object_labels').size) for p in rle['pages']}
+    print('RLE mask written to', out_path, 'objects per page:', nobjects)
+    if not storage.is_remote(tiff_path) and not storage.is_remote(out_path):
+        print('size, MB: TIFF {:.2f}, RLE {:.2f}'.format(osp.getsize(tiff_path) / 1024 ** 2,
+                                                         osp.getsize(out_path) / 1024 ** 2))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-i', type=str, required=True, help='path to label mask TIFF, e.g. stitched segmentation mask')
+    parser.add_argument('-o', type=str, default=None, help='path to output .rle.npz, default: next to the mask')
+    parser.add_argument('--pages', type=int, nargs='+', default=None, help='pages to encode, default: all')
+    args = parser.parse_args()
+
+    main(args.i, args.o, args.pages)
@@ -0,0 +1,116 @@
+import argparse
+from typing import List
+
+import numpy as np
+import tifffile as tif
+import dask
+import dask.array as da
+
+from stitcher import (get_block_slices, get_tile_remapping, get_remapping_for_border_values, read_tile_max,
+                      load_block, get_tile_grid_from_dir, get_tile_grid_from_manifest, generate_ome_meta_for_mask,
+                      iter_tiles_from_strips, OUTPUT_TILE_SHAPE)
+
+
+def get_tile_additions(path_list: List[str], page: int, x_nblocks: int, y_nblocks: int,
+                       scheduler: str = 'threads') -> np.ndarray:
+    """ Values added to the labels of every tile to make them unique across the image.
+        Same as tile_additions from stitcher.stitch_plane: cumulative maximum of all previous tiles.
+    """
+    task = [dask.delayed(read_tile_max)(path, page) for path in path_list]
+    tile_max = np.array(dask.compute(*task, scheduler=scheduler), dtype=np.int64)
+    tile_additions = np.concatenate(([0], np.cumsum(tile_max)[:-1]))
+    return tile_additions.reshape((y_nblocks, x_nblocks))
+
+
+def get_lazy_plane(path_list: List[str], page: int, x_nblocks: int, y_nblocks: int,
+                   block_shape: list, dtype, overlap: int, padding: dict,
+                   remap_dict: dict = None, scheduler: str = 'threads') -> da.Array:
+    """ Returns stitched plane as a lazy dask array with one chunk per tile.
+        Tiles are read, cropped and relabeled only when the chunk is computed.
+    """
+    if remap_dict is None:
+        remap_dict = {}
+        tile_additions = np.zeros((y_nblocks, x_nblocks), dtype=np.int64)
+    else:
+        tile_additions = get_tile_additions(path_list, page, x_nblocks, y_nblocks, scheduler)
+
+    dtype = np.dtype(dtype).type
+    rows = []
+    n = 0
+    for i in range(0, y_nblocks):
+        row = []
+        for j in range(0, x_nblocks):
+            block_slice, big_image_slice = get_block_slices(i, j, x_nblocks, y_nblocks, block_shape, overlap, padding)
+            chunk_shape = tuple(s.stop - s.start for s in big_image_slice)
+            hor_remap, ver_remap = get_tile_remapping(remap_dict, n)
+            left_tile_addition = tile_additions[i, j - 1] if j > 0 else 0
+            top_tile_addition = tile_additions[i - 1, j] if i > 0 else 0
+
+            block = dask.delayed(load_block)(path_list[n], page, block_slice, dtype, tile_additions[i, j],
+                                             hor_remap, ver_remap, left_tile_addition, top_tile_addition)
+            row.append(da.from_delayed(block, shape=chunk_shape, dtype=dtype))
+            n += 1
+        rows.append(row)
+    return da.block(rows)
+
+
+def store_tiff(planes: List[da.Array], out_path: str, ome_meta: str, scheduler: str):
+    """ Computes planes one row of chunks at a time and writes them as tiled BigTIFF """
+    with tif.TiffWriter(out_path, bigtiff=True) as TW:
+        for p, plane in enumerate(planes):
+            print('\npage', p)
+            strips = (plane.blocks[i].compute(scheduler=scheduler) for i in range(0, plane.numblocks[0]))
+            TW.save(iter_tiles_from_strips(strips, OUTPUT_TILE_SHAPE), shape=plane.shape, dtype=plane.dtype,
+                    tile=OUTPUT_TILE_SHAPE, photometric="minisblack", description=ome_meta)
+
+
+def store_zarr(planes: List[da.Array], out_path: str, scheduler: str):
+    import zarr
+
+    stack = da.stack(planes)
+    target = zarr.open(out_path, mode='w', shape=stack.shape, dtype=stack.dtype,
+                       chunks=(1,) + OUTPUT_TILE_SHAPE)
+    da.store(stack.rechunk((1,) + OUTPUT_TILE_SHAPE), target, lock=False, scheduler=scheduler)
+
+
+def main(img_dir: str, out_path: str, overlap: int, padding_str: str, manifest_path: str = None,
+         scheduler: str = 'threads'):
+
+    padding_int = [int(i) for i in padding_str.split(',')]
+    padding = {"left": padding_int[0], "right": padding_int[1], "top": padding_int[2], "bottom": padding_int[3]}
+
+    if manifest_path is not None:
+        path_list, x_nblocks, y_nblocks, block_shape, npages = get_tile_grid_from_manifest(img_dir, manifest_path)
+    else:
+        path_list, x_nblocks, y_nblocks, block_shape, npages = get_tile_grid_from_dir(img_dir)
+
+    print('getting values for remapping')
+    remap_dict = get_remapping_for_border_values(path_list, x_nblocks, y_nblocks, overlap)
+
+    dtype = np.uint32
+    planes = [get_lazy_plane(path_list, p, x_nblocks, y_nblocks, block_shape, dtype, overlap, padding,
+                             remap_dict, scheduler) for p in range(0, npages)]
+
+    if out_path.endswith('.zarr'):
+        store_zarr(planes, out_path, scheduler)
+    else:
+        ome_meta = generate_ome_meta_for_mask(planes[0].shape[-1], planes[0].shape[-2], dtype)
+        store_tiff(planes, out_path, ome_meta, scheduler)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-i', type=str, required=True, help='path to directory with images')
+    parser.add_argument('-o', type=str, required=True, help='path to output file, .zarr extension writes Zarr array')
+    parser.add_argument('-v', type=int, required=True, default=0, help='overlap size in pixels, default 0')
+    parser.add_argument('-p', type=str, default='0,0,0,0',
+                        help='image padding that should be removed, 4 comma separated numbers: left, right, top, bottom.' +
+                             'Default: 0,0,0,0')
+    parser.add_argument('-m', type=str, default=None,
+                        help='path to tile manifest produced by slicer, if not provided image directory will be listed')
+    parser.add_argument('--scheduler', type=str, default='threads', choices=['threads', 'processes', 'synchronous'],
+                        help='dask scheduler used to compute chunks. Default: threads')
+
+    args = parser.parse_args()
+
+    main(args.i, args.o, args.v, args.p, args.m, args.scheduler)
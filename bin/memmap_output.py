@@ -0,0 +1,55 @@
+from typing import List, Tuple
+
+import numpy as np
+import tifffile as tif
+
+from channel_stats import get_channel_stats
+import storage
+
+
+def get_plane_shape_and_dtype(path: str):
+    """ Shape and dtype of the first page, used to preallocate output for pages of the file """
+    with storage.open_tiff(path) as TF:
+        plane_shape = TF.pages[0].shape
+        dtype = TF.pages[0].dtype
+    return plane_shape, dtype
+
+
+def create_memmap_output(out_path: str, shape: tuple, dtype, ome_meta: str) -> np.memmap:
+    """ Preallocates uncompressed BigTIFF with one page per first dimension of shape
+        and returns it memory-mapped, so pages can be filled in place.
+    """
+    out = tif.memmap(out_path, shape=shape, dtype=dtype, bigtiff=True,
+                     photometric='minisblack', description=ome_meta)
+    return out
+
+
+def copy_page_to_memmap(src_path: str, src_page: int, out_path: str, out_page: int, compute_stats: bool = False):
+    """ Decodes page of the source file directly into the page of the memory-mapped output file.
+        If compute_stats, returns channel statistics of the copied page.
+    """
+    out = tif.memmap(out_path, page=out_page, mode='r+')
+    with storage.open_tiff(src_path) as TF:
+        page = TF.pages[src_page]
+        if page.dtype == out.dtype and page.shape == out.shape:
+            page.asarray(out=out)
+        else:
+            out[:] = page.asarray()
+    out.flush()
+    stats = get_channel_stats(out) if compute_stats else None
+    del out
+    return stats
+
+
+def copy_pages_to_memmap(page_list: List[Tuple[str, int]], out_path: str, scheduler: str = 'processes',
+                         compute_stats: bool = False) -> list:
+    """ page_list - (source path, source page) for every page of the output, in output order.
+        Pages are disjoint regions of the output file, so they are filled by parallel workers.
+        Returns statistics of every page if compute_stats.
+    """
+    import dask
+
+    task = []
+    for out_page, (src_path, src_page) in enumerate(page_list):
+        task.append(dask.delayed(copy_page_to_memmap)(src_path, src_page, out_path, out_page, compute_stats))
+    return list(dask.compute(*task, scheduler=scheduler))
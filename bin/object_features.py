@@ -0,0 +1,197 @@
+import argparse
+from typing import Dict, List, Tuple
+
+import numpy as np
+import tifffile as tif
+
+from ome_meta import read_ome_meta, strip_namespace
+import storage
+
+Image = np.ndarray
+
+OBJECT_TABLE_COLUMNS = ['label', 'area', 'centroid_y', 'centroid_x',
+                        'bbox_min_y', 'bbox_min_x', 'bbox_max_y', 'bbox_max_x']
+
+
+def iter_windows(shape: tuple, tile_shape: tuple):
+    for yf in range(0, shape[-2], tile_shape[-2]):
+        for xf in range(0, shape[-1], tile_shape[-1]):
+            yield slice(yf, min(yf + tile_shape[-2], shape[-2])), slice(xf, min(xf + tile_shape[-1], shape[-1]))
+
+
+def group_by_label(labels: np.ndarray, values: Dict[str, np.ndarray], reductions: Dict[str, np.ufunc]):
+    """ Reduces values of every column per unique label with the ufunc given for the column """
+    order = np.argsort(labels, kind='stable')
+    labels = labels[order]
+    unique_labels, start = np.unique(labels, return_index=True)
+    grouped = {'label': unique_labels}
+    for col, ufunc in reductions.items():
+        grouped[col] = ufunc.reduceat(values[col][order], start)
+    return grouped
+
+
+TILE_REDUCTIONS = {'area': np.add, 'sum_y': np.add, 'sum_x': np.add,
+                   'bbox_min_y': np.minimum, 'bbox_min_x': np.minimum,
+                   'bbox_max_y': np.maximum, 'bbox_max_x': np.maximum}
+
+
+def get_tile_stats(labels_tile: Image, y_offset: int, x_offset: int) -> dict:
+    ys, xs = np.nonzero(labels_tile)
+    labels = labels_tile[ys, xs]
+    ys = ys.astype(np.int64) + y_offset
+    xs = xs.astype(np.int64) + x_offset
+    values = {'area': np.ones(len(labels), dtype=np.int64), 'sum_y': ys, 'sum_x': xs,
+              'bbox_min_y': ys, 'bbox_min_x': xs, 'bbox_max_y': ys + 1, 'bbox_max_x': xs + 1}
+    return group_by_label(labels, values, TILE_REDUCTIONS)
+
+
+def get_object_table(plane: Image, tile_shape: tuple) -> Dict[str, np.ndarray]:
+    """ Computes label, area, centroid and bounding box (max is exclusive) of every object.
+        Plane is read one tile at a time, so it can be a memory-mapped page.
+    """
+    tile_stats = [get_tile_stats(plane[window], window[0].start, window[1].start)
+                  for window in iter_windows(plane.shape, tile_shape)]
+    merged = {col: np.concatenate([s[col] for s in tile_stats]) for col in ['label'] + list(TILE_REDUCTIONS.keys())}
+    table = group_by_label(merged['label'], merged, TILE_REDUCTIONS)
+
+    table['centroid_y'] = table.pop('sum_y') / table['area']
+    table['centroid_x'] = table.pop('sum_x') / table['area']
+    return {col: table[col] for col in OBJECT_TABLE_COLUMNS}
+
+
+def write_table(table: Dict[str, np.ndarray], out_path: str):
+    """ Writes Parquet if path ends with .parquet (requires pyarrow), otherwise CSV """
+    if out_path.endswith('.parquet'):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        pq.write_table(pa.table(table), out_path)
+    else:
+        columns = list(table.keys())
+        fmt = ['%d' if np.issubdtype(table[col].dtype, np.integer) else '%.6g' for col in columns]
+        np.savetxt(out_path, np.column_stack([table[col] for col in columns]), fmt=fmt, delimiter=',',
+                   header=','.join(columns), comments='')
+
+
+def get_page_reader(path: str, page: int) -> Image:
+    """ Returns memory-mapped page if possible, so windows can be read without decoding the whole plane """
+    with storage.open_tiff(path) as TF:
+        is_memmappable = TF.pages[page].is_memmappable and not storage.is_remote(path)
+    if is_memmappable:
+        return tif.memmap(path, page=page, mode='r')
+    else:
+        return storage.imread(path, key=page)
+
+
+def get_row_reader(TF: tif.TiffFile, path: str, page: int):
+    """ Memory-mapped page if possible, otherwise the TiffPage, that is decoded by row strips with read_rows """
+    if TF.pages[page].is_memmappable and not storage.is_remote(path):
+        return tif.memmap(path, page=page, mode='r')
+    return TF.pages[page]
+
+
+def read_page_rows(page: tif.TiffPage, rows: slice) -> Image:
+    """ Decodes only strips or tiles of the page that intersect the rows """
+    height, width = page.shape[-2:]
+    y0, y1 = rows.start, min(rows.stop, height)
+    if page.samplesperpixel != 1:
+        return page.asarray()[y0:y1]
+    if page.is_tiled:
+        segment_height, nsegments_x = page.tilelength, -(-width // page.tilewidth)
+    else:
+        segment_height, nsegments_x = min(page.rowsperstrip, height), 1
+    out = np.zeros((y1 - y0, width), dtype=page.dtype)
+    fh = page.parent.filehandle
+    for segment_row in range(y0 // segment_height, -(-y1 // segment_height)):
+        for index in range(segment_row * nsegments_x, (segment_row + 1) * nsegments_x):
+            with fh.lock:
+                fh.seek(page.dataoffsets[index])
+                data = fh.read(page.databytecounts[index])
+            segment, indices, _ = page.decode(data, index)
+            if segment is None:
+                continue
+            # segment is (depth, height, width, samples), tiles at the image border extend beyond it
+            segment = segment[0, :, :, 0]
+            sy, sx = indices[3], indices[4]
+            ys = slice(max(y0, sy), min(y1, sy + segment.shape[0]))
+            xs = slice(sx, min(width, sx + segment.shape[1]))
+            out[ys.start - y0:ys.stop - y0, xs] = segment[ys.start - sy:ys.stop - sy, :xs.stop - sx]
+    return out
+
+
+def read_rows(reader, rows: slice) -> Image:
+    """ reader - memory-mapped page or TiffPage from get_row_reader """
+    if isinstance(reader, tif.TiffPage):
+        return read_page_rows(reader, rows)
+    return np.asarray(reader[rows])
+
+
+def get_channel_names(path: str, nchannels: int) -> List[str]:
+    try:
+        xml = strip_namespace(read_ome_meta(path))
+        channels = xml.find('Image').find('Pixels').findall('Channel')
+        names = [ch.get('Name') for ch in channels]
+    except Exception:
+        names = []
+    if len(names) != nchannels or None in names:
+        names = ['channel_' + str(c) for c in range(0, nchannels)]
+    return names
+
+
+def quantify_channels(mask, img_path: str, strip_rows: int) -> Tuple[Dict[str, np.ndarray], List[str]]:
+    """ Computes mean intensity of every object in every channel of the image.
+        mask - memory-mapped page or TiffPage from get_row_reader.
+        Mask and image pages are read one strip of rows at a time, also compressed and tiled pages,
+        only one channel strip is in memory at once, sums are accumulated with np.bincount.
+    """
+    with storage.open_tiff(img_path) as TF:
+        nchannels = len(TF.pages)
+        channel_names = get_channel_names(img_path, nchannels)
+        channels = [get_row_reader(TF, img_path, c) for c in range(0, nchannels)]
+
+        strip_labels = []
+        strip_sums = []
+        for rows, _ in iter_windows(mask.shape, (strip_rows, mask.shape[-1])):
+            unique_labels, inverse = np.unique(read_rows(mask, rows).ravel(), return_inverse=True)
+            sums = np.zeros((nchannels + 1, len(unique_labels)), dtype=np.float64)
+            sums[0] = np.bincount(inverse, minlength=len(unique_labels))
+            for c in range(0, nchannels):
+                sums[c + 1] = np.bincount(inverse, weights=read_rows(channels[c], rows).ravel(),
+                                          minlength=len(unique_labels))
+            strip_labels.append(unique_labels)
+            strip_sums.append(sums)
+        del channels
+
+    labels = np.concatenate(strip_labels)
+    sums = np.concatenate(strip_sums, axis=1)
+    columns = ['area'] + channel_names
+    grouped = group_by_label(labels, dict(zip(columns, sums)), {col: np.add for col in columns})
+
+    # label 0 is background
+    is_object = grouped['label'] != 0
+    table = {'label': grouped['label'][is_object], 'area': grouped['area'][is_object].astype(np.int64)}
+    for name in channel_names:
+        table[name] = grouped[name][is_object] / grouped['area'][is_object]
+    return table, channel_names
+
+
+def main(mask_path: str, img_path: str, out_path: str, strip_rows: int):
+    with storage.open_tiff(mask_path) as TF:
+        mask = get_row_reader(TF, mask_path, 0)
+        table, channel_names = quantify_channels(mask, img_path, strip_rows)
+        del mask
+    print('quantified', len(table['label']), 'objects in', len(channel_names), 'channels')
+    write_table(table, out_path)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--mask_path', type=str, required=True, help='path to stitched segmentation mask')
+    parser.add_argument('--img_path', type=str, required=True,
+                        help='path to multichannel image, e.g. mxif_combined_multilayer.ome.tiff')
+    parser.add_argument('--out_path', type=str, required=True,
+                        help='path to output table, .csv or .parquet')
+    parser.add_argument('--strip_rows', type=int, default=1000,
+                        help='number of image rows read at once, default 1000')
+    args = parser.parse_args()
+
+    main(args.mask_path, args.img_path, args.out_path, args.strip_rows)
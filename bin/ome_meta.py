@@ -0,0 +1,20 @@
+""" OME-XML helpers shared by combiners and readers of combined files, numpy is not imported """
+
+import xml.etree.ElementTree as ET
+from io import StringIO
+
+import storage
+
+
+def read_ome_meta(path: str) -> str:
+    with storage.open_tiff(path) as TF:
+        ome_meta = TF.ome_metadata
+    return ome_meta
+
+
+def strip_namespace(xmlstr: str):
+    it = ET.iterparse(StringIO(xmlstr))
+    for _, el in it:
+        _, _, el.tag = el.tag.rpartition('}')
+    root = it.root
+    return root
@@ -0,0 +1,45 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from typing import Callable, Iterable, List
+
+import numpy as np
+
+import storage
+
+
+def read_page(path: str, page: int) -> np.ndarray:
+    return storage.imread(path, key=page)
+
+
+def read_tile(path: str, page: int, block_shape: list) -> np.ndarray:
+    """ Tiles without tissue are not written by slicer, their path is None and they are returned as zeros """
+    if path is None:
+        return np.zeros(tuple(block_shape[-2:]), dtype=np.uint8)
+    return storage.imread(path, key=page)
+
+
+def prefetch(func: Callable, args_list: Iterable[tuple], depth: int = 4):
+    """ Yields func(*args) for every args in args_list in the same order,
+        while the next calls run in background threads.
+        At most depth results are in flight, which bounds the memory used by prefetched data.
+        depth 0 disables prefetching.
+    """
+    if depth < 1:
+        for args in args_list:
+            yield func(*args)
+        return
+
+    args_iter = iter(args_list)
+    with ThreadPoolExecutor(max_workers=depth) as executor:
+        in_flight = deque(executor.submit(func, *args) for args in islice(args_iter, depth))
+        while in_flight:
+            result = in_flight.popleft().result()
+            for args in islice(args_iter, 1):
+                in_flight.append(executor.submit(func, *args))
+            yield result
+
+
+def prefetch_tiles(path_list: List[str], page: int, block_shape: list, depth: int = 4):
+    """ Yields page of every tile in path_list in raster order """
+    return prefetch(read_tile, [(path, page, block_shape) for path in path_list], depth)
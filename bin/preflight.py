@@ -0,0 +1,215 @@
+""" Validation of submission inputs before any heavy compute, only TIFF headers and OME-XML are read """
+
+import argparse
+import json
+import os.path as osp
+import xml.etree.ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List
+
+import yaml
+
+from extract_from_names import extract_cycle_info_from_names
+import storage
+
+PATH_KEYS = ['mxif_dataset_dir_path', 'multichannel_ims_ometiff_positive_path',
+             'multichannel_ims_ometiff_negative_path']
+
+
+def read_submission(path: str) -> dict:
+    """ Reads submission file in the format of sample_submission.yaml, Files and Directories are replaced by paths """
+    with open(path, 'r') as s:
+        submission = yaml.safe_load(s)
+    for key, val in submission.items():
+        if isinstance(val, dict) and 'path' in val:
+            submission[key] = val['path']
+    # stages run in job directories, so relative paths are resolved against the submission file
+    for key in PATH_KEYS:
+        if submission.get(key, None) is not None and not storage.is_remote(submission[key]):
+            submission[key] = osp.abspath(osp.join(osp.dirname(osp.abspath(path)), submission[key]))
+    return submission
+
+
+def get_ome_pixels(ome_xml: str) -> dict:
+    """ Attributes of the first Pixels element and names of its channels """
+    root = ET.fromstring(ome_xml.strip())
+    for el in root.iter():
+        _, _, el.tag = el.tag.rpartition('}')
+    image = root.find('Image')
+    pixels = image.find('Pixels') if image is not None else None
+    if pixels is None:
+        return None
+    channels = pixels.findall('Channel')
+    return {'attrib': dict(pixels.attrib),
+            'channel_names': [ch.get('Name') for ch in channels],
+            'channel_fluors': [ch.get('Fluor') for ch in channels]}
+
+
+def read_header(path: str) -> dict:
+    """ Reads IFDs and OME-XML, pixel data is not read """
+    header = {'path': path, 'error': None}
+    try:
+        with storage.open_tiff(path) as TF:
+            page = TF.pages[0]
+            header['npages'] = len(TF.pages)
+            header['plane_shape'] = [int(s) for s in page.shape[-2:]]
+            header['dtype'] = str(page.dtype)
+            header['ome'] = get_ome_pixels(page.description) if TF.is_ome else None
+    except Exception as e:
+        header['error'] = type(e).__name__ + ': ' + str(e)
+    return header
+
+
+def read_headers(paths: List[str], nworkers: int = 8) -> Dict[str, dict]:
+    """ Headers of all files are read at once, most of the time is spent waiting for storage """
+    with ThreadPoolExecutor(max_workers=max(1, nworkers)) as executor:
+        headers = list(executor.map(read_header, paths))
+    return {h['path']: h for h in headers}
+
+
+def check_header(header: dict, issues: List[dict], need_units: bool = False):
+    """ need_units: OME-XML of the file is the template of the combined file, which drops PhysicalSizeXUnit """
+    path = header['path']
+    if header['error'] is not None:
+        issues.append({'level': 'error', 'path': path, 'message': 'cannot read TIFF header: ' + header['error']})
+        return
+    ome = header['ome']
+    if ome is None:
+        issues.append({'level': 'error', 'path': path, 'message': 'file has no OME-XML with Image and Pixels'})
+        return
+    if need_units:
+        for attr in ('PhysicalSizeXUnit', 'PhysicalSizeYUnit'):
+            if attr not in ome['attrib']:
+                issues.append({'level': 'error', 'path': path, 'message': 'Pixels has no ' + attr})
+    sizes = [int(ome['attrib'].get(attr, 1)) for attr in ('SizeC', 'SizeZ', 'SizeT')]
+    if sizes[0] * sizes[1] * sizes[2] != header['npages']:
+        issues.append({'level': 'warning', 'path': path,
+                       'message': 'file has {} pages, OME-XML describes SizeC*SizeZ*SizeT = {}'.format(
+                           header['npages'], sizes[0] * sizes[1] * sizes[2])})
+    if [int(ome['attrib'].get('SizeY', -1)), int(ome['attrib'].get('SizeX', -1))] != header['plane_shape']:
+        issues.append({'level': 'warning', 'path': path,
+                       'message': 'page shape {} does not match SizeY, SizeX of OME-XML'.format(header['plane_shape'])})
+
+
+def check_same_planes(headers: List[dict], issues: List[dict], what: str):
+    """ All readable files must have the same plane shape and dtype as the first one """
+    readable = [h for h in headers if h['error'] is None]
+    if readable == []:
+        return
+    first = readable[0]
+    for h in readable[1:]:
+        if h['plane_shape'] != first['plane_shape']:
+            issues.append({'level': 'error', 'path': h['path'],
+                           'message': '{} plane shape {} differs from {} of {}'.format(
+                               what, h['plane_shape'], first['plane_shape'], first['path'])})
+        if h['dtype'] != first['dtype']:
+            issues.append({'level': 'error', 'path': h['path'],
+                           'message': '{} dtype {} differs from {} of {}'.format(
+                               what, h['dtype'], first['dtype'], first['path'])})
+
+
+def check_nuclei_channel(header: dict, nuclei_channel: str, cycle: int, issues: List[dict]):
+    """ Channel names of processed OME-TIFF are checked, pipeline matches them with Fluor of raw CZI metadata """
+    if header['error'] is not None or header['ome'] is None:
+        return
+    names = [n.lower() for n in header['ome']['channel_names'] + header['ome']['channel_fluors'] if n is not None]
+    if nuclei_channel.lower() not in names:
+        issues.append({'level': 'error', 'path': header['path'],
+                       'message': 'nuclei channel {} is not found in cycle {}, channels: {}, '
+                                  'channel 0 would be used instead'.format(
+                                      nuclei_channel, cycle, ', '.join(header['ome']['channel_names']))})
+
+
+def check_submission(submission: dict, nworkers: int = 8) -> List[dict]:
+    """ Returns list of issues, each with level error or warning, path and message """
+    issues = []
+    if not submission.get('auto_block_size', False):
+        if not isinstance(submission.get('block_size', None), int) or submission['block_size'] <= 0:
+            issues.append({'level': 'error', 'path': None, 'message': 'block_size must be a positive integer'})
+    if not isinstance(submission.get('overlap', None), int) or submission['overlap'] < 0:
+        issues.append({'level': 'error', 'path': None, 'message': 'overlap must be a non-negative integer'})
+
+    mxif_dir = submission['mxif_dataset_dir_path']
+    try:
+        per_cycle_info = extract_cycle_info_from_names(mxif_dir)
+    except Exception as e:
+        issues.append({'level': 'error', 'path': mxif_dir,
+                       'message': 'cannot list MxIF dataset: ' + type(e).__name__ + ': ' + str(e)})
+        per_cycle_info = dict()
+    if per_cycle_info == {}:
+        issues.append({'level': 'error', 'path': mxif_dir, 'message': 'no processed MxIF images are found'})
+
+    # same choice of region as generate_pipeline_config.get_region
+    proc_paths = dict()
+    if per_cycle_info != {}:
+        first_cycle = min(list(per_cycle_info.keys()))
+        region = submission.get('region', None)
+        if region is None:
+            region = min(list(per_cycle_info[first_cycle].keys()))
+        for cycle in sorted(per_cycle_info.keys()):
+            if region not in per_cycle_info[cycle]:
+                issues.append({'level': 'error', 'path': mxif_dir,
+                               'message': 'region {} is not found in cycle {}'.format(region, cycle)})
+                continue
+            if 'raw_path' not in per_cycle_info[cycle][region]:
+                issues.append({'level': 'error', 'path': per_cycle_info[cycle][region]['proc_path'],
+                               'message': 'no raw CZI of cycle {} region {} in rawMicroscopy'.format(cycle, region)})
+            proc_paths[cycle] = per_cycle_info[cycle][region]['proc_path']
+
+    ims_paths = [submission.get(key, None) for key in PATH_KEYS[1:]]
+    ims_paths = [path for path in ims_paths if path is not None]
+
+    headers = read_headers(list(proc_paths.values()) + ims_paths, nworkers)
+
+    cycles = sorted(proc_paths.keys())
+    for i, cycle in enumerate(cycles):
+        header = headers[proc_paths[cycle]]
+        # OME-XML of the first cycle is the template of combined MxIF
+        check_header(header, issues, need_units=i == 0)
+        check_nuclei_channel(header, submission['nuclei_channel'], cycle, issues)
+    check_same_planes([headers[proc_paths[c]] for c in cycles], issues, 'MxIF')
+
+    for i, path in enumerate(ims_paths):
+        # OME-XML of positive IMS is the template of combined IMS, single file is copied as is
+        check_header(headers[path], issues, need_units=len(ims_paths) == 2 and i == 0)
+    check_same_planes([headers[path] for path in ims_paths], issues, 'IMS')
+    return issues
+
+
+def print_report(issues: List[dict]):
+    nerrors = sum(1 for issue in issues if issue['level'] == 'error')
+    for issue in issues:
+        print(issue['level'].upper(), issue['path'] if issue['path'] is not None else 'submission', issue['message'],
+              sep='\t')
+    print('preflight:', nerrors, 'errors,', len(issues) - nerrors, 'warnings')
+
+
+def run_preflight(submission: dict, nworkers: int = 8, out_path: str = None):
+    """ Prints report and raises ValueError if any error is found """
+    issues = check_submission(submission, nworkers)
+    print_report(issues)
+    if out_path is not None:
+        with open(out_path, 'w') as s:
+            json.dump(issues, s, indent=4)
+    nerrors = sum(1 for issue in issues if issue['level'] == 'error')
+    if nerrors > 0:
+        raise ValueError('Preflight found ' + str(nerrors) + ' errors in submission ' +
+                         str(submission.get('experiment_name', '')))
+
+
+def main(submission_path: str, region: int = None, nworkers: int = 8, out_path: str = None):
+    submission = read_submission(submission_path)
+    if region is not None:
+        submission['region'] = region
+    run_preflight(submission, nworkers, out_path)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--submission', type=str, required=True, help='path to submission file')
+    parser.add_argument('--region', type=int, default=None, help='region to check, default: region of submission')
+    parser.add_argument('--nworkers', type=int, default=8, help='number of files read at once, default 8')
+    parser.add_argument('--out_path', type=str, default=None, help='path to JSON file to save found issues')
+    args = parser.parse_args()
+
+    main(args.submission, args.region, args.nworkers, args.out_path)
@@ -0,0 +1,215 @@
+import argparse
+import copy
+import os
+import os.path as osp
+import traceback
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from typing import Dict, List
+
+from extract_from_names import extract_cycle_info_from_names
+import initiate_pipeline
+from preflight import read_submission, check_submission, print_report
+import run_combine_ims
+import run_combine_mxif
+import run_shards
+import run_slicer
+import run_stitcher
+
+# stage: stages that have to be finished before it
+STAGES = {'initiate': [],
+          'slice': ['initiate'],
+          'combine_mxif': ['initiate'],
+          'segment': ['slice'],
+          'stitch': ['segment']}
+# stages of the job that combines IMS of an experiment, no stage of region jobs reads its output
+IMS_STAGES = {'combine_ims': []}
+IMS_PATH_KEYS = ('multichannel_ims_ometiff_positive_path', 'multichannel_ims_ometiff_negative_path')
+
+
+def expand_regions(submission: dict) -> List[dict]:
+    """ One submission per region found in MxIF dataset names, unless region is given in submission """
+    if submission.get('region', None) is not None:
+        return [submission]
+    per_cycle_info = extract_cycle_info_from_names(submission['mxif_dataset_dir_path'])
+    first_cycle = min(list(per_cycle_info.keys()))
+    expanded = []
+    for region in sorted(per_cycle_info[first_cycle].keys()):
+        region_submission = copy.deepcopy(submission)
+        region_submission['region'] = region
+        expanded.append(region_submission)
+    return expanded
+
+
+def get_job_name(submission: dict) -> str:
+    name = submission['experiment_name']
+    if submission.get('region', None) is not None:
+        name += '_reg' + str(submission['region'])
+    return name
+
+
+def get_ims_jobs(submissions: List[dict]) -> Dict[str, dict]:
+    """ One IMS combining job per experiment, regions of an experiment share the same IMS files """
+    jobs = dict()
+    for submission in submissions:
+        ims_paths = [submission.get(key, None) for key in IMS_PATH_KEYS]
+        if ims_paths == [None, None]:
+            continue
+        name = submission['experiment_name'] + '_ims'
+        if name not in jobs:
+            jobs[name] = submission
+        elif [jobs[name].get(key, None) for key in IMS_PATH_KEYS] != ims_paths:
+            raise ValueError('Submissions of experiment ' + submission['experiment_name'] + ' have different IMS')
+    return jobs
+
+
+def run_stage(stage: str, job_dir: str, submission: dict, segmentation_command: str, task_workers: int):
+    """ Runs one stage of one job in a worker process. Stages write to the current directory,
+        as they do in separate containers, so the worker changes to the job directory first.
+    """
+    import dask
+
+    os.chdir(job_dir)
+    pipeline_config = osp.join('pipeline_output', 'pipeline_config.yaml')
+    cytokit_config = osp.join('pipeline_output', 'cytokit_config.yaml')
+    with dask.config.set(num_workers=task_workers):
+        if stage == 'initiate':
+            initiate_pipeline.main(submission['experiment_name'], submission['mxif_dataset_dir_path'],
+                                   submission.get('multichannel_ims_ometiff_positive_path', None),
+                                   submission.get('multichannel_ims_ometiff_negative_path', None),
+                                   submission['ngpus'], submission['nuclei_channel'],
+                                   submission['block_size'], submission['overlap'],
+                                   submission.get('skip_empty_tiles', False),
+                                   submission.get('preselect_best_focus', False),
+                                   submission.get('nshards', 1), submission.get('region', None),
+                                   submission.get('auto_block_size', False),
+                                   submission.get('rle_mask', False))
+        elif stage == 'combine_ims':
+            run_combine_ims.main(submission.get('multichannel_ims_ometiff_positive_path', None),
+                                 submission.get('multichannel_ims_ometiff_negative_path', None))
+        elif stage == 'slice':
+            run_slicer.main(pipeline_config, submission['mxif_dataset_dir_path'],
+                            submission['block_size'], submission['overlap'])
+        elif stage == 'combine_mxif':
+            run_combine_mxif.main(pipeline_config, submission['mxif_dataset_dir_path'])
+        elif stage == 'segment':
+            run_shards.main('tiles', cytokit_config, 'cytokit_out', segmentation_command)
+        elif stage == 'stitch':
+            run_stitcher.main(pipeline_config, 'cytokit_out', 'tiles')
+        else:
+            raise ValueError('Unknown stage ' + stage)
+
+
+def get_ready_stages(done: set, submitted: set, stages: Dict[str, list] = STAGES) -> List[str]:
+    return [stage for stage, deps in stages.items()
+            if stage not in submitted and all(dep in done for dep in deps)]
+
+
+def run_jobs(jobs: Dict[str, dict], job_stages: Dict[str, dict], out_dir: str, nworkers: int, task_workers: int,
+             segmentation_command: str, nsegment: int) -> Dict[str, str]:
+    """ Stages of all jobs share one process pool, a stage is submitted as soon as stages it depends on are done.
+        At most nsegment segmentation stages run at once, because they share GPUs.
+        Failed job does not stop other jobs. Returns error of every failed job.
+    """
+    done = {name: set() for name in jobs}
+    submitted = {name: set() for name in jobs}
+    failed = dict()
+    running = dict()
+
+    with ProcessPoolExecutor(max_workers=nworkers) as pool:
+        while True:
+            nsegment_running = sum(1 for _, stage in running.values() if stage == 'segment')
+            for name, submission in jobs.items():
+                if name in failed:
+                    continue
+                for stage in get_ready_stages(done[name], submitted[name], job_stages[name]):
+                    if stage == 'segment':
+                        if nsegment_running >= nsegment:
+                            continue
+                        nsegment_running += 1
+                    job_dir = osp.join(out_dir, name)
+                    future = pool.submit(run_stage, stage, job_dir, submission, segmentation_command, task_workers)
+                    running[future] = (name, stage)
+                    submitted[name].add(stage)
+            if not running:
+                break
+
+            finished, _ = wait(list(running.keys()), return_when=FIRST_COMPLETED)
+            for future in finished:
+                name, stage = running.pop(future)
+                error = future.exception()
+                if error is None:
+                    done[name].add(stage)
+                    print(name, stage, 'done')
+                else:
+                    failed[name] = stage + ': ' + ''.join(traceback.format_exception_only(type(error), error)).strip()
+                    print(name, stage, 'failed:', failed[name])
+    return failed
+
+
+def main(submission_paths: List[str], out_dir: str, all_regions: bool = False, nworkers: int = 0,
+         task_workers: int = 0, segmentation_command: str = run_shards.CYTOKIT_COMMAND, nsegment: int = 1):
+    submissions = [read_submission(path) for path in submission_paths]
+    if all_regions:
+        submissions = [expanded for submission in submissions for expanded in expand_regions(submission)]
+
+    jobs = dict()
+    for submission in submissions:
+        name = get_job_name(submission)
+        if name in jobs:
+            raise ValueError('Two submissions have the same experiment name and region: ' + name)
+        jobs[name] = submission
+
+    # inputs of all jobs are validated before any stage starts, so a broken job does not fail hours later
+    nerrors = 0
+    for name, submission in jobs.items():
+        print('preflight of', name)
+        issues = check_submission(submission)
+        print_report(issues)
+        nerrors += sum(1 for issue in issues if issue['level'] == 'error')
+    if nerrors > 0:
+        raise ValueError('Preflight found ' + str(nerrors) + ' errors, no jobs were started')
+
+    job_stages = {name: STAGES for name in jobs}
+    for name, submission in get_ims_jobs(submissions).items():
+        if name in jobs:
+            raise ValueError('Job name of combined IMS is already used by a submission: ' + name)
+        jobs[name] = submission
+        job_stages[name] = IMS_STAGES
+    for name in jobs:
+        job_dir = osp.join(out_dir, name)
+        if not osp.exists(job_dir):
+            os.makedirs(job_dir)
+
+    ncpus = os.cpu_count() or 1
+    nworkers = nworkers if nworkers > 0 else ncpus
+    task_workers = task_workers if task_workers > 0 else max(1, ncpus // nworkers)
+    print('running', len(jobs), 'jobs on', nworkers, 'workers with', task_workers, 'threads per stage')
+
+    failed = run_jobs(jobs, job_stages, osp.abspath(out_dir), nworkers, task_workers, segmentation_command, nsegment)
+    print(len(jobs) - len(failed), 'of', len(jobs), 'jobs finished')
+    for name, error in failed.items():
+        print(name, 'failed at', error)
+    if failed:
+        raise RuntimeError(str(len(failed)) + ' jobs failed')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--submissions', type=str, nargs='+', required=True,
+                        help='space separated paths to submission files, as sample_submission.yaml')
+    parser.add_argument('--out_dir', type=str, required=True,
+                        help='path to output directory, every job writes to out_dir/<experiment_name>_reg<region>')
+    parser.add_argument('--all_regions', action='store_true',
+                        help='run a job for every region found in MxIF dataset of submissions without region')
+    parser.add_argument('--nworkers', type=int, default=0,
+                        help='number of stages that run at once, default 0 - number of cores')
+    parser.add_argument('--task_workers', type=int, default=0,
+                        help='number of dask workers inside one stage, default 0 - cores divided by nworkers')
+    parser.add_argument('--segmentation_command', type=str, default=run_shards.CYTOKIT_COMMAND,
+                        help='segmentation command template, see run_shards.py. Default: Cytokit')
+    parser.add_argument('--nsegment', type=int, default=1,
+                        help='number of segmentation stages that run at once, default 1')
+    args = parser.parse_args()
+
+    main(args.submissions, args.out_dir, args.all_regions, args.nworkers, args.task_workers,
+         args.segmentation_command, args.nsegment)
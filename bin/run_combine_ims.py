@@ -1,22 +1,33 @@
 import argparse
 import shutil
 
-import combine_ims
 
-
-def main(ims_pos_path: str, ims_neg_path):
+def main(ims_pos_path: str, ims_neg_path, use_memmap: bool = False, sparse: bool = False):
+    # modules are imported only on the path that needs them, copying a single file does not import dask
     ims_combined_out_path = 'ims_combined_multilayer.ome.tiff'
 
     # Will run combine_ims.py if both positive and negative paths are provided
     # Otherwise will just copy file to output folder
     if ims_pos_path is not None and ims_neg_path is not None:
-        combine_ims.main(ims_pos_path, ims_neg_path, ims_combined_out_path)
+        import combine_ims
+        combine_ims.main(ims_pos_path, ims_neg_path, ims_combined_out_path, use_memmap)
 
-    # if one of path is None
+    # if one of path is None, file in object store is downloaded first
     elif ims_pos_path is not None and ims_neg_path is None:
-        shutil.copy(ims_pos_path, ims_combined_out_path)
+        import storage
+        shutil.copy(storage.get_local_copy(ims_pos_path), ims_combined_out_path)
     elif ims_pos_path is None and ims_neg_path is not None:
-        shutil.copy(ims_neg_path, ims_combined_out_path)
+        import storage
+        shutil.copy(storage.get_local_copy(ims_neg_path), ims_combined_out_path)
+
+    # combine_ims writes the index itself, copied file gets it here
+    if ims_pos_path is None or ims_neg_path is None:
+        import channel_index
+        channel_index.main(ims_combined_out_path)
+
+    if sparse:
+        import ims_spectra
+        ims_spectra.main(ims_combined_out_path)
 
 
 if __name__ == '__main__':
@@ -25,6 +36,12 @@ if __name__ == '__main__':
                         help='path positive multichannel IMS OME-TIFF')
     parser.add_argument('--multichannel_ims_ometiff_negative_path', type=str,
                         help='path negative multichannel IMS OME-TIFF')
+    parser.add_argument('--memmap', action='store_true',
+                        help='copy pages directly into memory-mapped uncompressed output file')
+    parser.add_argument('--sparse', action='store_true',
+                        help='also store tissue pixels as (pixels x channels) Zarr array ' +
+                             'ims_combined_multilayer.spectra.zarr')
     args = parser.parse_args()
 
-    main(args.multichannel_ims_ometiff_positive_path, args.multichannel_ims_ometiff_negative_path)
+    main(args.multichannel_ims_ometiff_positive_path, args.multichannel_ims_ometiff_negative_path, args.memmap,
+         args.sparse)
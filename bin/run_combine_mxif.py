@@ -5,28 +5,35 @@ import re
 
 import yaml
 
-import combine_mxif
 from extract_from_names import extract_cycle_info_from_names
 
 
-def main(pipeline_config: str, mxif_dataset_dir_path: str):
+def main(pipeline_config: str, mxif_dataset_dir_path: str, use_memmap: bool = False, layout: str = 'planar'):
+    # combine_mxif imports numpy, tifffile and dask, they are not needed to parse arguments
+    import combine_mxif
+
     with open(pipeline_config, 'r') as s:
         pipeline_config = yaml.safe_load(s)
 
     per_cycle_info = extract_cycle_info_from_names(mxif_dataset_dir_path)
+    # region processed by this pipeline run, if not set all regions are combined
+    region = pipeline_config['submission'].get('region', None)
 
     mxif_data_paths = []
     total_cycles = list(per_cycle_info.keys())
     for c in total_cycles:
         this_cycle_info = per_cycle_info[c]
-        regions = list(this_cycle_info.keys())
+        regions = list(this_cycle_info.keys()) if region is None else [region]
         for r in regions:
             proc_img_path = this_cycle_info[r]['proc_path']
             mxif_data_paths.append(proc_img_path)
 
-    mxif_combined_out_path = 'mxif_combined_multilayer.ome.tiff'
+    if layout == 'zarr':
+        mxif_combined_out_path = 'mxif_combined_multilayer.zarr'
+    else:
+        mxif_combined_out_path = 'mxif_combined_multilayer.ome.tiff'
 
-    combine_mxif.main(pipeline_config, mxif_data_paths, mxif_combined_out_path)
+    combine_mxif.main(pipeline_config, mxif_data_paths, mxif_combined_out_path, use_memmap, layout)
 
 
 if __name__ == '__main__':
@@ -34,6 +41,11 @@ if __name__ == '__main__':
     parser.add_argument('--pipeline_config', type=str, help='path pipeline config')
     parser.add_argument('--mxif_dataset_dir_path', type=str,
                         help='path to directory with MxIF datasets. Contains two directories: processedMicroscopy, rawMicroscopy')
+    parser.add_argument('--memmap', action='store_true',
+                        help='copy pages directly into memory-mapped uncompressed output file')
+    parser.add_argument('--layout', type=str, default='planar',
+                        help='planar - one page per channel, interleaved - all channels of a tile stored together ' +
+                             'in one tiled page, zarr - mxif_combined_multilayer.zarr. Default: planar')
     args = parser.parse_args()
 
-    main(args.pipeline_config, args.mxif_dataset_dir_path)
+    main(args.pipeline_config, args.mxif_dataset_dir_path, args.memmap, args.layout)
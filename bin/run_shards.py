@@ -0,0 +1,61 @@
+import argparse
+import os
+import os.path as osp
+import shlex
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+from tile_manifest import MANIFEST_NAME, read_manifest
+from shards import get_shard_config_path
+
+# same command as in steps/run_cytokit.cwl
+CYTOKIT_COMMAND = 'cytokit processor run_all --data-dir {data_dir} --config-path {config_path} --output-dir {output_dir}'
+
+
+def get_shard_commands(command: str, slicer_out_dir: str, cytokit_config_path: str, out_dir: str) -> list:
+    """ Fills command template for every shard listed in the slicer manifest.
+        Template fields: data_dir - slicer shard directory, config_path - Cytokit config of the shard,
+        output_dir - segmentation output of the shard, shard - shard index.
+    """
+    manifest = read_manifest(osp.join(slicer_out_dir, MANIFEST_NAME))
+    shards = manifest.get('shards', [dict(dir='')])
+    commands = []
+    for s, shard in enumerate(shards):
+        config_path = cytokit_config_path if 'shards' not in manifest else get_shard_config_path(cytokit_config_path, s)
+        commands.append(command.format(data_dir=osp.join(slicer_out_dir, shard['dir']),
+                                       config_path=config_path,
+                                       output_dir=osp.join(out_dir, shard['dir']),
+                                       shard=s))
+    return commands
+
+
+def run_command(command: str):
+    print('running', command)
+    subprocess.run(shlex.split(command), check=True)
+
+
+def main(slicer_out_dir: str, cytokit_config_path: str, out_dir: str, command: str = CYTOKIT_COMMAND,
+         nworkers: int = 1):
+    """ Runs segmentation of every shard locally. On a cluster the same commands are submitted as separate jobs,
+        segmentation output of shard shard_000 is expected in out_dir/shard_000, as run_stitcher does.
+    """
+    if not osp.exists(out_dir):
+        os.makedirs(out_dir)
+    commands = get_shard_commands(command, slicer_out_dir, cytokit_config_path, out_dir)
+    with ThreadPoolExecutor(max_workers=nworkers) as executor:
+        list(executor.map(run_command, commands))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--slicer_out_dir', type=str, required=True, help='path to slicer output directory')
+    parser.add_argument('--cytokit_config_path', type=str, required=True,
+                        help='path to cytokit config, configs of shards are next to it')
+    parser.add_argument('--out_dir', type=str, required=True, help='path to segmentation output directory')
+    parser.add_argument('--command', type=str, default=CYTOKIT_COMMAND,
+                        help='segmentation command template with fields {data_dir}, {config_path}, {output_dir}, ' +
+                             '{shard}. Default: Cytokit')
+    parser.add_argument('--nworkers', type=int, default=1, help='number of shards segmented at once, default 1')
+    args = parser.parse_args()
+
+    main(args.slicer_out_dir, args.cytokit_config_path, args.out_dir, args.command, args.nworkers)
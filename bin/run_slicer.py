@@ -4,21 +4,28 @@ import argparse
 
 import yaml
 
-import slicer
+import tiling_planner
+from tile_manifest import SEGMENTATION_REGION
 
 from extract_from_names import extract_cycle_info_from_names
 
 
 def main(pipeline_config: str, mxif_dataset_dir_path: str, block_size: int, overlap: int):
+    # slicer imports numpy, tifffile and dask, they are not needed to parse arguments
+    import dask
+    import slicer
+
     with open(pipeline_config, 'r') as s:
         config = yaml.safe_load(s)
 
     ome_meta = config['ome_meta']
+    # block size may be selected by the planner when pipeline config was generated
+    block_size = config['submission'].get('block_size', block_size)
     num_z_planes = ome_meta['num_z_planes']
     num_channels = len(ome_meta['channel_names'])
     per_cycle_info = extract_cycle_info_from_names(mxif_dataset_dir_path)
     cycle = min(list(per_cycle_info.keys()))
-    region = min(list(per_cycle_info[cycle].keys()))
+    region = config['submission'].get('region', min(list(per_cycle_info[cycle].keys())))
 
     in_path = per_cycle_info[cycle][region]['proc_path']
     output_dir = 'tiles'
@@ -30,8 +37,22 @@ def main(pipeline_config: str, mxif_dataset_dir_path: str, block_size: int, over
     nuclei_channel = int(per_cycle_channel_names[0].lstrip('CH')) - 1
     selected_channels = [nuclei_channel]
 
-    slicer.main(in_path, output_dir, block_size, 0, overlap, cycle, region,
-                int(num_z_planes), int(num_channels), selected_channels)
+    # tiles without tissue found when pipeline config was generated
+    empty_tiles = config['slicer_meta'].get('empty_tiles', [])
+    # z-planes selected with CPU focus metric, if present only one plane per tile is sliced
+    best_focus_z = config['slicer_meta'].get('best_focus_z', None)
+    # tile rows are partitioned into shards, that are segmented separately
+    nshards = max(1, len(config['slicer_meta'].get('shards', [])))
+
+    # workers and prefetch depth tuned on this machine, workers set by the caller, e.g. batch mode, have priority
+    tuned = tiling_planner.get_tuned_config('slicer')
+    num_workers = dask.config.get('num_workers', None) or tuned.get('num_workers', None)
+
+    with dask.config.set(num_workers=num_workers):
+        slicer.main(in_path, output_dir, block_size, 0, overlap, cycle, SEGMENTATION_REGION,
+                    int(num_z_planes), int(num_channels), selected_channels,
+                    prefetch_depth=tuned.get('prefetch', 1),
+                    empty_tiles=empty_tiles, best_focus_z=best_focus_z, nshards=nshards)
 
 
 if __name__ == '__main__':
@@ -4,10 +4,16 @@ import os.path as osp
 
 import yaml
 
-import stitcher
+import tiling_planner
+from tile_manifest import MANIFEST_NAME, read_manifest
 
 
-def main(pipeline_config: str, cytokit_out_dir: str):
+def main(pipeline_config: str, cytokit_out_dir: str, slicer_out_dir: str = None):
+    # stitcher imports numpy, tifffile and dask, they are not needed to parse arguments
+    import dask
+    import stitcher
+    from label_rle import get_rle_path
+
     with open(pipeline_config, 'r') as s:
         config = yaml.safe_load(s)
     slicer_meta = config['slicer_meta']
@@ -19,13 +25,32 @@ def main(pipeline_config: str, cytokit_out_dir: str):
 
     stitcher_out_path = 'segmentation_mask_stitched.ome.tiff'
 
-    stitcher.main(tiles, stitcher_out_path, overlap, padding)
+    manifest_path = None
+    if slicer_out_dir is not None and osp.exists(osp.join(slicer_out_dir, MANIFEST_NAME)):
+        manifest_path = osp.join(slicer_out_dir, MANIFEST_NAME)
+        manifest = read_manifest(manifest_path)
+        if 'shards' in manifest:
+            # every shard was segmented separately, output of each shard is in its own directory
+            tiles = [osp.join(cytokit_out_dir, shard['dir'], 'cytometry', 'tile') for shard in manifest['shards']]
+
+    # run-length encoded labels with object index, for transfer and per-object queries
+    rle_path = get_rle_path(stitcher_out_path) if config['submission'].get('rle_mask', False) else None
+
+    # workers and prefetch depth tuned on this machine, workers set by the caller, e.g. batch mode, have priority
+    tuned = tiling_planner.get_tuned_config('stitcher')
+    num_workers = dask.config.get('num_workers', None) or tuned.get('num_workers', None)
+
+    with dask.config.set(num_workers=num_workers):
+        stitcher.main(tiles, stitcher_out_path, overlap, padding, manifest_path,
+                      prefetch_depth=tuned.get('prefetch', 4), rle_path=rle_path)
 
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument('--pipeline_config', type=str, help='path to pipeline config')
     parser.add_argument('--cytokit_out_dir', type=str, help='path to cytokit output directory')
+    parser.add_argument('--slicer_out_dir', type=str, default=None,
+                        help='path to slicer output directory with tile manifest')
     args = parser.parse_args()
 
-    main(args.pipeline_config, args.cytokit_out_dir)
+    main(args.pipeline_config, args.cytokit_out_dir, args.slicer_out_dir)
@@ -0,0 +1,158 @@
+import argparse
+import importlib
+import os
+import os.path as osp
+import re
+from typing import Callable, Dict, Tuple
+
+import numpy as np
+import tifffile as tif
+import yaml
+
+from tile_manifest import MANIFEST_NAME, CYTOKIT_TILE_NAME, read_manifest
+from boundaries import get_boundaries
+
+Image = np.ndarray
+
+DEFAULT_CPU_PARAMS = {'sigma': 1.0, 'min_size': 20, 'min_distance': 5, 'cell_expansion': 5, 'min_contrast': 3.0}
+
+# 1-based channel in names of slicer tiles: 1_00001_Z001_CH1.tif
+TILE_CHANNEL_PATTERN = re.compile(r'_CH(\d+)\.tiff?$')
+
+
+def segment_cpu(img: Image, params: dict) -> Tuple[Image, Image]:
+    """ Nucleus thresholding with Otsu and watershed on distance transform to split touching nuclei.
+        Cells are nuclei expanded by cell_expansion pixels without overlapping each other.
+        Tiles where foreground is less than min_contrast background standard deviations
+        brighter than background contain only noise and get no objects.
+        Returns cells and nuclei labels.
+    """
+    from scipy import ndimage as ndi
+    from skimage.feature import peak_local_max
+    from skimage.segmentation import watershed
+    from slicer import otsu_threshold
+
+    params = dict(DEFAULT_CPU_PARAMS, **params)
+    # zero padding added by slicer to the tiles at the image border is not background,
+    # it is filled with the median so it does not affect the threshold and smoothing
+    valid = img > 0
+    if valid.sum() < 2:
+        empty = np.zeros(img.shape, dtype=np.uint32)
+        return empty, empty.copy()
+    img = img.astype(np.float32)
+    img[~valid] = np.median(img[valid])
+    smooth = ndi.gaussian_filter(img, params['sigma'])
+    mask = (smooth > otsu_threshold(smooth[valid])) & valid
+    bg = valid & ~mask
+    if not mask.any() or not bg.any() or \
+            smooth[mask].mean() - smooth[bg].mean() < params['min_contrast'] * smooth[bg].std():
+        empty = np.zeros(img.shape, dtype=np.uint32)
+        return empty, empty.copy()
+
+    components, ncomponents = ndi.label(mask)
+    sizes = np.bincount(components.ravel())
+    mask &= sizes[components] >= params['min_size']
+
+    distance = ndi.distance_transform_edt(mask)
+    peaks = peak_local_max(distance, min_distance=params['min_distance'], labels=ndi.label(mask)[0])
+    markers = np.zeros(img.shape, dtype=np.int32)
+    markers[tuple(peaks.T)] = np.arange(1, len(peaks) + 1)
+    nuclei = watershed(-distance, markers, mask=mask).astype(np.uint32)
+
+    distance_to_nuclei = ndi.distance_transform_edt(nuclei == 0)
+    cells = watershed(distance_to_nuclei, nuclei, mask=distance_to_nuclei <= params['cell_expansion'])
+    return cells.astype(np.uint32), nuclei
+
+
+# backend takes nuclei image and parameters and returns cells and nuclei labels
+SEGMENTATION_BACKENDS = {'cpu': segment_cpu}
+
+
+def get_backend(name: str) -> Callable[[Image, dict], Tuple[Image, Image]]:
+    """ name - one of SEGMENTATION_BACKENDS or path to function, e.g. my_package.my_module:segment """
+    if name in SEGMENTATION_BACKENDS:
+        return SEGMENTATION_BACKENDS[name]
+    if ':' not in name:
+        raise ValueError('Unknown segmentation backend ' + name + ', available: ' + ', '.join(SEGMENTATION_BACKENDS))
+    module_name, func_name = name.split(':')
+    return getattr(importlib.import_module(module_name), func_name)
+
+
+def get_tile_channel(path: str) -> int:
+    match = TILE_CHANNEL_PATTERN.search(osp.basename(path))
+    if match is None:
+        raise ValueError('Channel is not found in tile name ' + path)
+    return int(match.group(1))
+
+
+def read_nuclei_tile(data_dir: str, tile: dict, nuclei_channel: int = None) -> Image:
+    """ Reads the sliced nuclei channel of the tile, if there are several z-planes the sharpest is used.
+        nuclei_channel - 1-based channel of tile names, can be omitted if only one channel was sliced
+    """
+    channels = sorted({get_tile_channel(f['path']) for f in tile['files']})
+    if nuclei_channel is None:
+        if len(channels) > 1:
+            raise ValueError('Tile ' + str(tile['tile']) + ' has channels ' + ', '.join(str(c) for c in channels) +
+                             ', nuclei channel has to be selected')
+        nuclei_channel = channels[0]
+    files = [f for f in tile['files'] if get_tile_channel(f['path']) == nuclei_channel]
+    if files == []:
+        raise ValueError('Tile ' + str(tile['tile']) + ' has no channel ' + str(nuclei_channel))
+    planes = [tif.imread(osp.join(data_dir, f['path'])) for f in files]
+    if len(planes) == 1:
+        return planes[0]
+    from slicer import get_focus_metric
+
+    return planes[int(np.argmax([get_focus_metric(p) for p in planes]))]
+
+
+def segment_tile(data_dir: str, tile: dict, out_path: str, backend: str, params: dict, nuclei_channel: int = None):
+    img = read_nuclei_tile(data_dir, tile, nuclei_channel)
+    cells, nuclei = get_backend(backend)(img, params)
+    # same pages as Cytokit output: cells, nuclei, cell_boundaries, nucleus_boundaries
+    stack = np.stack([cells, nuclei, get_boundaries(cells), get_boundaries(nuclei)]).astype(np.uint32)
+    tif.imwrite(out_path, stack, photometric='minisblack')
+
+
+def main(data_dir: str, out_dir: str, backend: str = 'cpu', params: Dict = None, nworkers: int = 0,
+         nuclei_channel: int = None):
+    """ data_dir - slicer output directory or one of its shard directories.
+        Writes Cytokit-style output to out_dir/cytometry/tile, tiles without tissue are skipped.
+    """
+    # slicer and dask are imported in functions that use them, so --help and backend modules start fast
+    import dask
+
+    params = {} if params is None else params
+    manifest = read_manifest(osp.join(data_dir, MANIFEST_NAME))
+    tile_dir = osp.join(out_dir, 'cytometry', 'tile')
+    if not osp.exists(tile_dir):
+        os.makedirs(tile_dir)
+
+    task = []
+    for tile in manifest['tiles']:
+        if tile.get('empty', False) or tile['files'] == []:
+            continue
+        out_path = osp.join(tile_dir, CYTOKIT_TILE_NAME.format(region=manifest['region'], x=tile['x'], y=tile['y']))
+        task.append(dask.delayed(segment_tile)(data_dir, tile, out_path, backend, params, nuclei_channel))
+    print('segmenting', len(task), 'tiles')
+    num_workers = nworkers if nworkers > 0 else None
+    dask.compute(*task, scheduler='processes', num_workers=num_workers)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--data_dir', type=str, required=True,
+                        help='path to slicer output directory or shard directory with tile manifest')
+    parser.add_argument('--out_dir', type=str, required=True,
+                        help='path to output directory, tiles are written to out_dir/cytometry/tile')
+    parser.add_argument('--backend', type=str, default='cpu',
+                        help='segmentation backend: cpu or path to function, e.g. my_module:segment. Default: cpu')
+    parser.add_argument('--params', type=yaml.safe_load, default=None,
+                        help='backend parameters, e.g. "{sigma: 1, min_distance: 5}"')
+    parser.add_argument('--nworkers', type=int, default=0, help='number of processes, default 0 - all cores')
+    parser.add_argument('--nuclei_channel', type=int, default=None,
+                        help='1-based channel of tile names (CH1) with nuclei, ' +
+                             'required only if several channels were sliced')
+    args = parser.parse_args()
+
+    main(args.data_dir, args.out_dir, args.backend, args.params, args.nworkers, args.nuclei_channel)
@@ -0,0 +1,90 @@
+import copy
+import os
+import os.path as osp
+from typing import List, Tuple
+
+from tile_manifest import write_manifest
+
+# directory of one shard inside slicer and segmentation output directories
+SHARD_DIR_NAME = 'shard_{shard:03d}'
+
+
+def get_shard_rows(y_nblocks: int, nshards: int) -> List[Tuple[int, int]]:
+    """ Splits rows of the tile grid into contiguous blocks of nearly equal size.
+        Returns (first row, last row + 1) for every shard, there are no more shards than rows.
+    """
+    nshards = max(1, min(nshards, y_nblocks))
+    base, extra = divmod(y_nblocks, nshards)
+    shard_rows = []
+    row_start = 0
+    for s in range(0, nshards):
+        row_stop = row_start + base + (1 if s < extra else 0)
+        shard_rows.append((row_start, row_stop))
+        row_start = row_stop
+    return shard_rows
+
+
+def get_shard_config_path(cytokit_config_path: str, shard: int) -> str:
+    """ cytokit_config.yaml -> cytokit_config_shard_000.yaml """
+    base, ext = osp.splitext(cytokit_config_path)
+    return base + '_' + SHARD_DIR_NAME.format(shard=shard) + ext
+
+
+def get_local_tile_indexes(empty_tiles: list, x_nblocks: int, row_start: int, row_stop: int) -> List[int]:
+    """ Returns 0-based indexes of tiles with tissue inside the shard, as used by Cytokit tile_indexes """
+    empty_tiles = set(empty_tiles)
+    first_tile = row_start * x_nblocks + 1
+    ntiles = (row_stop - row_start) * x_nblocks
+    return [t for t in range(0, ntiles) if first_tile + t not in empty_tiles]
+
+
+def rename_tile_file(name: str, tile: int) -> str:
+    """ Replaces tile number in the slicer output name: 1_00007_Z001_CH1.tif -> 1_00002_Z001_CH1.tif """
+    parts = name.split('_')
+    parts[1] = '{tile:05d}'.format(tile=tile)
+    return '_'.join(parts)
+
+
+def partition_tiles(base_out_dir: str, manifest: dict, nshards: int) -> dict:
+    """ Moves slicer tiles into one directory per shard, tiles are renumbered inside the shard,
+        so every shard is a complete tile grid that can be segmented on its own.
+        Each shard directory gets its own manifest, the returned manifest of the whole grid lists the shards.
+    """
+    x_nblocks = manifest['nblocks']['x']
+    shard_rows = get_shard_rows(manifest['nblocks']['y'], nshards)
+    manifest = copy.deepcopy(manifest)
+    manifest['shards'] = []
+    src_dirs = set()
+
+    for s, (row_start, row_stop) in enumerate(shard_rows):
+        shard_dir_name = SHARD_DIR_NAME.format(shard=s)
+        shard_manifest = copy.deepcopy(manifest)
+        del shard_manifest['shards']
+        shard_manifest['nblocks']['y'] = row_stop - row_start
+        shard_manifest['shard'] = dict(index=s, nshards=len(shard_rows), row_start=row_start, row_stop=row_stop)
+        shard_manifest['tiles'] = []
+
+        for tile in manifest['tiles'][row_start * x_nblocks: row_stop * x_nblocks]:
+            shard_tile = copy.deepcopy(tile)
+            shard_tile['y'] = tile['y'] - row_start
+            shard_tile['tile'] = tile['tile'] - row_start * x_nblocks
+            for file, shard_file in zip(tile['files'], shard_tile['files']):
+                src_dir, name = osp.split(file['path'])
+                src_dirs.add(src_dir)
+                shard_file['path'] = osp.join(src_dir, rename_tile_file(name, shard_tile['tile']))
+                dst_path = osp.join(base_out_dir, shard_dir_name, shard_file['path'])
+                if not osp.exists(osp.dirname(dst_path)):
+                    os.makedirs(osp.dirname(dst_path))
+                os.replace(osp.join(base_out_dir, file['path']), dst_path)
+                file['path'] = osp.join(shard_dir_name, shard_file['path'])
+            shard_manifest['tiles'].append(shard_tile)
+
+        if not osp.exists(osp.join(base_out_dir, shard_dir_name)):
+            os.makedirs(osp.join(base_out_dir, shard_dir_name))
+        write_manifest(shard_manifest, osp.join(base_out_dir, shard_dir_name))
+        manifest['shards'].append(dict(dir=shard_dir_name, row_start=row_start, row_stop=row_stop))
+
+    for src_dir in src_dirs:
+        if os.listdir(osp.join(base_out_dir, src_dir)) == []:
+            os.rmdir(osp.join(base_out_dir, src_dir))
+    return manifest
@@ -7,6 +7,11 @@ import numpy as np
 import tifffile as tif
 import dask
 
+from tile_manifest import create_manifest, add_tile_file, mark_empty_tiles, set_best_focus_z, write_manifest
+from prefetch import prefetch, read_page
+from shards import partition_tiles
+import storage
+
 
 def get_block(arr, hor_f: int, hor_t: int, ver_f: int, ver_t: int, overlap=0):
     hor_f -= overlap
@@ -45,17 +50,19 @@ def get_block(arr, hor_f: int, hor_t: int, ver_f: int, ver_t: int, overlap=0):
     return block
 
 
+def get_nblocks(arr_shape: tuple, block_w: int, block_h: int):
+    arr_width, arr_height = arr_shape[-1], arr_shape[-2]
+    x_nblocks = arr_width // block_w if arr_width % block_w == 0 else (arr_width // block_w) + 1
+    y_nblocks = arr_height // block_h if arr_height % block_h == 0 else (arr_height // block_h) + 1
+    return x_nblocks, y_nblocks
+
+
 def split_by_size(arr: np.ndarray, region: int, zplane: int, channel: int, block_w: int, block_h: int, overlap: int):
     """ Splits image into blocks by size of block.
         block_w - block width
         block_h - block height
     """
-    x_axis = -1
-    y_axis = -2
-    arr_width, arr_height = arr.shape[x_axis], arr.shape[y_axis]
-
-    x_nblocks = arr_width // block_w if arr_width % block_w == 0 else (arr_width // block_w) + 1
-    y_nblocks = arr_height // block_h if arr_height % block_h == 0 else (arr_height // block_h) + 1
+    x_nblocks, y_nblocks = get_nblocks(arr.shape, block_w, block_h)
 
     blocks = []
     img_names = []
@@ -84,6 +91,80 @@ def split_by_size(arr: np.ndarray, region: int, zplane: int, channel: int, block
     return blocks, img_names
 
 
+def downsample(arr: np.ndarray, factor: int) -> np.ndarray:
+    """ Downsamples image by averaging factor x factor blocks, incomplete blocks at the edges are dropped """
+    height = arr.shape[-2] // factor * factor
+    width = arr.shape[-1] // factor * factor
+    arr = arr[:height, :width].astype(np.float32)
+    return arr.reshape(height // factor, factor, width // factor, factor).mean(axis=(1, 3))
+
+
+def otsu_threshold(arr: np.ndarray, nbins: int = 256) -> float:
+    hist, bin_edges = np.histogram(arr, bins=nbins)
+    bin_centers = (bin_edges[:-1] + bin_edges[1:]) / 2
+    hist = hist.astype(np.float64)
+
+    weight_bg = np.cumsum(hist)
+    weight_fg = np.cumsum(hist[::-1])[::-1]
+    mean_bg = np.cumsum(hist * bin_centers) / np.maximum(weight_bg, 1)
+    mean_fg = (np.cumsum((hist * bin_centers)[::-1]) / np.maximum(np.cumsum(hist[::-1]), 1))[::-1]
+
+    # between class variance for threshold after every bin
+    variance = weight_bg[:-1] * weight_fg[1:] * (mean_bg[:-1] - mean_fg[1:]) ** 2
+    return bin_centers[:-1][np.argmax(variance)]
+
+
+def get_empty_tiles(arr: np.ndarray, block_w: int, block_h: int, overlap: int, factor: int = 16) -> list:
+    """ Finds tiles without tissue using Otsu threshold of downsampled nuclei channel.
+        Tile together with its overlap must not contain any pixel above threshold to be considered empty.
+        Returns 1-based tile numbers, same as in slicer output names.
+    """
+    x_nblocks, y_nblocks = get_nblocks(arr.shape, block_w, block_h)
+    thumbnail = downsample(arr, factor)
+    if thumbnail.size == 0 or thumbnail.min() == thumbnail.max():
+        return []
+    tissue = thumbnail > otsu_threshold(thumbnail)
+
+    empty_tiles = []
+    for i in range(0, y_nblocks):
+        ver_f = max(block_h * i - overlap, 0) // factor
+        ver_t = -(-(block_h * (i + 1) + overlap) // factor)
+        for j in range(0, x_nblocks):
+            hor_f = max(block_w * j - overlap, 0) // factor
+            hor_t = -(-(block_w * (j + 1) + overlap) // factor)
+            if not tissue[ver_f:ver_t, hor_f:hor_t].any():
+                empty_tiles.append(i * x_nblocks + j + 1)
+    return empty_tiles
+
+
+def get_focus_metric(arr: np.ndarray) -> float:
+    """ Variance of Laplacian, higher values mean sharper image """
+    arr = arr.astype(np.float32)
+    laplacian = (arr[:-2, 1:-1] + arr[2:, 1:-1] + arr[1:-1, :-2] + arr[1:-1, 2:]) - 4 * arr[1:-1, 1:-1]
+    return float(laplacian.var())
+
+
+def get_tile_focus_metrics(arr: np.ndarray, block_w: int, block_h: int) -> list:
+    x_nblocks, y_nblocks = get_nblocks(arr.shape, block_w, block_h)
+    task = []
+    for i in range(0, y_nblocks):
+        for j in range(0, x_nblocks):
+            block = get_block(arr, block_w * j, block_w * (j + 1), block_h * i, block_h * (i + 1))
+            task.append(dask.delayed(get_focus_metric)(block))
+    return list(dask.compute(*task, scheduler='threads'))
+
+
+def get_best_focus_z(in_path: str, channel: int, nzplanes: int, block_w: int, block_h: int) -> list:
+    """ Returns 0-based index of the sharpest z-plane for every tile in raster order.
+        Only one plane is kept in memory at a time.
+    """
+    metrics = []
+    for z in range(0, nzplanes):
+        plane = storage.imread(in_path, key=channel * nzplanes + z)
+        metrics.append(get_tile_focus_metrics(plane, block_w, block_h))
+    return np.argmax(np.array(metrics), axis=0).tolist()
+
+
 def split_by_nblocks(arr: np.ndarray, region: int, zplane: int, channel: int, x_nblocks: int, y_nblocks: int,
                      overlap: int):
     """ Splits image into blocks by number of block.
@@ -96,49 +177,79 @@ def split_by_nblocks(arr: np.ndarray, region: int, zplane: int, channel: int, x_
     return split_by_size(arr, region, zplane, channel, block_w, block_h, overlap)
 
 
-def split_tiff(in_path: str, out_dir: str, block_size: int, nblocks: int, overlap: int,
-               region: int, nzplanes: int, nchannels: int, selected_channels: list):
-    with tif.TiffFile(in_path) as TF:
+def write_tiles(out_dir: str, blocks: list, img_names: list, manifest: dict, empty_tiles: set,
+                zplane: int = 0, best_focus_z: list = None):
+    # blocks are in raster order, so position in the list gives the tile number
+    tiles = [i for i in range(0, len(blocks)) if i + 1 not in empty_tiles]
+    if best_focus_z is not None:
+        tiles = [i for i in tiles if best_focus_z[i] == zplane]
+    task = []
+    for i in tiles:
+        task.append(dask.delayed(tif.imwrite)(osp.join(out_dir, img_names[i]), blocks[i], photometric='minisblack'))
+    dask.compute(*task, scheduler='threads')
+
+    dir_name = osp.basename(osp.normpath(out_dir))
+    for i in tiles:
+        add_tile_file(manifest, i + 1, osp.join(dir_name, img_names[i]), osp.getsize(osp.join(out_dir, img_names[i])))
+
+
+def split_tiff(in_path: str, out_dir: str, block_size: int, nblocks: int, overlap: int, cycle: int,
+               region: int, nzplanes: int, nchannels: int, selected_channels: list, prefetch_depth: int = 1,
+               empty_tiles: list = None, best_focus_z: list = None) -> dict:
+    """ empty_tiles - 1-based numbers of tiles without tissue, they are not written and marked empty in manifest
+        best_focus_z - 0-based z-plane for every tile, only this plane is written, as the first z-plane
+    """
+    with storage.open_tiff(in_path) as TF:
         npages = len(TF.pages)
+        plane_shape = TF.pages[0].shape
+        dtype = TF.pages[0].dtype
+
+    if nblocks == 0:
+        block_w, block_h = block_size, block_size
+    else:
+        block_w, block_h = plane_shape[-1] // nblocks, plane_shape[-2] // nblocks
+    x_nblocks, y_nblocks = get_nblocks(plane_shape, block_w, block_h)
+    manifest = create_manifest(cycle, region, plane_shape, (block_h + overlap * 2, block_w + overlap * 2), overlap,
+                               x_nblocks, y_nblocks, dtype)
+    empty_tiles = set() if empty_tiles is None else set(empty_tiles)
+    mark_empty_tiles(manifest, sorted(empty_tiles))
+    if best_focus_z is not None:
+        set_best_focus_z(manifest, best_focus_z)
+
+    # next plane is read in background while current one is split and written
+    page_list = [(c, z) for c in selected_channels for z in range(0, nzplanes)]
+    planes = prefetch(read_page, [(in_path, c * nzplanes + z) for c, z in page_list], prefetch_depth)
 
     # split image by number of blocks
     if nblocks == 0:
-        for c in selected_channels:
-            for z in range(0, nzplanes):
-                page = c * nzplanes + z
-                print('page', page + 1, '/', npages)
-                this_plane_split, this_plane_img_names = split_by_size(
-                    tif.imread(in_path, key=page), region, zplane=z, channel=c, block_w=block_size, block_h=block_size,
-                    overlap=overlap
-                )
-                task = []
-                for i, img in enumerate(this_plane_split):
-                    task.append(dask.delayed(tif.imwrite)(osp.join(out_dir, this_plane_img_names[i]), img,
-                                                          photometric='minisblack'))
-
-                dask.compute(*task, scheduler='threads')
+        for c, z in page_list:
+            page = c * nzplanes + z
+            print('page', page + 1, '/', npages)
+            this_plane_split, this_plane_img_names = split_by_size(
+                next(planes), region, zplane=z if best_focus_z is None else 0, channel=c,
+                block_w=block_size, block_h=block_size, overlap=overlap
+            )
+            write_tiles(out_dir, this_plane_split, this_plane_img_names, manifest, empty_tiles, z, best_focus_z)
 
     # split image by block size
     elif block_size == 0:
-        for c in selected_channels:
-            for z in range(0, nzplanes):
-                page = c * nzplanes + z
-                print('page', page + 1, '/', npages)
-                this_plane_split, this_plane_img_names = split_by_nblocks(
-                    tif.imread(in_path, key=page), region, zplane=0, channel=c, x_nblocks=nblocks, y_nblocks=nblocks,
-                    overlap=overlap
-                )
-                task = []
-                for i, img in enumerate(this_plane_split):
-                    task.append(dask.delayed(tif.imwrite)(osp.join(out_dir, this_plane_img_names[i]), img,
-                                                          photometric='minisblack'))
-                dask.compute(*task, scheduler='threads')
+        for c, z in page_list:
+            page = c * nzplanes + z
+            print('page', page + 1, '/', npages)
+            this_plane_split, this_plane_img_names = split_by_nblocks(
+                next(planes), region, zplane=0, channel=c, x_nblocks=nblocks, y_nblocks=nblocks,
+                overlap=overlap
+            )
+            write_tiles(out_dir, this_plane_split, this_plane_img_names, manifest, empty_tiles, z, best_focus_z)
+    return manifest
 
 
 def main(in_path: str = None, out_dir: str = None, block_size: int = None, nblocks: int = None, overlap: int = None,
-         cycle: int = None, region: int = None, nzplanes: int = None, nchannels: int = None, selected_channels: list = None):
+         cycle: int = None, region: int = None, nzplanes: int = None, nchannels: int = None, selected_channels: list = None,
+         prefetch_depth: int = 1, empty_tiles: list = None, best_focus_z: list = None, nshards: int = 1):
 
     # Cyc{cycle:d}_reg{region:d}/{region:d}_{tile:05d}_Z{z:03d}_CH{channel:d}.tif
+    base_out_dir = out_dir
     out_dir = osp.join(out_dir, 'Cyc{cycle}_reg{region}'.format(cycle=cycle, region=region))
     if not in_path.endswith(('tif', 'tiff')):
         raise ValueError('Only tif, tiff input files are accepted')
@@ -157,7 +268,12 @@ def main(in_path: str = None, out_dir: str = None, block_size: int = None, nbloc
     else:
         selected_channels = [ch_id for ch_id in selected_channels if ch_id < nchannels]
 
-    split_tiff(in_path, out_dir, block_size, nblocks, overlap, region, nzplanes, nchannels, selected_channels)
+    manifest = split_tiff(in_path, out_dir, block_size, nblocks, overlap, cycle, region,
+                          nzplanes, nchannels, selected_channels, prefetch_depth, empty_tiles, best_focus_z)
+    if nshards > 1:
+        # each shard is a separate tile grid that can be segmented on a different node
+        manifest = partition_tiles(base_out_dir, manifest, nshards)
+    write_manifest(manifest, base_out_dir)
 
 
 if __name__ == '__main__':
@@ -175,7 +291,11 @@ if __name__ == '__main__':
     parser.add_argument('--nchannels', type=int, default=1, help='number of channels, default 1')
     parser.add_argument('--selected_channels', type=int, nargs='+', default=None,
                         help="space separated ids of channels you want to slice, e.g. 0 1 3, default all")
+    parser.add_argument('--prefetch', type=int, default=1,
+                        help='number of planes read in background while slicing, 0 disables prefetching. Default: 1')
+    parser.add_argument('--nshards', type=int, default=1,
+                        help='number of shards, contiguous blocks of tile rows with separate directories. Default: 1')
 
     args = parser.parse_args()
     main(args.i, args.o, args.s, args.n, args.v, args.cycle, args.region,
-         args.nzplanes, args.nchannels, args.selected_channels)
+         args.nzplanes, args.nchannels, args.selected_channels, args.prefetch, nshards=args.nshards)
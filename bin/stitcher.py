@@ -1,13 +1,26 @@
 import os
 import re
+import json
 import argparse
 import numpy as np
 import tifffile as tif
-import pandas as pd
 from typing import List, Tuple, Union
-import dask
+
+from tile_manifest import read_manifest, get_cytokit_tile_paths, get_grid_info, CYTOKIT_MASK_CHANNELS
+from memmap_output import create_memmap_output
+from object_features import get_object_table, write_table, iter_windows
+from boundaries import get_boundaries
+from prefetch import prefetch_tiles
+from label_rle import write_rle
+
 Image = np.ndarray
 
+# tile shape of the tiled output, must be a multiple of 16
+OUTPUT_TILE_SHAPE = (512, 512)
+
+# boundary page of the mask: label page it can be derived from
+BOUNDARY_PAGES = {2: 0, 3: 1}
+
 
 def generate_ome_meta_for_mask(size_x: int, size_y: int, dtype):
         template = """<?xml version="1.0" encoding="utf-8"?>
@@ -34,6 +47,25 @@ def generate_ome_meta_for_mask(size_x: int, size_y: int, dtype):
         return ome_meta
 
 
+def generate_ome_meta_for_intensity(size_x: int, size_y: int, dtype, nchannels: int):
+    template = """<?xml version="1.0" encoding="utf-8"?>
+            <OME xmlns="http://www.openmicroscopy.org/Schemas/OME/2016-06" xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" xsi:schemaLocation="http://www.openmicroscopy.org/Schemas/OME/2016-06 http://www.openmicroscopy.org/Schemas/OME/2016-06/ome.xsd">
+              <Image ID="Image:0" Name="intensity_stitched.ome.tiff">
+                <Pixels BigEndian="true" DimensionOrder="XYZCT" ID="Pixels:0" SizeC="{nchannels}" SizeT="1" SizeX="{size_x}" SizeY="{size_y}" SizeZ="1" Type="{dtype}">
+{channels}
+{tiffdata}
+                </Pixels>
+              </Image>
+            </OME>
+        """
+    channel = '                    <Channel ID="Channel:0:{id}" Name="{id}" SamplesPerPixel="1" />'
+    tiffdata = '                    <TiffData FirstC="{id}" FirstT="0" FirstZ="0" IFD="{id}" PlaneCount="1" />'
+    ome_meta = template.format(size_x=size_x, size_y=size_y, dtype=np.dtype(dtype).name, nchannels=nchannels,
+                               channels='\n'.join(channel.format(id=i) for i in range(0, nchannels)),
+                               tiffdata='\n'.join(tiffdata.format(id=i) for i in range(0, nchannels)))
+    return ome_meta
+
+
 def alpha_num_order(string: str) -> str:
     """ Returns all numbers on 5 digits to let sort the string with numeric order.
     Ex: alphaNumOrder("a6b12.125")  ==> "a00006b00012.00125"
@@ -50,10 +82,58 @@ def parse_str_to_dict(string):
     return d
 
 
+def get_block_slices(i: int, j: int, x_nblocks: int, y_nblocks: int,
+                     block_shape: list, overlap: int, padding: dict) -> Tuple[tuple, tuple]:
+    """ Returns slice of tile (i, j) without overlap and padding,
+        and slice of the stitched image where it should be placed
+    """
+    x_axis = -1
+    y_axis = -2
+
+    block_x_size = block_shape[x_axis] - overlap * 2
+    block_y_size = block_shape[y_axis] - overlap * 2
+
+    big_image_slice = [slice(None), slice(None)]
+    block_slice = [slice(None), slice(None)]
+
+    yf = i * block_y_size
+    yt = yf + block_y_size
+
+    # tile can be both first and last if there is only one row or column of tiles
+    block_yf, block_yt = overlap, block_y_size + overlap
+    if i == 0:
+        block_yf += padding["top"]
+        yf = padding["top"]
+    if i == y_nblocks - 1:
+        block_yt -= padding["bottom"]
+        yt -= padding["bottom"]
+    block_slice[y_axis] = slice(block_yf, block_yt)
+    big_image_slice[y_axis] = slice(yf, yt)
+
+    xf = j * block_x_size
+    xt = xf + block_x_size
+
+    block_xf, block_xt = overlap, block_x_size + overlap
+    if j == 0:
+        block_xf += padding["left"]
+        xf = padding["left"]
+    if j == x_nblocks - 1:
+        block_xt -= padding["right"]
+        xt -= padding["right"]
+    block_slice[x_axis] = slice(block_xf, block_xt)
+    big_image_slice[x_axis] = slice(xf, xt)
+
+    return tuple(block_slice), tuple(big_image_slice)
+
+
 def stitch_plane(path_list: List[str], page: int,
                  x_nblocks: int, y_nblocks: int,
                  block_shape: list, dtype,
-                 overlap: int, padding: dict, remap_dict: dict = None) -> Tuple[Image, Union[np.ndarray, None]]:
+                 overlap: int, padding: dict, remap_dict: dict = None,
+                 out: Image = None, prefetch_depth: int = 4) -> Tuple[Image, Union[np.ndarray, None]]:
+    """ out - optional preallocated zero-filled plane, e.g. memory-mapped page of the output file
+        prefetch_depth - number of tiles read in background while current one is placed
+    """
 
     x_axis = -1
     y_axis = -2
@@ -65,48 +145,28 @@ def stitch_plane(path_list: List[str], page: int,
     big_image_y_size = (y_nblocks * block_y_size) - padding["top"] - padding["bottom"]
 
     big_image_shape = (big_image_y_size, big_image_x_size)
-    big_image = np.zeros(big_image_shape, dtype=dtype)
-    big_image_slice = [slice(None), slice(None)]
-    block_slice = [slice(None), slice(None)]
+    if out is None:
+        big_image = np.zeros(big_image_shape, dtype=dtype)
+    else:
+        if out.shape != big_image_shape:
+            raise ValueError('Output plane has shape ' + str(out.shape) + ', expected ' + str(big_image_shape))
+        big_image = out
     previous_tile_max = 0
     tile_additions = np.zeros((y_nblocks, x_nblocks), dtype=dtype)
     print('n blocks x,y:', (x_nblocks, y_nblocks))
     print('plane shape x,y:', big_image_shape[::-1])
+    tiles = prefetch_tiles(path_list, page, block_shape, prefetch_depth)
     n = 0
     for i in range(0, y_nblocks):
-        yf = i * block_y_size
-        yt = yf + block_y_size
-
-        if i == 0:
-            block_slice[y_axis] = slice(0 + overlap + padding["top"], block_y_size + overlap)
-            big_image_slice[y_axis] = slice(padding["top"], yt)
-        elif i == y_nblocks - 1:
-            block_slice[y_axis] = slice(0 + overlap, block_y_size + overlap - padding["bottom"])
-            big_image_slice[y_axis] = slice(yf, yt - padding["bottom"])
-        else:
-            block_slice[y_axis] = slice(0 + overlap, block_y_size + overlap)
-            big_image_slice[y_axis] = slice(yf, yt)
-
         for j in range(0, x_nblocks):
-            xf = j * block_x_size
-            xt = xf + block_x_size
-
-            if j == 0:
-                block_slice[x_axis] = slice(0 + overlap + padding["left"], block_x_size + overlap)
-                big_image_slice[x_axis] = slice(padding["left"], xt)
-            elif j == x_nblocks - 1:
-                block_slice[x_axis] = slice(0 + overlap, block_x_size + overlap - padding["right"])
-                big_image_slice[x_axis] = slice(xf, xt - padding["right"])
-            else:
-                block_slice[x_axis] = slice(0 + overlap, block_x_size + overlap)
-                big_image_slice[x_axis] = slice(xf, xt)
+            block_slice, big_image_slice = get_block_slices(i, j, x_nblocks, y_nblocks, block_shape, overlap, padding)
 
-            block = tif.imread(path_list[n], key=page).astype(dtype)
+            block = next(tiles).astype(dtype)
 
             if remap_dict is not None:
                 block[np.nonzero(block)] += previous_tile_max
 
-            big_image[tuple(big_image_slice)] = block[tuple(block_slice)]
+            big_image[big_image_slice] = block[block_slice]
 
             if remap_dict is not None:
                 tile_additions[i, j] = previous_tile_max
@@ -122,6 +182,20 @@ def stitch_plane(path_list: List[str], page: int,
     return big_image, tile_additions
 
 
+def get_seam_remapping(img1_ov: Image, img2_ov: Image) -> dict:
+    """ Maps labels of the second tile to labels of the first tile that cover the same pixels of the seam.
+        If label overlaps several labels, the first one in row-major order is taken.
+    """
+    old_values = img2_ov.ravel()
+    new_values = img1_ov.ravel()
+    both_labeled = (old_values > 0) & (new_values > 0)
+    old_values = old_values[both_labeled]
+    new_values = new_values[both_labeled]
+    unique_old_values, first_occurrence = np.unique(old_values, return_index=True)
+    remap_dict = dict(zip(unique_old_values.tolist(), new_values[first_occurrence].tolist()))
+    return remap_dict
+
+
 def get_remapping(img1: Image, img2: Image, overlap: int, mode: str) -> dict:
     if mode == 'horizontal':
         img1_ov = img1[:, -overlap:]
@@ -129,71 +203,112 @@ def get_remapping(img1: Image, img2: Image, overlap: int, mode: str) -> dict:
     elif mode == 'vertical':
         img1_ov = img1[-overlap:, :]
         img2_ov = img2[:overlap, :]
+    return get_seam_remapping(img1_ov, img2_ov)
 
-    nrows, ncols = img2_ov.shape
-
-    remap_dict = dict()
-
-    for i in range(0, nrows):
-        for j in range(0, ncols):
-            old_value = img2_ov[i, j]
-            if old_value in remap_dict:
-                continue
-            else:
-                new_value = img1_ov[i, j]
-                if old_value > 0 and new_value > 0:
-                    remap_dict[old_value] = img1_ov[i, j]
-
-    return remap_dict
 
-
-def remap(path_list: List[str], img1_id: int, img2_id: int, overlap: int, mode: str):
-    # take only first channel
-    img1 = tif.imread(path_list[img1_id], key=0)
-    img2 = tif.imread(path_list[img2_id], key=0)
-    remapping = get_remapping(img1, img2, overlap, mode=mode)
-    if mode == 'horizontal':
-        return {img2_id: {'horizontal': remapping, 'vertical': {}}} # add empty vertical mapping if it is not present
-    elif mode == 'vertical':
-        return {img2_id: {'vertical': remapping}}
+def read_tile_edges(path: str, overlap: int, page: int = 0) -> dict:
+    """ Reads only overlapping strips from four edges of the tile.
+        Uncompressed tiles are memory-mapped, so the rest of the tile is never decoded.
+        Returns None for tiles without tissue, which were not written.
+    """
+    if path is None:
+        return None
+    try:
+        img = tif.memmap(path, page=page, mode='r')
+    except ValueError:
+        img = tif.imread(path, key=page)
+    edges = {'left': np.array(img[:, :overlap]),
+             'right': np.array(img[:, -overlap:]),
+             'top': np.array(img[:overlap, :]),
+             'bottom': np.array(img[-overlap:, :])
+             }
+    del img
+    return edges
 
 
 def get_remapping_for_border_values(path_list: List[str],
                                     x_nblocks: int, y_nblocks: int,
                                     overlap: int) -> dict:
+    # tiles without overlap have no seams, img[:, -0:] would also select the whole tile
+    if overlap == 0:
+        return {}
+    # dask is imported here, so modules that use only helpers of the stitcher start without it
+    import dask
+
+    # every tile is read once, its edges are used for seams with all four neighbours
+    task = [dask.delayed(read_tile_edges)(path, overlap) for path in path_list]
+    edges = dask.compute(*task, scheduler='processes')
+
     remap_dict = dict()
-    htask = []
     for i in range(0, y_nblocks):
         for j in range(0, x_nblocks - 1):
             img1_id = i * x_nblocks + j
             img2h_id = i * x_nblocks + (j + 1)
-            htask.append(dask.delayed(remap)(path_list, img1_id, img2h_id, overlap, 'horizontal'))
-
-    hor_values = dask.compute(*htask, scheduler='processes')
-    hor_values = list(hor_values)
-    for d in hor_values:
-        remap_dict.update(d)
+            if edges[img1_id] is None or edges[img2h_id] is None:
+                remapping = {}
+            else:
+                remapping = get_seam_remapping(edges[img1_id]['right'], edges[img2h_id]['left'])
+            remap_dict[img2h_id] = {'horizontal': remapping, 'vertical': {}}
 
-    vtask = []
     for i in range(0, y_nblocks - 1):
         for j in range(0, x_nblocks):
             img1_id = i * x_nblocks + j
             img2v_id = (i + 1) * x_nblocks + j
-            vtask.append(dask.delayed(remap)(path_list, img1_id, img2v_id, overlap, 'vertical'))
-
-    ver_values = dask.compute(*vtask, scheduler='processes')
-    ver_values = list(ver_values)
-    for d in ver_values:
-        k, v = list(*d.items())
-        if k in remap_dict:
-            remap_dict[k].update(v)
-        else:
-            v.update({'horizontal': {}})  # add empty horizontal mapping if it is not present
-            remap_dict[k] = {k: v}
+            if edges[img1_id] is None or edges[img2v_id] is None:
+                remapping = {}
+            else:
+                remapping = get_seam_remapping(edges[img1_id]['bottom'], edges[img2v_id]['top'])
+            if img2v_id in remap_dict:
+                remap_dict[img2v_id]['vertical'] = remapping
+            else:
+                remap_dict[img2v_id] = {'horizontal': {}, 'vertical': remapping}
 
     return remap_dict
 
 
+def get_tile_remapping(remap_dict: dict, tile_id: int) -> Tuple[dict, dict]:
+    try:
+        hor_remap = remap_dict[tile_id]['horizontal']
+    except KeyError:
+        hor_remap = {}
+    try:
+        ver_remap = remap_dict[tile_id]['vertical']
+    except KeyError:
+        ver_remap = {}
+    return hor_remap, ver_remap
+
+
+def remap_block_values(block: Image, hor_remap: dict, ver_remap: dict, this_tile_addition: int,
+                       left_tile_addition: int, top_tile_addition: int) -> Image:
+    """ Replaces labels of the tile with labels of its left and top neighbours """
+    for old_value, new_value in hor_remap.items():
+        block[block == old_value + this_tile_addition] = new_value + left_tile_addition
+    for old_value, new_value in ver_remap.items():
+        block[block == old_value + this_tile_addition] = new_value + top_tile_addition
+    return block
+
+
+def read_tile_max(path: str, page: int) -> int:
+    """ Maximum label of the tile page, 0 for tiles without tissue """
+    if path is None:
+        return 0
+    return int(tif.imread(path, key=page).max())
+
+
+def load_block(path: str, page: int, block_slice: tuple, dtype, this_tile_addition: int,
+               hor_remap: dict, ver_remap: dict, left_tile_addition: int, top_tile_addition: int) -> Image:
+    """ Cropped tile page with label offset of the tile and seam remapping applied, zeros for missing tiles """
+    if path is None:
+        return np.zeros(tuple(s.stop - s.start for s in block_slice), dtype=dtype)
+    block = tif.imread(path, key=page).astype(dtype)
+    block[np.nonzero(block)] += dtype(this_tile_addition)
+    block = block[block_slice]
+    if hor_remap != {} or ver_remap != {}:
+        block = remap_block_values(block, hor_remap, ver_remap, this_tile_addition,
+                                   left_tile_addition, top_tile_addition)
+    return block
+
+
 def remap_values(big_image: Image, remap_dict: dict,
                  tile_additions: np.ndarray, block_shape: list,
                  overlap: int, x_nblocks: int, y_nblocks: int) -> Image:
@@ -224,84 +339,375 @@ def remap_values(big_image: Image, remap_dict: dict,
             #left_block_slice[x_axis] = slice(xf - x_block_size, xt - x_block_size)
 
             this_block = big_image[tuple(this_block_slice)]
-            try:
-                hor_remap = remap_dict[n]['horizontal']
-            except KeyError:
-                hor_remap = {}
-            try:
-                ver_remap = remap_dict[n]['vertical']
-            except KeyError:
-                ver_remap = {}
-
-            modified_x = False
-            modified_y = False
-
-            if hor_remap != {}:
-                left_tile_addition = tile_additions[i, j - 1]
-                this_tile_addition = tile_additions[i, j]
-                for old_value, new_value in hor_remap.items():
-                    this_block[this_block == old_value + this_tile_addition] = new_value + left_tile_addition
-                modified_x = True
-            if ver_remap != {}:
-                top_tile_addition = tile_additions[i - 1, j]
-                this_tile_addition = tile_additions[i, j]
-                for old_value, new_value in ver_remap.items():
-                    this_block[this_block == old_value + this_tile_addition] = new_value + top_tile_addition
-                modified_y = True
-
-            if modified_x or modified_y:
+            hor_remap, ver_remap = get_tile_remapping(remap_dict, n)
+
+            if hor_remap != {} or ver_remap != {}:
+                left_tile_addition = tile_additions[i, j - 1] if j > 0 else 0
+                top_tile_addition = tile_additions[i - 1, j] if i > 0 else 0
+                this_block = remap_block_values(this_block, hor_remap, ver_remap, tile_additions[i, j],
+                                                left_tile_addition, top_tile_addition)
                 big_image[tuple(this_block_slice)] = this_block
 
             n += 1
     return big_image
 
 
-def main(img_dir: str, out_path: str, overlap: int, padding_str: str):
+def get_boundary_window(labels: Image, window: tuple) -> Image:
+    """ Boundaries of labels inside the window, one pixel around the window is read,
+        so boundaries are the same as if the whole plane was processed at once
+    """
+    ys, xs = window
+    y_from, x_from = max(ys.start - 1, 0), max(xs.start - 1, 0)
+    y_to, x_to = min(ys.stop + 1, labels.shape[-2]), min(xs.stop + 1, labels.shape[-1])
+    boundaries = get_boundaries(np.asarray(labels[y_from:y_to, x_from:x_to]))
+    return boundaries[ys.start - y_from: ys.stop - y_from, xs.start - x_from: xs.stop - x_from]
+
+
+def derive_boundaries(labels: Image, out: Image, windows: List[tuple] = None) -> Image:
+    """ Fills out with boundaries of stitched labels one window at a time,
+        labels and out can be memory-mapped pages. By default the whole plane is processed.
+    """
+    if windows is None:
+        windows = iter_windows(labels.shape, OUTPUT_TILE_SHAPE)
+    for window in windows:
+        out[window] = get_boundary_window(labels, window)
+    return out
+
+
+def get_label_table(remap_dict: dict, pages: List[int], tile_additions: List[np.ndarray], max_labels: List[int],
+                    x_nblocks: int, y_nblocks: int, block_shape: list, overlap: int, padding: dict) -> dict:
+    """ Everything needed to map tile labels to labels of the stitched mask without stitching it again.
+        tile_additions and max_labels are given for every stitched page,
+        max label is the largest label assigned in the page.
+    """
+    table = {'nblocks': dict(x=x_nblocks, y=y_nblocks),
+             'pages': pages,
+             'block_shape': [int(s) for s in block_shape[-2:]],
+             'overlap': overlap,
+             'padding': padding,
+             'tile_additions': [[int(a) for a in page_additions.ravel()] for page_additions in tile_additions],
+             'max_labels': [int(n) for n in max_labels],
+             'remap': remap_dict
+             }
+    return table
+
+
+def write_label_table(table: dict, out_path: str):
+    with open(out_path, 'w') as s:
+        json.dump(table, s, separators=(',', ':'))
+
+
+def read_label_table(path: str) -> dict:
+    with open(path, 'r') as s:
+        table = json.load(s)
+    # json keys are strings
+    remap_dict = dict()
+    for tile_id, tile_remap in table['remap'].items():
+        remap_dict[int(tile_id)] = {direction: {int(old): new for old, new in remapping.items()}
+                                    for direction, remapping in tile_remap.items()}
+    table['remap'] = remap_dict
+    return table
 
-    padding_int = [int(i) for i in padding_str.split(',')]
-    padding = {"left": padding_int[0], "right": padding_int[1], "top": padding_int[2], "bottom": padding_int[3]}
 
+def get_blend_ramp(overlap: int, blend: str) -> np.ndarray:
+    """ Returns increasing weights across the seam of two tiles, which is 2 * overlap wide.
+        Ramp and its reverse add up to 1 at every pixel of the seam.
+    """
+    t = (np.arange(0, overlap * 2, dtype=np.float32) + 0.5) / (overlap * 2)
+    if blend == 'linear':
+        ramp = t
+    elif blend == 'cosine':
+        ramp = 0.5 - 0.5 * np.cos(np.pi * t)
+    else:
+        raise ValueError('Unknown blend mode ' + blend + ', use linear or cosine')
+    return ramp.astype(np.float32)
+
+
+def get_blend_weights(length: int, ramp: np.ndarray, has_prev: bool, has_next: bool) -> np.ndarray:
+    """ Returns 1D weights of one tile side, edges that have no neighbour keep weight 1 """
+    weights = np.ones(length, dtype=np.float32)
+    ramp_len = len(ramp)
+    if ramp_len > 0:
+        if has_prev:
+            weights[:ramp_len] = ramp
+        if has_next:
+            weights[-ramp_len:] = ramp[::-1]
+    return weights
+
+
+def cast_to_dtype(arr: Image, dtype) -> Image:
+    if np.issubdtype(dtype, np.integer):
+        dtype_info = np.iinfo(dtype)
+        arr = np.clip(np.rint(arr), dtype_info.min, dtype_info.max)
+    return arr.astype(dtype)
+
+
+def stitch_plane_blended(path_list: List[str], page: int,
+                         x_nblocks: int, y_nblocks: int,
+                         block_shape: list, dtype,
+                         overlap: int, padding: dict, blend: str = 'linear', prefetch_depth: int = 4):
+    """ Generator of stitched rows of an intensity plane.
+        Tiles are feathered across the overlap instead of being cropped.
+        Only one row of tiles and the seam below it are kept in memory.
+    """
+    x_axis = -1
+    y_axis = -2
+
+    block_x_size = block_shape[x_axis] - overlap * 2
+    block_y_size = block_shape[y_axis] - overlap * 2
+    full_x_size = x_nblocks * block_x_size
+    full_y_size = y_nblocks * block_y_size
+
+    # buffer column 0 is the column -overlap of the full image
+    row_from = padding["top"]
+    row_to = full_y_size - padding["bottom"]
+    col_slice = slice(overlap + padding["left"], overlap + full_x_size - padding["right"])
+
+    ramp = get_blend_ramp(overlap, blend)
+    tiles = prefetch_tiles(path_list, page, block_shape, prefetch_depth)
+    seam = None
+    n = 0
+    for i in range(0, y_nblocks):
+        row_buffer = np.zeros((block_shape[y_axis], full_x_size + overlap * 2), dtype=np.float32)
+        if seam is not None:
+            row_buffer[:overlap * 2, :] = seam
+        y_weights = get_blend_weights(block_shape[y_axis], ramp, i > 0, i < y_nblocks - 1)
+
+        for j in range(0, x_nblocks):
+            x_weights = get_blend_weights(block_shape[x_axis], ramp, j > 0, j < x_nblocks - 1)
+            block = next(tiles).astype(np.float32)
+            xf = j * block_x_size
+            row_buffer[:, xf:xf + block_shape[x_axis]] += block * y_weights[:, None] * x_weights[None, :]
+            n += 1
+
+        # buffer row 0 is the row i * block_y_size - overlap of the full image
+        if i < y_nblocks - 1:
+            finished_rows = row_buffer[:block_y_size, :]
+            seam = row_buffer[block_y_size:, :].copy()
+        else:
+            finished_rows = row_buffer
+        buffer_row = i * block_y_size - overlap
+        f = max(row_from - buffer_row, 0)
+        t = min(row_to - buffer_row, finished_rows.shape[0])
+        if t > f:
+            yield cast_to_dtype(finished_rows[f:t, col_slice], dtype)
+
+
+def split_rows_to_tiles(rows: Image, tile_shape: tuple):
+    """ Yields tiles of rows in raster order, last tile of the row is padded with zeros """
+    width = rows.shape[-1]
+    for xf in range(0, width, tile_shape[-1]):
+        tile = rows[:, xf:xf + tile_shape[-1]]
+        if tile.shape != tuple(tile_shape):
+            tile = np.pad(tile, ((0, tile_shape[-2] - tile.shape[-2]), (0, tile_shape[-1] - tile.shape[-1])),
+                          mode='constant')
+        yield tile
+
+
+def iter_tiles_from_strips(strips, tile_shape: tuple):
+    """ Converts generator of row strips of arbitrary height into generator of tiles
+        that can be written with TiffWriter.save(..., tile=tile_shape)
+    """
+    rows = None
+    for strip in strips:
+        rows = strip if rows is None else np.concatenate((rows, strip), axis=0)
+        while rows.shape[0] >= tile_shape[-2]:
+            yield from split_rows_to_tiles(rows[:tile_shape[-2], :], tile_shape)
+            rows = rows[tile_shape[-2]:, :]
+    if rows is not None and rows.shape[0] > 0:
+        yield from split_rows_to_tiles(rows, tile_shape)
+
+
+def stitch_intensity(path_list: List[str], out_path: str, x_nblocks: int, y_nblocks: int,
+                     block_shape: list, overlap: int, padding: dict, blend: str, prefetch_depth: int = 4):
+    first_tile_path = next(path for path in path_list if path is not None)
+    with tif.TiffFile(first_tile_path) as TF:
+        npages = len(TF.pages)
+        dtype = TF.pages[0].dtype
+
+    big_image_x_size = (x_nblocks * (block_shape[-1] - overlap * 2)) - padding["left"] - padding["right"]
+    big_image_y_size = (y_nblocks * (block_shape[-2] - overlap * 2)) - padding["top"] - padding["bottom"]
+    ome_meta = generate_ome_meta_for_intensity(big_image_x_size, big_image_y_size, dtype, npages)
+
+    with tif.TiffWriter(out_path, bigtiff=True) as TW:
+        for p in range(0, npages):
+            print('\npage', p)
+            print('stitching with', blend, 'blending')
+            strips = stitch_plane_blended(path_list, p, x_nblocks, y_nblocks, block_shape, dtype,
+                                          overlap, padding, blend, prefetch_depth)
+            TW.save(iter_tiles_from_strips(strips, OUTPUT_TILE_SHAPE), shape=(big_image_y_size, big_image_x_size),
+                    dtype=dtype, tile=OUTPUT_TILE_SHAPE, photometric="minisblack", description=ome_meta)
+
+
+def get_tile_grid_from_dir(img_dir: str):
     allowed_extensions = ('.tif', '.tiff')
     file_list = [fn for fn in os.listdir(img_dir) if fn.endswith(allowed_extensions)]
     dict_list = [parse_str_to_dict(f) for f in file_list]
-    df = pd.DataFrame(dict_list)
-    df.sort_values(["R", "Y", "X"], inplace=True)
+    dict_list.sort(key=lambda d: (d["R"], d["Y"], d["X"]))
 
-    x_nblocks = df["X"].max()
-    y_nblocks = df["Y"].max()
-    path_list = [os.path.join(img_dir, p) for p in df["path"].to_list()]
-    print('getting values for remapping')
-    remap_dict = get_remapping_for_border_values(path_list, x_nblocks, y_nblocks, overlap)
+    x_nblocks = max(d["X"] for d in dict_list)
+    y_nblocks = max(d["Y"] for d in dict_list)
+    # tiles without tissue may be missing, their place in the grid stays None
+    path_list = [None] * (x_nblocks * y_nblocks)
+    for d in dict_list:
+        path_list[(d["Y"] - 1) * x_nblocks + d["X"] - 1] = os.path.join(img_dir, d["path"])
 
-    with tif.TiffFile(path_list[0]) as TF:
+    with tif.TiffFile(os.path.join(img_dir, dict_list[0]["path"])) as TF:
         block_shape = list(TF.series[0].shape)
         npages = len(TF.pages)
+    return path_list, x_nblocks, y_nblocks, block_shape, npages
+
+
+def get_tile_grid_from_manifest(img_dir: Union[str, List[str]], manifest_path: str):
+    """ img_dir - directory with Cytokit tiles or list of directories, one per shard if tiles were sharded """
+    manifest = read_manifest(manifest_path)
+    x_nblocks, y_nblocks, block_shape = get_grid_info(manifest)
+    path_list = get_cytokit_tile_paths(manifest, img_dir)
+    npages = len(CYTOKIT_MASK_CHANNELS)
+    return path_list, x_nblocks, y_nblocks, block_shape, npages
+
+
+def main(img_dir: Union[str, List[str]], out_path: str, overlap: int, padding_str: str, manifest_path: str = None,
+         mode: str = 'mask', blend: str = 'linear', use_memmap: bool = False, features_path: str = None,
+         prefetch_depth: int = 4, label_table_path: str = None, derive_boundaries_from_labels: bool = False,
+         rle_path: str = None):
+
+    padding_int = [int(i) for i in padding_str.split(',')]
+    padding = {"left": padding_int[0], "right": padding_int[1], "top": padding_int[2], "bottom": padding_int[3]}
+
+    if manifest_path is not None:
+        path_list, x_nblocks, y_nblocks, block_shape, npages = get_tile_grid_from_manifest(img_dir, manifest_path)
+    elif isinstance(img_dir, str):
+        path_list, x_nblocks, y_nblocks, block_shape, npages = get_tile_grid_from_dir(img_dir)
+    else:
+        raise ValueError('Tiles from several shard directories can be stitched only with tile manifest')
+
+    if mode == 'intensity':
+        stitch_intensity(path_list, out_path, x_nblocks, y_nblocks, block_shape, overlap, padding, blend,
+                         prefetch_depth)
+        return
+    elif mode != 'mask':
+        raise ValueError('Unknown stitching mode ' + mode + ', use mask or intensity')
+
+    print('getting values for remapping')
+    remap_dict = get_remapping_for_border_values(path_list, x_nblocks, y_nblocks, overlap)
 
     dtype = np.uint32
 
     big_image_x_size = (x_nblocks * (block_shape[-1] - overlap * 2)) - padding["left"] - padding["right"]
     big_image_y_size = (y_nblocks * (block_shape[-2] - overlap * 2)) - padding["top"] - padding["bottom"]
     ome_meta = generate_ome_meta_for_mask(big_image_x_size, big_image_y_size, dtype)
-
+    # object table is computed from the cells plane, one stitched tile at a time
+    table_tile_shape = (block_shape[-2] - overlap * 2, block_shape[-1] - overlap * 2)
+    # boundary pages are not stitched, they are derived from stitched label pages
+    if derive_boundaries_from_labels:
+        if npages != len(CYTOKIT_MASK_CHANNELS):
+            raise ValueError('Boundaries can be derived only for Cytokit masks with pages ' +
+                             ', '.join(CYTOKIT_MASK_CHANNELS))
+        stitched_pages = [p for p in range(0, npages) if p not in BOUNDARY_PAGES]
+    else:
+        stitched_pages = list(range(0, npages))
+    # label offsets of every stitched page are saved for incremental re-stitching
+    page_additions = []
+    max_labels = []
+
+    if use_memmap:
+        # planes are stitched directly into the output file, OS page cache takes care of eviction
+        out = create_memmap_output(out_path, (npages, big_image_y_size, big_image_x_size), dtype, ome_meta)
+        for p in stitched_pages:
+            print('\npage', p)
+            print('stitching')
+            plane, tile_additions = stitch_plane(path_list, p, x_nblocks, y_nblocks, block_shape, dtype, overlap,
+                                                 padding, remap_dict, out=out[p], prefetch_depth=prefetch_depth)
+            if remap_dict is not None:
+                if label_table_path is not None:
+                    page_additions.append(tile_additions)
+                    max_labels.append(int(plane.max()))
+                remap_values(plane, remap_dict, tile_additions, block_shape, overlap, x_nblocks, y_nblocks)
+            out.flush()
+            if p == 0 and features_path is not None:
+                print('extracting object features')
+                write_table(get_object_table(plane, table_tile_shape), features_path)
+        if derive_boundaries_from_labels:
+            for boundary_page, label_page in BOUNDARY_PAGES.items():
+                print('\nderiving page', boundary_page, 'from page', label_page)
+                derive_boundaries(out[label_page], out[boundary_page])
+            out.flush()
+        del out
+        if label_table_path is not None:
+            write_label_table(get_label_table(remap_dict, stitched_pages, page_additions, max_labels,
+                                              x_nblocks, y_nblocks, block_shape, overlap, padding), label_table_path)
+        if rle_path is not None:
+            print('\nwriting RLE mask')
+            write_rle(out_path, rle_path)
+        return
+
+    label_planes = dict()
     with tif.TiffWriter(out_path, bigtiff=True) as TW:
-        for p in range(0, npages):
+        for p in stitched_pages:
             print('\npage', p)
             print('stitching')
-            plane, tile_additions = stitch_plane(path_list, p, x_nblocks, y_nblocks, block_shape, dtype, overlap, padding, remap_dict)
+            plane, tile_additions = stitch_plane(path_list, p, x_nblocks, y_nblocks, block_shape, dtype, overlap, padding, remap_dict,
+                                                 prefetch_depth=prefetch_depth)
             if remap_dict is not None:
+                if label_table_path is not None:
+                    page_additions.append(tile_additions)
+                    max_labels.append(int(plane.max()))
                 plane = remap_values(plane, remap_dict, tile_additions, block_shape, overlap, x_nblocks, y_nblocks)
             TW.save(plane, photometric="minisblack", description=ome_meta)
+            if p == 0 and features_path is not None:
+                print('extracting object features')
+                write_table(get_object_table(plane, table_tile_shape), features_path)
+            if derive_boundaries_from_labels:
+                label_planes[p] = plane
+        for boundary_page, label_page in BOUNDARY_PAGES.items() if derive_boundaries_from_labels else []:
+            print('\nderiving page', boundary_page, 'from page', label_page)
+            plane = derive_boundaries(label_planes[label_page], np.zeros_like(label_planes[label_page]))
+            TW.save(plane, photometric="minisblack", description=ome_meta)
+            del label_planes[label_page]
+
+    if label_table_path is not None:
+        write_label_table(get_label_table(remap_dict, stitched_pages, page_additions, max_labels,
+                                          x_nblocks, y_nblocks, block_shape, overlap, padding), label_table_path)
+    if rle_path is not None:
+        print('\nwriting RLE mask')
+        write_rle(out_path, rle_path)
 
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
-    parser.add_argument('-i', type=str, required=True, help='path to directory with images')
+    parser.add_argument('-i', type=str, nargs='+', required=True,
+                        help='path to directory with images, one directory per shard if tiles were sharded')
     parser.add_argument('-o', type=str, required=True, help='path to output file')
     parser.add_argument('-v', type=int, required=True, default=0, help='overlap size in pixels, default 0')
     parser.add_argument('-p', type=str, default='0,0,0,0',
                         help='image padding that should be removed, 4 comma separated numbers: left, right, top, bottom.' +
                              'Default: 0,0,0,0')
+    parser.add_argument('-m', type=str, default=None,
+                        help='path to tile manifest produced by slicer, if not provided image directory will be listed')
+    parser.add_argument('--mode', type=str, default='mask', choices=['mask', 'intensity'],
+                        help='mask - label tiles are cropped and labels merged across seams, ' +
+                             'intensity - image tiles are blended across overlap. Default: mask')
+    parser.add_argument('--blend', type=str, default='linear', choices=['linear', 'cosine'],
+                        help='feathering profile across overlap in intensity mode. Default: linear')
+    parser.add_argument('--memmap', action='store_true',
+                        help='stitch mask directly into memory-mapped uncompressed output file, ' +
+                             'for images that do not fit into RAM')
+    parser.add_argument('--features', type=str, default=None,
+                        help='path to output table with label, area, centroid and bounding box of every cell, ' +
+                             '.csv or .parquet')
+    parser.add_argument('--prefetch', type=int, default=4,
+                        help='number of tiles read in background while stitching, 0 disables prefetching. Default: 4')
+
+    parser.add_argument('--label_table', type=str, default=None,
+                        help='path to output label table .json, required for incremental re-stitching of changed tiles')
+    parser.add_argument('--derive_boundaries', action='store_true',
+                        help='stitch only cells and nuclei pages, boundary pages are computed from stitched labels')
+    parser.add_argument('--rle', type=str, default=None,
+                        help='path to output .rle.npz with run-length encoded labels and object index of every page')
 
     args = parser.parse_args()
 
-    main(args.i, args.o, args.v, args.p)
+    img_dir = args.i[0] if len(args.i) == 1 else args.i
+    main(img_dir, args.o, args.v, args.p, args.m, args.mode, args.blend, args.memmap, args.features, args.prefetch,
+         args.label_table, args.derive_boundaries, args.rle)
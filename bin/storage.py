@@ -0,0 +1,158 @@
+""" Access to local files and object stores (s3://, gs://, memory:// ...) through fsspec.
+    Local paths are used as they are, fsspec is imported only when a remote path is given.
+    Options of filesystems are read from IMS_PIPELINE_STORAGE_OPTIONS, JSON with options per protocol, e.g.
+    {"s3": {"client_kwargs": {"endpoint_url": "http://localhost:9000"}, "key": "minio", "secret": "minio123"}}
+    If IMS_PIPELINE_CACHE_DIR is set, blocks read from remote files are also cached on local disk.
+    tifffile is imported when the first TIFF is opened, so modules that only list and join paths start fast.
+"""
+
+import json
+import os
+import os.path as osp
+import posixpath
+import shutil
+import tempfile
+from contextlib import contextmanager
+from functools import lru_cache
+from typing import List
+
+STORAGE_OPTIONS_ENV = 'IMS_PIPELINE_STORAGE_OPTIONS'
+CACHE_DIR_ENV = 'IMS_PIPELINE_CACHE_DIR'
+# size of one ranged read, TIFF headers and IFDs usually fit into one block
+BLOCK_SIZE = 4 * 1024 * 1024
+# connections kept open to the object store by one process
+MAX_POOL_CONNECTIONS = 32
+
+
+def get_protocol(path: str) -> str:
+    return path.split('://', 1)[0] if '://' in path else 'file'
+
+
+def is_remote(path: str) -> bool:
+    return get_protocol(path) != 'file'
+
+
+def get_storage_options(protocol: str) -> dict:
+    options = json.loads(os.environ.get(STORAGE_OPTIONS_ENV, '{}')).get(protocol, {})
+    if protocol in ('s3', 's3a'):
+        # all threads of the process share the connection pool of one client
+        options.setdefault('config_kwargs', {}).setdefault('max_pool_connections', MAX_POOL_CONNECTIONS)
+    return options
+
+
+@lru_cache(maxsize=None)
+def get_filesystem(protocol: str):
+    """ One filesystem instance per protocol and process, so connections are reused between files """
+    try:
+        import fsspec
+    except ImportError:
+        raise ImportError('Path with protocol ' + protocol + ':// requires fsspec, install it with pip install fsspec')
+
+    options = get_storage_options(protocol)
+    cache_dir = os.environ.get(CACHE_DIR_ENV, None)
+    try:
+        if cache_dir is not None and protocol != 'memory':
+            return fsspec.filesystem('blockcache', target_protocol=protocol, target_options=options,
+                                     cache_storage=cache_dir)
+        return fsspec.filesystem(protocol, **options)
+    except ImportError as e:
+        # filesystem of the protocol is a separate package, e.g. s3fs for s3://
+        raise ImportError('Path with protocol ' + protocol + ':// requires filesystem package of the protocol, ' +
+                          'e.g. s3fs for s3://, gcsfs for gs://: ' + str(e))
+
+
+def open_file(path: str, mode: str = 'rb'):
+    """ Remote files are read with ranged requests of BLOCK_SIZE, recently read blocks are kept in memory """
+    if not is_remote(path):
+        return open(path, mode)
+    fs = get_filesystem(get_protocol(path))
+    if 'r' in mode:
+        return fs.open(path, mode, block_size=BLOCK_SIZE, cache_type='blockcache')
+    return fs.open(path, mode)
+
+
+def open_tiff(path: str):
+    """ TiffFile reads only IFDs and the strips or tiles that are requested,
+        so for remote files only these byte ranges are downloaded
+    """
+    import tifffile as tif
+
+    if not is_remote(path):
+        return tif.TiffFile(path)
+    return tif.TiffFile(open_file(path, 'rb'), name=posixpath.basename(path))
+
+
+def imread(path: str, key: int = None):
+    import tifffile as tif
+
+    if not is_remote(path):
+        return tif.imread(path, key=key)
+    with open_tiff(path) as TF:
+        return TF.asarray(key=key)
+
+
+def exists(path: str) -> bool:
+    if not is_remote(path):
+        return osp.exists(path)
+    return get_filesystem(get_protocol(path)).exists(path)
+
+
+def listdir(path: str) -> List[str]:
+    """ Names of files and directories in the directory, as os.listdir """
+    if not is_remote(path):
+        return os.listdir(path)
+    fs = get_filesystem(get_protocol(path))
+    return [posixpath.basename(p.rstrip('/')) for p in fs.ls(path, detail=False)]
+
+
+def join(path: str, *paths: str) -> str:
+    if not is_remote(path):
+        return osp.join(path, *paths)
+    return posixpath.join(path, *paths)
+
+
+def get_sidecar_path(tiff_path: str, suffix: str) -> str:
+    """ Path of the file stored next to the TIFF, e.g. image.ome.tiff -> image.rle.npz """
+    base = tiff_path
+    for ext in ('.tiff', '.tif', '.ome'):
+        if base.lower().endswith(ext):
+            base = base[:-len(ext)]
+    return base + suffix
+
+
+def get_local_copy(path: str, cache_dir: str = None) -> str:
+    """ Downloads remote file for tools that can only read local files, local path is returned as is """
+    if not is_remote(path):
+        return path
+    cache_dir = os.environ.get(CACHE_DIR_ENV, tempfile.gettempdir()) if cache_dir is None else cache_dir
+    local_path = osp.join(cache_dir, 'downloads', get_protocol(path), path.split('://', 1)[1])
+    if not osp.exists(local_path):
+        os.makedirs(osp.dirname(local_path), exist_ok=True)
+        get_filesystem(get_protocol(path)).get(path, local_path + '.part')
+        os.replace(local_path + '.part', local_path)
+    return local_path
+
+
+def upload(local_path: str, path: str):
+    """ Large files are uploaded by fsspec in parts, directories are uploaded recursively """
+    fs = get_filesystem(get_protocol(path))
+    fs.put(local_path, path, recursive=osp.isdir(local_path))
+
+
+@contextmanager
+def local_output(path: str):
+    """ Yields local path to write the output to. For remote path it is in a temporary directory
+        and everything written to this directory, including sidecar files next to the output,
+        is uploaded next to the remote path when the block exits without error.
+    """
+    if not is_remote(path):
+        yield path
+        return
+    tmp_dir = tempfile.mkdtemp(prefix='ims_pipeline_')
+    try:
+        yield osp.join(tmp_dir, posixpath.basename(path))
+        remote_dir = posixpath.dirname(path)
+        for name in sorted(os.listdir(tmp_dir)):
+            upload(osp.join(tmp_dir, name), posixpath.join(remote_dir, name))
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
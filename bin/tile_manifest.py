@@ -0,0 +1,108 @@
+import json
+import os.path as osp
+from typing import List, Tuple, Union
+
+MANIFEST_NAME = 'tile_manifest.json'
+
+# name of the Cytokit segmentation output for one tile: cytometry/tile/R001_X001_Y001.tif
+CYTOKIT_TILE_NAME = 'R{region:03d}_X{x:03d}_Y{y:03d}.tif'
+
+# region of tiles for segmentation, selected region of the dataset is always sliced and named as region 1,
+# because Cytokit config of one pipeline run has one region reg1
+SEGMENTATION_REGION = 1
+
+# pages of the Cytokit segmentation output
+CYTOKIT_MASK_CHANNELS = ['cells', 'nuclei', 'cell_boundaries', 'nucleus_boundaries']
+
+
+def create_manifest(cycle: int, region: int, plane_shape: tuple, block_shape: tuple, overlap: int,
+                    x_nblocks: int, y_nblocks: int, dtype) -> dict:
+    """ Creates empty manifest of the tile grid, tiles are added with add_tile_file.
+        block_shape - shape of tile including overlap (height, width)
+    """
+    manifest = {'cycle': cycle,
+                'region': region,
+                'image_shape': dict(x=plane_shape[-1], y=plane_shape[-2]),
+                'block_shape': dict(x=block_shape[-1], y=block_shape[-2]),
+                'overlap': overlap,
+                'nblocks': dict(x=x_nblocks, y=y_nblocks),
+                'dtype': str(dtype),
+                'tiles': []
+                }
+    for i in range(0, y_nblocks):
+        for j in range(0, x_nblocks):
+            manifest['tiles'].append({'tile': i * x_nblocks + j + 1, 'x': j + 1, 'y': i + 1,
+                                      'empty': False, 'files': []})
+    return manifest
+
+
+def add_tile_file(manifest: dict, tile: int, path: str, nbytes: int, npages: int = 1):
+    """ tile - 1-based tile number in raster order, as in slicer output names """
+    manifest['tiles'][tile - 1]['files'].append({'path': path, 'nbytes': nbytes, 'npages': npages})
+
+
+def mark_empty_tiles(manifest: dict, empty_tiles: List[int]):
+    """ empty_tiles - 1-based tile numbers of tiles without tissue, they are not written by slicer """
+    for tile in empty_tiles:
+        manifest['tiles'][tile - 1]['empty'] = True
+
+
+def set_best_focus_z(manifest: dict, best_focus_z: List[int]):
+    """ best_focus_z - 0-based z-plane that was written for every tile in raster order """
+    for tile, z in zip(manifest['tiles'], best_focus_z):
+        tile['best_focus_z'] = z
+
+
+def write_manifest(manifest: dict, out_dir: str) -> str:
+    out_path = osp.join(out_dir, MANIFEST_NAME)
+    with open(out_path, 'w') as s:
+        json.dump(manifest, s, separators=(',', ':'))
+    return out_path
+
+
+def read_manifest(path: str) -> dict:
+    with open(path, 'r') as s:
+        manifest = json.load(s)
+    return manifest
+
+
+def get_cytokit_tile_paths(manifest: dict, cytokit_tile_dir: Union[str, List[str]]) -> List[str]:
+    """ Returns paths to Cytokit output tiles in raster order without listing the directory.
+        Tiles without tissue have no Cytokit output, their path is None.
+        If tiles were partitioned into shards, cytokit_tile_dir is a list with one directory per shard,
+        and tile rows are numbered from the first row of the shard.
+    """
+    region = manifest['region']
+    if 'shards' in manifest:
+        if isinstance(cytokit_tile_dir, str) or len(cytokit_tile_dir) != len(manifest['shards']):
+            raise ValueError('Manifest has ' + str(len(manifest['shards'])) + ' shards, ' +
+                             'provide one Cytokit tile directory per shard')
+        shard_of_row = []
+        for s, shard in enumerate(manifest['shards']):
+            shard_of_row.extend([(s, shard['row_start'])] * (shard['row_stop'] - shard['row_start']))
+    else:
+        if not isinstance(cytokit_tile_dir, str):
+            cytokit_tile_dir = cytokit_tile_dir[0]
+        shard_of_row = None
+
+    path_list = []
+    for tile in manifest['tiles']:
+        if tile.get('empty', False):
+            path_list.append(None)
+            continue
+        if shard_of_row is None:
+            tile_dir, y = cytokit_tile_dir, tile['y']
+        else:
+            s, row_start = shard_of_row[tile['y'] - 1]
+            tile_dir, y = cytokit_tile_dir[s], tile['y'] - row_start
+        name = CYTOKIT_TILE_NAME.format(region=region, x=tile['x'], y=y)
+        path_list.append(osp.join(tile_dir, name))
+    return path_list
+
+
+def get_grid_info(manifest: dict) -> Tuple[int, int, list]:
+    """ Returns x_nblocks, y_nblocks and block shape (height, width) """
+    x_nblocks = manifest['nblocks']['x']
+    y_nblocks = manifest['nblocks']['y']
+    block_shape = [manifest['block_shape']['y'], manifest['block_shape']['x']]
+    return x_nblocks, y_nblocks, block_shape
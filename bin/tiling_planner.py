@@ -0,0 +1,185 @@
+import argparse
+import os
+import os.path as osp
+import re
+from typing import List
+
+import yaml
+
+import storage
+
+# Local profile with calibrated coefficients, values that are not in the profile are taken from DEFAULT_COST_MODEL.
+# autotune.py also saves tuned workers and prefetch depth of slicer and stitcher in it
+DEFAULT_PROFILE_PATH = osp.join(osp.expanduser('~'), '.ims_pipeline_profile.yaml')
+
+# Rough coefficients of a workstation with one GPU, runtimes in seconds, memory in bytes per pixel of a tile.
+# They are used for ranking block sizes, absolute numbers should be calibrated on the target machine.
+DEFAULT_COST_MODEL = {'segmentation_s_per_mpx': 1.5,  # per million tile pixels of one z-plane
+                      'segmentation_s_per_tile': 2.0,  # model call, reading and writing of one tile
+                      'slicer_s_per_mpx': 0.05,
+                      'stitcher_s_per_mpx': 0.2,  # per million pixels of one output page
+                      'stitcher_s_per_tile': 0.05,  # edge reading and seam remapping of one tile
+                      'gpu_bytes_per_px': 400,  # per pixel of one z-plane of a tile
+                      'cpu_segmentation_bytes_per_px': 40
+                      }
+
+DEFAULT_BLOCK_SIZES = list(range(250, 4001, 250))
+# cell, nucleus, cell boundary, nucleus boundary
+NUM_MASK_PAGES = 4
+
+
+def load_profile(profile_path: str = None) -> dict:
+    """ Empty profile if the default one does not exist """
+    path = DEFAULT_PROFILE_PATH if profile_path is None else profile_path
+    if osp.exists(path):
+        with open(path, 'r') as s:
+            return yaml.safe_load(s) or {}
+    elif profile_path is not None:
+        raise FileNotFoundError('Profile ' + profile_path + ' does not exist')
+    return {}
+
+
+def get_tuned_config(stage: str, profile_path: str = None) -> dict:
+    """ num_workers and prefetch of slicer or stitcher saved by autotune.py, empty if the stage was not tuned """
+    return load_profile(profile_path).get(stage, {})
+
+
+def load_cost_model(profile_path: str = None) -> dict:
+    model = dict(DEFAULT_COST_MODEL)
+    model.update(load_profile(profile_path).get('cost_model', {}))
+    return model
+
+
+def get_machine_limits(ram_gb: float = None, gpu_memory_gb: float = None, ngpus: int = 1, ncpus: int = None) -> dict:
+    """ RAM and number of cores of this machine are used if not given """
+    if ram_gb is None:
+        try:
+            ram_gb = os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES') / 1024 ** 3
+        except (ValueError, OSError, AttributeError):
+            ram_gb = 16
+    return {'ram_gb': float(ram_gb),
+            'gpu_memory_gb': float(gpu_memory_gb) if gpu_memory_gb is not None else 11.0,
+            'ngpus': max(1, int(ngpus or 1)),
+            'ncpus': int(ncpus) if ncpus is not None else (os.cpu_count() or 1)}
+
+
+def get_image_params(img_path: str) -> dict:
+    """ Plane shape, number of z-planes and bytes per pixel from OME-TIFF, only the first IFD is read """
+    with storage.open_tiff(img_path) as TF:
+        page = TF.pages[0]
+        plane_shape = page.shape[-2:]
+        itemsize = page.dtype.itemsize
+        num_z = 1
+        if TF.is_ome:
+            match = re.search(r'SizeZ="(\d+)"', TF.pages[0].description)
+            num_z = int(match.group(1)) if match is not None else 1
+    return {'plane_shape': [int(s) for s in plane_shape], 'num_z': num_z, 'itemsize': int(itemsize)}
+
+
+def get_nblocks(size: int, block_size: int) -> int:
+    """ Same rounding as generate_pipeline_config.get_img_info """
+    return size // block_size if size % block_size == 0 else size // block_size + 1
+
+
+def estimate_plan(plane_shape: tuple, num_z: int, itemsize: int, block_size: int, overlap: int,
+                  machine: dict, model: dict) -> dict:
+    y_nblocks = get_nblocks(plane_shape[-2], block_size)
+    x_nblocks = get_nblocks(plane_shape[-1], block_size)
+    ntiles = x_nblocks * y_nblocks
+    tile_side = block_size + overlap * 2
+    tile_px = tile_side ** 2
+    plane_px = plane_shape[-2] * plane_shape[-1]
+    padded_px = (y_nblocks * block_size) * (x_nblocks * block_size)
+    segmented_mpx = ntiles * tile_px * num_z / 1e6
+
+    # slicer pads and splits one plane of the nuclei channel at a time
+    slicer_ram = 2 * (y_nblocks * tile_side) * (x_nblocks * tile_side) * itemsize
+    # stitcher without memmap keeps one uint32 output page and one page of tile edges in memory
+    stitcher_ram = padded_px * 4 + ntiles * 4 * tile_side * overlap * 2 * 4
+    cpu_segmentation_ram = machine['ncpus'] * tile_px * model['cpu_segmentation_bytes_per_px']
+    gpu_memory = tile_px * num_z * model['gpu_bytes_per_px']
+
+    segmentation_s = (model['segmentation_s_per_mpx'] * segmented_mpx +
+                      model['segmentation_s_per_tile'] * ntiles) / machine['ngpus']
+    slicer_s = model['slicer_s_per_mpx'] * ntiles * tile_px * num_z / 1e6
+    stitcher_s = (model['stitcher_s_per_mpx'] * padded_px * NUM_MASK_PAGES / 1e6 +
+                  model['stitcher_s_per_tile'] * ntiles)
+
+    plan = {'block_size': block_size,
+            'overlap': overlap,
+            'nblocks': {'x': x_nblocks, 'y': y_nblocks},
+            'ntiles': ntiles,
+            'redundant_fraction': round(1 - plane_px / (ntiles * tile_px), 4),
+            'peak_ram_gb': {'slicer': round(slicer_ram / 1024 ** 3, 3),
+                            'segmentation_cpu': round(cpu_segmentation_ram / 1024 ** 3, 3),
+                            'stitcher': round(stitcher_ram / 1024 ** 3, 3)},
+            'gpu_memory_gb': round(gpu_memory / 1024 ** 3, 3),
+            'runtime_s': {'slicer': round(slicer_s, 1),
+                          'segmentation': round(segmentation_s, 1),
+                          'stitcher': round(stitcher_s, 1)},
+            }
+    plan['total_runtime_s'] = round(sum(plan['runtime_s'].values()), 1)
+    plan['fits'] = bool(gpu_memory / 1024 ** 3 <= machine['gpu_memory_gb'] and
+                        max(plan['peak_ram_gb'].values()) <= machine['ram_gb'])
+    return plan
+
+
+def get_plans(plane_shape: tuple, num_z: int, itemsize: int, overlap: int, machine: dict, model: dict,
+              block_sizes: List[int] = None) -> List[dict]:
+    block_sizes = DEFAULT_BLOCK_SIZES if block_sizes is None else block_sizes
+    # tiles larger than the image only add padding
+    max_size = max(plane_shape[-2:])
+    candidates = [b for b in block_sizes if b > overlap * 2 and b < max_size + min(block_sizes)]
+    return [estimate_plan(plane_shape, num_z, itemsize, b, overlap, machine, model) for b in candidates]
+
+
+def select_plan(plans: List[dict]) -> dict:
+    """ Fastest plan that fits in memory limits, if none fits the one with the smallest GPU memory """
+    fitting = [p for p in plans if p['fits']]
+    if fitting == []:
+        return min(plans, key=lambda p: p['gpu_memory_gb'])
+    return min(fitting, key=lambda p: (p['total_runtime_s'], p['redundant_fraction']))
+
+
+def plan_tiling(img_path: str, overlap: int, machine: dict, model: dict = None, num_z: int = None) -> dict:
+    """ Returns selected plan and all evaluated plans """
+    model = load_cost_model() if model is None else model
+    params = get_image_params(img_path)
+    num_z = params['num_z'] if num_z is None else num_z
+    plans = get_plans(params['plane_shape'], num_z, params['itemsize'], overlap, machine, model)
+    selected = select_plan(plans)
+    return {'selected': selected, 'plans': plans, 'machine': machine, 'image': params}
+
+
+def print_plans(plans: List[dict], selected: dict):
+    print('block', 'tiles', 'redundant', 'gpu_gb', 'ram_gb', 'runtime_s', 'fits', sep='\t')
+    for p in plans:
+        mark = ' *' if p is selected else ''
+        print(p['block_size'], p['ntiles'], p['redundant_fraction'], p['gpu_memory_gb'],
+              max(p['peak_ram_gb'].values()), p['total_runtime_s'], str(p['fits']) + mark, sep='\t')
+
+
+def main(img_path: str, overlap: int, ram_gb: float = None, gpu_memory_gb: float = None, ngpus: int = 1,
+         ncpus: int = None, profile_path: str = None, num_z: int = None):
+    machine = get_machine_limits(ram_gb, gpu_memory_gb, ngpus, ncpus)
+    result = plan_tiling(img_path, overlap, machine, load_cost_model(profile_path), num_z)
+    print_plans(result['plans'], result['selected'])
+    print('recommended block_size:', result['selected']['block_size'], 'overlap:', overlap)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--img_path', type=str, required=True, help='path to MxIF OME-TIFF that will be sliced')
+    parser.add_argument('--overlap', type=int, required=True,
+                        help='overlap of one edge, should be at least the radius of the largest cell')
+    parser.add_argument('--ram_gb', type=float, default=None, help='RAM limit, default: RAM of this machine')
+    parser.add_argument('--gpu_memory_gb', type=float, default=None, help='memory of one GPU, default 11')
+    parser.add_argument('--ngpus', type=int, default=1, help='number of GPUs, default 1')
+    parser.add_argument('--ncpus', type=int, default=None, help='number of cores, default: cores of this machine')
+    parser.add_argument('--num_z', type=int, default=None, help='number of z-planes, default: SizeZ from OME-XML')
+    parser.add_argument('--profile', type=str, default=None,
+                        help='path to profile with calibrated cost model, default ' + DEFAULT_PROFILE_PATH)
+    args = parser.parse_args()
+
+    main(args.img_path, args.overlap, args.ram_gb, args.gpu_memory_gb, args.ngpus, args.ncpus, args.profile,
+         args.num_z)
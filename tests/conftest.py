@@ -0,0 +1,41 @@
+import os
+import os.path as osp
+import sys
+
+import numpy as np
+import pytest
+import tifffile as tif
+
+# pipeline scripts in bin/ import each other by module name
+sys.path.insert(0, osp.join(osp.dirname(osp.dirname(osp.abspath(__file__))), 'bin'))
+
+LABEL_BLOCK_SIZE = 64
+LABEL_OVERLAP = 10
+
+
+@pytest.fixture
+def label_tiles(tmp_path):
+    """ Label image sliced by slicer into four-page tiles with Cytokit names, as segmentation output.
+        Returns labels, directory with tiles, path to tile manifest, overlap and padding string of the stitcher.
+    """
+    import slicer
+    from tile_manifest import MANIFEST_NAME, CYTOKIT_TILE_NAME, read_manifest
+
+    rng = np.random.default_rng(0)
+    labels = np.kron(rng.integers(0, 40, size=(15, 17)), np.ones((10, 10), dtype=np.int64)).astype(np.uint16)
+    img_path = str(tmp_path / 'labels.tif')
+    tif.imwrite(img_path, labels[None], photometric='minisblack')
+    slicer.main(img_path, str(tmp_path / 'tiles'), LABEL_BLOCK_SIZE, 0, LABEL_OVERLAP, 1, 1, 1, 1, [0])
+    manifest_path = str(tmp_path / 'tiles' / MANIFEST_NAME)
+    manifest = read_manifest(manifest_path)
+
+    tile_dir = str(tmp_path / 'cytokit')
+    os.makedirs(tile_dir)
+    for tile in manifest['tiles']:
+        tile_labels = tif.imread(str(tmp_path / 'tiles' / tile['files'][0]['path'])).astype(np.uint32)
+        name = CYTOKIT_TILE_NAME.format(region=1, x=tile['x'], y=tile['y'])
+        tif.imwrite(osp.join(tile_dir, name), np.stack([tile_labels] * 4), photometric='minisblack')
+
+    x_nblocks, y_nblocks = manifest['nblocks']['x'], manifest['nblocks']['y']
+    padding = [0, x_nblocks * LABEL_BLOCK_SIZE - labels.shape[1], 0, y_nblocks * LABEL_BLOCK_SIZE - labels.shape[0]]
+    return labels, tile_dir, manifest_path, LABEL_OVERLAP, ','.join(str(p) for p in padding)
@@ -0,0 +1,40 @@
+import numpy as np
+import tifffile as tif
+import yaml
+
+import autotune
+import tiling_planner
+
+
+def test_stage_config_with_smallest_total_time():
+    trials = [{'num_workers': 1, 'prefetch': 0, 'slicer_s': 1.0}, {'num_workers': 2, 'prefetch': 0, 'slicer_s': 0.4},
+              {'num_workers': 1, 'prefetch': 0, 'slicer_s': 1.0}, {'num_workers': 2, 'prefetch': 0, 'slicer_s': 0.7}]
+    assert autotune.select_stage_config(trials, 'slicer') == {'num_workers': 2, 'prefetch': 0}
+
+
+def test_tuned_settings_are_saved_to_profile(tmp_path):
+    rng = np.random.default_rng(0)
+    img = np.zeros((2, 200, 240), dtype=np.uint16)
+    for y, x in rng.integers(10, 190, size=(30, 2)):
+        img[:, y - 5:y + 5, x - 5:x + 5] = 3000
+    img_path = str(tmp_path / 'img.ome.tiff')
+    tif.imwrite(img_path, img, photometric='minisblack')
+    profile_path = str(tmp_path / 'profile.yaml')
+    with open(profile_path, 'w') as s:
+        yaml.safe_dump({'cost_model': {'segmentation_s_per_tile': 30.0}}, s)
+
+    autotune.main(img_path, 8, str(tmp_path), sample_size=160, sample_pages=1, block_sizes=[64, 128],
+                  workers=[1, 2], prefetch_depths=[0, 2], profile_path=profile_path)
+
+    with open(profile_path, 'r') as s:
+        profile = yaml.safe_load(s)
+    assert len(profile['autotune']['trials']) == 2 * 2 * 2
+    for stage in ('slicer', 'stitcher'):
+        tuned = tiling_planner.get_tuned_config(stage, profile_path)
+        assert tuned == profile[stage]
+        assert tuned['num_workers'] in (1, 2) and tuned['prefetch'] in (0, 2)
+    model = tiling_planner.load_cost_model(profile_path)
+    assert model['segmentation_s_per_tile'] == 30.0
+    assert model['slicer_s_per_mpx'] == profile['cost_model']['slicer_s_per_mpx'] > 0
+    # only the sample and trial tiles are written to the work directory, and they are removed
+    assert sorted(p.name for p in tmp_path.iterdir()) == ['img.ome.tiff', 'profile.yaml']
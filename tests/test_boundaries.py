@@ -0,0 +1,31 @@
+import numpy as np
+import pytest
+import tifffile as tif
+
+import stitcher
+from boundaries import get_boundaries
+
+
+def test_boundaries_keep_only_edge_pixels():
+    labels = np.zeros((7, 7), dtype=np.uint32)
+    labels[1:6, 1:6] = 3
+    boundaries = get_boundaries(labels)
+    assert boundaries[3, 3] == 0
+    assert np.all(boundaries[1, 1:6] == 3)
+    assert np.array_equal(boundaries > 0, (labels > 0) & ~np.pad(np.ones((3, 3), bool), 2))
+
+
+@pytest.mark.parametrize('use_memmap', [False, True])
+def test_derived_boundaries_follow_stitched_labels(tmp_path, label_tiles, use_memmap):
+    labels, tile_dir, manifest_path, overlap, padding_str = label_tiles
+    stitched_path = str(tmp_path / 'stitched.tif')
+    derived_path = str(tmp_path / 'derived.tif')
+    stitcher.main(tile_dir, stitched_path, overlap, padding_str, manifest_path, use_memmap=use_memmap)
+    stitcher.main(tile_dir, derived_path, overlap, padding_str, manifest_path, use_memmap=use_memmap,
+                  derive_boundaries_from_labels=True)
+
+    stitched = tif.imread(stitched_path, is_ome=False)
+    derived = tif.imread(derived_path, is_ome=False)
+    assert np.array_equal(derived[:2], stitched[:2])
+    assert np.array_equal(derived[2], get_boundaries(stitched[0]))
+    assert np.array_equal(derived[3], get_boundaries(stitched[1]))
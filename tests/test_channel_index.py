@@ -0,0 +1,31 @@
+import numpy as np
+import pytest
+import tifffile as tif
+
+from channel_index import get_index_path, write_index_for_file, read_channel, parse_mz
+
+CHANNEL_NAMES = ['885.5498', 'mz 766.54', 'DAPI']
+
+
+@pytest.mark.parametrize('compress', [0, 6])
+def test_channel_is_read_by_name_and_mz(tmp_path, compress):
+    rng = np.random.default_rng(0)
+    img = rng.integers(0, 60000, size=(3, 30, 40)).astype(np.uint16)
+    path = str(tmp_path / 'combined.ome.tiff')
+    with tif.TiffWriter(path, bigtiff=True) as TW:
+        for plane in img:
+            TW.save(plane, photometric='minisblack', compress=compress)
+
+    assert write_index_for_file(path, CHANNEL_NAMES) == get_index_path(path)
+    assert get_index_path(path).endswith('combined.channel_index.json')
+    assert np.array_equal(read_channel(path, 'DAPI'), img[2])
+    assert np.array_equal(read_channel(path, 766.5405), img[1])
+    assert np.array_equal(read_channel(path, 885.5498), img[0])
+    with pytest.raises(KeyError):
+        read_channel(path, 700.0)
+
+
+def test_parse_mz():
+    assert parse_mz('mz 885.5498') == 885.5498
+    assert parse_mz('M/Z 12') == 12.0
+    assert parse_mz('DAPI') is None
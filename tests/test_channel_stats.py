@@ -0,0 +1,40 @@
+import numpy as np
+import tifffile as tif
+
+import channel_index
+from channel_stats import get_channel_stats, reserve_ome_meta, write_stats_to_ome, STATS_NAMESPACE
+from memmap_output import create_memmap_output, copy_pages_to_memmap
+
+OME_META = ('<?xml version="1.0" encoding="UTF-8"?><OME xmlns="http://www.openmicroscopy.org/Schemas/OME/2016-06">'
+            '<Image ID="Image:0"/></OME>')
+
+
+def test_quantiles_are_interpolated_from_histogram():
+    img = np.arange(10000, dtype=np.uint16).reshape((100, 100))
+    stats = get_channel_stats(img)
+    assert stats['min'] == 0 and stats['max'] == 9999
+    assert stats['mean'] == img.mean()
+    assert sum(stats['histogram']['counts']) == img.size
+    assert abs(stats['quantiles']['0.5'] - 5000) < 10000 / 256
+    assert abs(stats['quantiles']['0.99'] - 9900) < 10000 / 256
+
+
+def test_stats_are_written_to_ome_and_index(tmp_path):
+    rng = np.random.default_rng(0)
+    src = rng.integers(0, 1000, size=(2, 30, 40)).astype(np.uint16)
+    src_path = str(tmp_path / 'src.tif')
+    tif.imwrite(src_path, src, photometric='minisblack')
+    out_path = str(tmp_path / 'out.ome.tiff')
+    names = ['885.5498', 'DAPI']
+
+    create_memmap_output(out_path, src.shape, src.dtype, reserve_ome_meta(OME_META, names))
+    stats = copy_pages_to_memmap([(src_path, 0), (src_path, 1)], out_path, scheduler='threads', compute_stats=True)
+    write_stats_to_ome(out_path, OME_META, names, stats)
+    channel_index.write_index_for_file(out_path, names, stats)
+
+    with tif.TiffFile(out_path) as TF:
+        description = TF.pages[0].description
+        assert np.array_equal(TF.asarray(), src)
+    assert description.count(STATS_NAMESPACE) == 2
+    assert '<M K="max">{}</M>'.format(src[1].max()) in description
+    assert channel_index.read_channel_stats(out_path, 'DAPI')['mean'] == src[1].mean()
@@ -0,0 +1,38 @@
+import os.path as osp
+import subprocess
+import sys
+
+import pytest
+
+import ims_pipeline
+
+BIN_DIR = osp.dirname(osp.abspath(ims_pipeline.__file__))
+
+# prints heavy modules imported by '<command> --help'
+HELP_IMPORTS = """
+import sys
+import ims_pipeline
+try:
+    ims_pipeline.main([sys.argv[1], '--help'])
+except SystemExit:
+    pass
+print('heavy imports:', *[m for m in ('dask', 'scipy', 'zarr') if m in sys.modules])
+"""
+
+
+def test_unknown_command_lists_commands(capsys):
+    assert ims_pipeline.main(['unknown']) == 2
+    assert 'stitch' in capsys.readouterr().out
+    assert ims_pipeline.main([]) == 0
+
+
+def test_every_command_is_a_script():
+    for module, _ in ims_pipeline.COMMANDS.values():
+        assert osp.exists(osp.join(BIN_DIR, module + '.py'))
+
+
+@pytest.mark.parametrize('command', sorted(ims_pipeline.COMMANDS.keys()))
+def test_help_does_not_import_heavy_modules(command):
+    res = subprocess.run([sys.executable, '-c', HELP_IMPORTS, command], cwd=BIN_DIR, check=True,
+                         stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    assert res.stdout.decode('utf-8').strip().splitlines()[-1] == 'heavy imports:'
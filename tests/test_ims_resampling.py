@@ -0,0 +1,35 @@
+import numpy as np
+
+from ims_resampling import (get_pixel_transform, get_ims_window, get_overlap_weights, get_cell_means,
+                            save_overlap_weights, load_overlap_weights)
+
+
+def test_resampled_window_equals_upsampled_ims():
+    rng = np.random.default_rng(0)
+    ims = rng.integers(0, 100, size=(10, 12)).astype(np.float32)
+    # IMS pixel is 4 mask pixels wide
+    transform = get_pixel_transform((0.5, 0.5), (2.0, 2.0))
+    upsampled = np.kron(ims, np.ones((4, 4), dtype=ims.dtype))
+    window = (slice(5, 30), slice(7, 45))
+    resampled = get_ims_window([ims, ims * 2], window, transform)
+    assert np.array_equal(resampled[0], upsampled[window])
+    assert np.array_equal(resampled[1], upsampled[window] * 2)
+    # mask pixels outside IMS get 0
+    assert not get_ims_window([ims], (slice(40, 44), slice(0, 4)), transform).any()
+
+
+def test_cell_means_equal_means_of_upsampled_ims(tmp_path):
+    rng = np.random.default_rng(1)
+    ims = rng.integers(0, 100, size=(10, 12)).astype(np.float32)
+    transform = get_pixel_transform((0.5, 0.5), (2.0, 2.0))
+    upsampled = np.kron(ims, np.ones((4, 4), dtype=ims.dtype))
+    mask = np.kron(rng.integers(0, 6, size=(8, 8)), np.ones((5, 6), dtype=np.int64)).astype(np.uint32)
+
+    weights_path = str(tmp_path / 'weights.npz')
+    save_overlap_weights(get_overlap_weights(mask, transform, ims.shape, (16, 16)), weights_path)
+    table = get_cell_means(load_overlap_weights(weights_path), [ims], ['885.5'])
+
+    for label, area, mean in zip(table['label'], table['area'], table['885.5']):
+        assert area == (mask == label).sum()
+        assert np.isclose(mean, upsampled[mask == label].mean())
+    assert 0 not in table['label']
@@ -0,0 +1,26 @@
+import numpy as np
+import tifffile as tif
+
+from ims_spectra import get_spectra_path, write_spectra, open_spectra, get_spectrum, get_channel_image
+
+
+def test_spectra_restore_channels(tmp_path):
+    rng = np.random.default_rng(0)
+    img = rng.integers(1, 1000, size=(5, 20, 30)).astype(np.float32)
+    # background has no signal in any channel, pixels with signal in one channel are tissue
+    img[:, :8, :] = 0
+    img[3, 2, 4] = 7
+    tiff_path = str(tmp_path / 'ims_combined_multilayer.ome.tiff')
+    tif.imwrite(tiff_path, img, photometric='minisblack', compress=6)
+
+    out_path = get_spectra_path(tiff_path)
+    assert out_path == str(tmp_path / 'ims_combined_multilayer.spectra.zarr')
+    assert write_spectra(tiff_path, out_path, pixel_chunk=50, channel_chunk=2) == 12 * 30 + 1
+
+    spectra = open_spectra(out_path)
+    for c in range(0, 5):
+        assert np.array_equal(get_channel_image(spectra, c), img[c])
+    assert np.array_equal(get_channel_image(spectra, 'channel_3'), img[3])
+    assert np.array_equal(get_spectrum(spectra, 15, 11), img[:, 15, 11])
+    assert np.array_equal(get_spectrum(spectra, 2, 4), img[:, 2, 4])
+    assert not get_spectrum(spectra, 0, 0).any()
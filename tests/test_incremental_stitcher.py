@@ -0,0 +1,39 @@
+import numpy as np
+import tifffile as tif
+
+import incremental_stitcher
+import stitcher
+
+
+def same_partition(a: np.ndarray, b: np.ndarray) -> bool:
+    """ True if both masks have the same background and a one-to-one label correspondence """
+    if not np.array_equal(a == 0, b == 0):
+        return False
+    pairs = np.unique(np.stack([a.ravel(), b.ravel()]), axis=1)
+    return len(np.unique(pairs[0])) == pairs.shape[1] == len(np.unique(pairs[1]))
+
+
+def test_changed_tile_restitch_matches_full_restitch(tmp_path, label_tiles):
+    labels, tile_dir, manifest_path, overlap, padding_str = label_tiles
+    out_path = str(tmp_path / 'stitched.tif')
+    table_path = str(tmp_path / 'labels.json')
+    stitcher.main(tile_dir, out_path, overlap, padding_str, manifest_path, label_table_path=table_path)
+
+    path_list = stitcher.get_tile_grid_from_manifest(tile_dir, manifest_path)[0]
+    changed_path = path_list[4]
+    tile = tif.imread(changed_path)
+    # split every object of the changed tile into a left and a right half
+    tile[:, :, tile.shape[-1] // 2:] += np.where(tile[:, :, tile.shape[-1] // 2:] > 0, 1000, 0).astype(tile.dtype)
+    tif.imwrite(changed_path, tile, photometric='minisblack')
+
+    incremental_stitcher.main(tile_dir, out_path, table_path, [5], manifest_path)
+    full_path = str(tmp_path / 'full.tif')
+    stitcher.main(tile_dir, full_path, overlap, padding_str, manifest_path)
+
+    with tif.TiffFile(out_path) as TF:
+        updated = [p.asarray() for p in TF.pages]
+    with tif.TiffFile(full_path) as TF:
+        full = [p.asarray() for p in TF.pages]
+    assert not same_partition(updated[0], labels)
+    for updated_plane, full_plane in zip(updated, full):
+        assert same_partition(updated_plane, full_plane)
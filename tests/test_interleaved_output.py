@@ -0,0 +1,42 @@
+import numpy as np
+import tifffile as tif
+import zarr
+
+from interleaved_output import write_interleaved_tiff, write_interleaved_zarr, read_tiff_window
+
+OME_META = ('<OME><Image ID="Image:0"><Pixels DimensionOrder="XYZCT" SizeC="3">'
+            '<TiffData IFD="0" /><TiffData IFD="1" /><TiffData IFD="2" /></Pixels></Image></OME>')
+
+
+def write_source(tmp_path) -> tuple:
+    rng = np.random.default_rng(0)
+    img = rng.integers(0, 60000, size=(3, 70, 90)).astype(np.uint16)
+    src_path = str(tmp_path / 'src.tif')
+    compressed_path = str(tmp_path / 'src_compressed.tif')
+    tif.imwrite(src_path, img[:2], photometric='minisblack')
+    tif.imwrite(compressed_path, img[2:], photometric='minisblack', compress=6)
+    return img, [(src_path, 0), (src_path, 1), (compressed_path, 0)]
+
+
+def test_tiff_windows_hold_all_channels(tmp_path):
+    img, page_list = write_source(tmp_path)
+    out_path = str(tmp_path / 'interleaved.ome.tiff')
+    write_interleaved_tiff(page_list, out_path, OME_META, tile_shape=(32, 32))
+
+    with tif.TiffFile(out_path) as TF:
+        assert len(TF.pages) == 1 and TF.pages[0].is_tiled
+        assert TF.pages[0].description.count('<TiffData') == 1
+    expected = np.moveaxis(img, 0, -1)
+    for window in [(slice(0, 70), slice(0, 90)), (slice(10, 50), slice(30, 31)), (slice(60, 80), slice(64, 96))]:
+        assert np.array_equal(read_tiff_window(out_path, window), expected[window])
+
+
+def test_zarr_chunks_hold_all_channels(tmp_path):
+    img, page_list = write_source(tmp_path)
+    out_path = str(tmp_path / 'interleaved.zarr')
+    write_interleaved_zarr(page_list, out_path, ['a', 'b', 'c'], tile_shape=(32, 32))
+
+    target = zarr.open(out_path, mode='r')
+    assert target.chunks == (32, 32, 3)
+    assert target.attrs['channel_names'] == ['a', 'b', 'c']
+    assert np.array_equal(target[:], np.moveaxis(img, 0, -1))
@@ -0,0 +1,37 @@
+import numpy as np
+import tifffile as tif
+
+import stitcher
+from label_rle import get_rle_path, write_rle, open_rle, read_plane, read_window, get_object_mask
+
+
+def test_rle_restores_mask_and_objects(tmp_path):
+    rng = np.random.default_rng(0)
+    labels = np.kron(rng.integers(0, 30, size=(12, 9)), np.ones((7, 11), dtype=np.int64)).astype(np.uint32)
+    tiff_path = str(tmp_path / 'mask.ome.tiff')
+    tif.imwrite(tiff_path, np.stack([labels, labels // 2]), photometric='minisblack', compress=6)
+
+    rle_path = write_rle(tiff_path, strip_rows=10)
+    assert rle_path == get_rle_path(tiff_path)
+    rle = open_rle(rle_path)
+    assert np.array_equal(read_plane(rle, 0), labels)
+    assert np.array_equal(read_plane(rle, 1), labels // 2)
+    window = (slice(5, 40), slice(13, 80))
+    assert np.array_equal(read_window(rle, window), labels[window])
+
+    label = int(labels[30, 30])
+    mask, bbox = get_object_mask(rle, label)
+    ys, xs = np.nonzero(labels == label)
+    assert bbox == (ys.min(), xs.min(), ys.max() + 1, xs.max() + 1)
+    assert np.array_equal(mask, (labels == label)[bbox[0]:bbox[2], bbox[1]:bbox[3]])
+
+
+def test_stitcher_writes_rle(tmp_path, label_tiles):
+    labels, tile_dir, manifest_path, overlap, padding_str = label_tiles
+    out_path = str(tmp_path / 'stitched.tif')
+    rle_path = str(tmp_path / 'stitched.rle.npz')
+    stitcher.main(tile_dir, out_path, overlap, padding_str, manifest_path, rle_path=rle_path)
+    stitched = tif.imread(out_path, is_ome=False)
+    rle = open_rle(rle_path)
+    for p in range(0, 4):
+        assert np.array_equal(read_plane(rle, p), stitched[p])
@@ -0,0 +1,25 @@
+import numpy as np
+import tifffile as tif
+
+import lazy_stitcher
+import stitcher
+
+
+def test_lazy_output_equals_stitcher_output(tmp_path, label_tiles):
+    labels, tile_dir, manifest_path, overlap, padding_str = label_tiles
+    stitched_path = str(tmp_path / 'stitched.tif')
+    lazy_path = str(tmp_path / 'lazy.tif')
+    stitcher.main(tile_dir, stitched_path, overlap, padding_str, manifest_path)
+    lazy_stitcher.main(tile_dir, lazy_path, overlap, padding_str, manifest_path)
+
+    with tif.TiffFile(stitched_path) as TF:
+        stitched = [p.asarray() for p in TF.pages]
+    with tif.TiffFile(lazy_path) as TF:
+        assert TF.pages[0].is_tiled
+        lazy = [p.asarray() for p in TF.pages]
+    assert len(lazy) == 4
+    assert stitched[0].shape == labels.shape
+    for stitched_plane, lazy_plane in zip(stitched, lazy):
+        assert np.array_equal(stitched_plane, lazy_plane)
+    # background stays background and every object keeps one label
+    assert np.array_equal(stitched[0] == 0, labels == 0)
@@ -0,0 +1,31 @@
+import numpy as np
+import tifffile as tif
+
+import stitcher
+from memmap_output import create_memmap_output, copy_pages_to_memmap
+
+
+def test_copy_pages_to_memmap(tmp_path):
+    rng = np.random.default_rng(0)
+    src = rng.integers(0, 1000, size=(3, 40, 50)).astype(np.uint16)
+    src_path = str(tmp_path / 'src.tif')
+    # compressed source pages are decoded into the output
+    tif.imwrite(src_path, src, photometric='minisblack', compress=6)
+    out_path = str(tmp_path / 'out.tif')
+    create_memmap_output(out_path, (3, 40, 50), np.uint16, 'description')
+    copy_pages_to_memmap([(src_path, 2), (src_path, 0), (src_path, 1)], out_path, scheduler='threads')
+
+    out = tif.imread(out_path)
+    assert np.array_equal(out, src[[2, 0, 1]])
+
+
+def test_memmap_stitching_equals_in_memory(tmp_path, label_tiles):
+    labels, tile_dir, manifest_path, overlap, padding_str = label_tiles
+    in_memory_path = str(tmp_path / 'stitched.tif')
+    memmap_path = str(tmp_path / 'stitched_memmap.tif')
+    stitcher.main(tile_dir, in_memory_path, overlap, padding_str, manifest_path)
+    stitcher.main(tile_dir, memmap_path, overlap, padding_str, manifest_path, use_memmap=True)
+
+    with tif.TiffFile(memmap_path) as TF:
+        assert TF.pages[0].is_memmappable
+    assert np.array_equal(tif.imread(in_memory_path, is_ome=False), tif.imread(memmap_path, is_ome=False))
@@ -0,0 +1,68 @@
+import numpy as np
+import pytest
+import tifffile as tif
+
+import object_features
+import stitcher
+
+
+def test_object_table_merges_tiles():
+    rng = np.random.RandomState(0)
+    plane = np.kron(rng.randint(0, 12, size=(6, 7)), np.ones((9, 8), dtype=np.int64)).astype(np.uint32)
+    # tiles do not align with the objects, so most objects are merged from several tiles
+    table = object_features.get_object_table(plane, (10, 13))
+
+    labels = np.unique(plane)
+    labels = labels[labels != 0]
+    assert np.array_equal(table['label'], labels)
+    for n, label in enumerate(labels):
+        ys, xs = np.nonzero(plane == label)
+        assert table['area'][n] == len(ys)
+        assert np.isclose(table['centroid_y'][n], ys.mean())
+        assert np.isclose(table['centroid_x'][n], xs.mean())
+        assert (table['bbox_min_y'][n], table['bbox_min_x'][n]) == (ys.min(), xs.min())
+        assert (table['bbox_max_y'][n], table['bbox_max_x'][n]) == (ys.max() + 1, xs.max() + 1)
+
+
+def test_stitcher_writes_feature_table(tmp_path, label_tiles):
+    labels, tile_dir, manifest_path, overlap, padding_str = label_tiles
+    out_path = str(tmp_path / 'stitched.tif')
+    features_path = str(tmp_path / 'features.csv')
+    stitcher.main(tile_dir, out_path, overlap, padding_str, manifest_path, features_path=features_path)
+
+    table = np.genfromtxt(features_path, delimiter=',', names=True)
+    assert list(table.dtype.names) == object_features.OBJECT_TABLE_COLUMNS
+    cells = tif.imread(out_path, key=0, is_ome=False)
+    expected = object_features.get_object_table(cells, cells.shape)
+    for col in object_features.OBJECT_TABLE_COLUMNS:
+        assert np.allclose(table[col], expected[col], rtol=1e-5)
+
+
+def get_expected_means(mask, img):
+    labels = np.unique(mask)
+    labels = labels[labels != 0]
+    return labels, [[img[c][mask == label].mean() for label in labels] for c in range(0, img.shape[0])]
+
+
+@pytest.mark.parametrize('options', [{}, {'compress': 6}, {'compress': 6, 'tile': (32, 32)},
+                                     {'compress': 6, 'rowsperstrip': 7}])
+def test_quantify_channels_reads_strips(tmp_path, options):
+    rng = np.random.RandomState(0)
+    mask = np.kron(rng.randint(0, 20, size=(10, 12)), np.ones((11, 9), dtype=np.int64)).astype(np.uint32)
+    img = rng.randint(0, 1000, size=(3,) + mask.shape).astype(np.uint16)
+    mask_path = str(tmp_path / 'mask.tif')
+    img_path = str(tmp_path / 'img.tif')
+    tif.imwrite(mask_path, mask, **options)
+    tif.imwrite(img_path, img, photometric='minisblack', **options)
+
+    with tif.TiffFile(mask_path) as TF:
+        reader = object_features.get_row_reader(TF, mask_path, 0)
+        assert isinstance(reader, tif.TiffPage) == ('compress' in options)
+        table, channel_names = object_features.quantify_channels(reader, img_path, 25)
+        del reader
+
+    labels, means = get_expected_means(mask, img)
+    assert np.array_equal(table['label'], labels)
+    assert np.array_equal(table['area'], [(mask == label).sum() for label in labels])
+    for c, name in enumerate(channel_names):
+        assert np.allclose(table[name], means[c])
@@ -0,0 +1,33 @@
+import threading
+import time
+
+from prefetch import prefetch
+
+
+def test_prefetch_keeps_order_and_depth():
+    lock = threading.Lock()
+    state = {'running': 0, 'max_running': 0, 'started': 0}
+
+    def work(n: int):
+        with lock:
+            state['running'] += 1
+            state['started'] += 1
+            state['max_running'] = max(state['max_running'], state['running'])
+        # earlier calls finish later, results must still come in order of arguments
+        time.sleep(0.002 * (10 - n))
+        with lock:
+            state['running'] -= 1
+        return n
+
+    results = []
+    for result in prefetch(work, [(n,) for n in range(0, 10)], depth=3):
+        # no more than depth calls are started ahead of the consumer
+        assert state['started'] <= result + 1 + 3
+        results.append(result)
+    assert results == list(range(0, 10))
+    assert 1 < state['max_running'] <= 3
+
+
+def test_prefetch_depth_zero_runs_in_caller():
+    thread_ids = list(prefetch(lambda: threading.get_ident(), [()] * 3, depth=0))
+    assert thread_ids == [threading.get_ident()] * 3
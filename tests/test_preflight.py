@@ -0,0 +1,65 @@
+import os
+import os.path as osp
+
+import numpy as np
+import tifffile as tif
+
+import preflight
+
+OME_TEMPLATE = ('<?xml version="1.0" encoding="UTF-8"?>'
+                '<OME xmlns="http://www.openmicroscopy.org/Schemas/OME/2016-06"><Image ID="Image:0">'
+                '<Pixels ID="Pixels:0" DimensionOrder="XYZCT" Type="uint16" SizeC="2" SizeZ="1" SizeT="1" '
+                'SizeX="{x}" SizeY="{y}" PhysicalSizeX="0.5" PhysicalSizeXUnit="um" '
+                'PhysicalSizeY="0.5" PhysicalSizeYUnit="um">'
+                '<Channel ID="Channel:0:0" Name="DAPI"/><Channel ID="Channel:0:1" Name="CD31"/>'
+                '</Pixels></Image></OME>')
+
+
+def write_dataset(base_dir: str, shapes: list, raw_cycles: list) -> str:
+    """ MxIF dataset with one two-channel image per cycle, raw CZI files only for raw_cycles """
+    dataset_dir = osp.join(base_dir, 'dataset')
+    os.makedirs(osp.join(dataset_dir, 'rawMicroscopy'))
+    for cycle, shape in enumerate(shapes, start=1):
+        name = 'sample_cyc{}_reg1'.format(cycle)
+        img_dir = osp.join(dataset_dir, 'processedMicroscopy', name + '_images')
+        os.makedirs(img_dir)
+        tif.imwrite(osp.join(img_dir, name + '_registered.ome.tiff'), np.zeros((2,) + shape, dtype=np.uint16),
+                    photometric='minisblack', description=OME_TEMPLATE.format(y=shape[0], x=shape[1]),
+                    metadata=None)
+        if cycle in raw_cycles:
+            open(osp.join(dataset_dir, 'rawMicroscopy', name + '_unregistered.czi'), 'wb').close()
+    return dataset_dir
+
+
+def get_submission(dataset_dir: str, **kwargs) -> dict:
+    submission = {'experiment_name': 'sample', 'mxif_dataset_dir_path': dataset_dir, 'nuclei_channel': 'DAPI',
+                  'block_size': 1000, 'overlap': 50}
+    submission.update(kwargs)
+    return submission
+
+
+def test_valid_submission_has_no_issues(tmp_path):
+    dataset_dir = write_dataset(str(tmp_path), [(40, 50), (40, 50)], [1, 2])
+    assert preflight.check_submission(get_submission(dataset_dir)) == []
+
+
+def test_every_problem_is_reported(tmp_path):
+    dataset_dir = write_dataset(str(tmp_path), [(40, 50), (40, 60)], [1])
+    submission = get_submission(dataset_dir, nuclei_channel='Hoechst', overlap=-1)
+    issues = preflight.check_submission(submission)
+    messages = [issue['message'] for issue in issues]
+    assert all(issue['level'] == 'error' for issue in issues)
+    assert 'overlap must be a non-negative integer' in messages
+    assert any(m.startswith('no raw CZI of cycle 2') for m in messages)
+    assert any(m.startswith('MxIF plane shape [40, 60] differs') for m in messages)
+    assert sum(m.startswith('nuclei channel Hoechst is not found') for m in messages) == 2
+
+
+def test_unreadable_ims_is_reported(tmp_path):
+    dataset_dir = write_dataset(str(tmp_path), [(40, 50)], [1])
+    ims_path = str(tmp_path / 'ims.ome.tiff')
+    with open(ims_path, 'wb') as f:
+        f.write(b'not a tiff')
+    issues = preflight.check_submission(get_submission(dataset_dir, multichannel_ims_ometiff_positive_path=ims_path))
+    assert [issue['path'] for issue in issues] == [ims_path]
+    assert issues[0]['message'].startswith('cannot read TIFF header')
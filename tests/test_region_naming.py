@@ -0,0 +1,69 @@
+import os
+import os.path as osp
+
+import numpy as np
+import tifffile as tif
+import yaml
+
+import generate_cytokit_config
+import generate_pipeline_config
+import run_slicer
+from tile_manifest import MANIFEST_NAME, CYTOKIT_TILE_NAME, read_manifest, get_cytokit_tile_paths
+
+BLOCK_SIZE = 50
+OVERLAP = 5
+
+
+def write_dataset(base_dir: str) -> dict:
+    """ MxIF dataset with regions 1 and 2 of one cycle, returns images by region """
+    images = dict()
+    for region in (1, 2):
+        name = 'sample_cyc1_reg{}'.format(region)
+        img_dir = osp.join(base_dir, 'processedMicroscopy', name + '_images')
+        os.makedirs(img_dir)
+        images[region] = np.full((1, 120, 140), region * 1000, dtype=np.uint16)
+        tif.imwrite(osp.join(img_dir, name + '_registered.ome.tiff'), images[region], photometric='minisblack')
+        os.makedirs(osp.join(base_dir, 'rawMicroscopy'), exist_ok=True)
+        open(osp.join(base_dir, 'rawMicroscopy', name + '_unregistered.czi'), 'wb').close()
+    return images
+
+
+def get_raw_meta(raw_img_path: str, meta_output_dir: str) -> dict:
+    """ Metadata that is read from raw CZI with bioformats """
+    return {'per_cycle_channel_names': ['CH1'], 'channel_names': ['DAPI'], 'axial_resolution': 1,
+            'lateral_resolution': 0.5, 'emission_wavelengths': [465], 'magnification': 20, 'num_z_planes': 1,
+            'numerical_aperture': 0.8, 'objective_type': 'air'}
+
+
+def test_selected_region_is_segmented_as_region_1(tmp_path, monkeypatch):
+    mxif_dir = str(tmp_path / 'mxif')
+    images = write_dataset(mxif_dir)
+    monkeypatch.setattr(generate_pipeline_config, 'get_raw_meta', get_raw_meta)
+    monkeypatch.chdir(tmp_path)
+
+    submission = {'experiment_name': 'sample', 'mxif_dataset_dir_path': mxif_dir, 'nuclei_channel': 'DAPI',
+                  'block_size': BLOCK_SIZE, 'overlap': OVERLAP, 'ngpus': 1, 'region': 2}
+    pipeline_config_path = str(tmp_path / 'pipeline_config.yaml')
+    cytokit_config_path = str(tmp_path / 'cytokit_config.yaml')
+    generate_pipeline_config.main(submission, str(tmp_path), pipeline_config_path)
+    generate_cytokit_config.main(pipeline_config_path, cytokit_config_path)
+    run_slicer.main(pipeline_config_path, mxif_dir, BLOCK_SIZE, OVERLAP)
+
+    with open(pipeline_config_path, 'r') as s:
+        pipeline_config = yaml.safe_load(s)
+    with open(cytokit_config_path, 'r') as s:
+        cytokit_config = yaml.safe_load(s)
+    manifest = read_manifest(osp.join('tiles', MANIFEST_NAME))
+
+    # region of the dataset is kept in submission, tiles of it are region 1 of Cytokit config
+    assert pipeline_config['submission']['region'] == 2
+    assert cytokit_config['acquisition']['region_names'] == ['reg1']
+    assert manifest['region'] == 1
+    assert sorted(os.listdir('tiles')) == ['Cyc1_reg1', MANIFEST_NAME]
+    tile_path = osp.join('tiles', manifest['tiles'][0]['files'][0]['path'])
+    assert osp.basename(tile_path).startswith('1_')
+    assert (tif.imread(tile_path)[OVERLAP:-OVERLAP, OVERLAP:-OVERLAP] == images[2][0, 0, 0]).all()
+
+    # stitcher expects Cytokit output of region 1
+    paths = get_cytokit_tile_paths(manifest, 'cytometry/tile')
+    assert osp.basename(paths[0]) == CYTOKIT_TILE_NAME.format(region=1, x=1, y=1)
@@ -0,0 +1,59 @@
+import os
+import os.path as osp
+
+import yaml
+
+import run_batch
+
+
+def write_submission(base_dir: str, region=None) -> str:
+    """ Submission with relative path to MxIF dataset with regions 1 and 2 """
+    for region_id in (1, 2):
+        img_dir = osp.join(base_dir, 'dataset', 'processedMicroscopy', 'sample_cyc1_reg{}_images'.format(region_id))
+        os.makedirs(img_dir)
+        open(osp.join(img_dir, 'sample_cyc1_reg{}_registered.ome.tiff'.format(region_id)), 'wb').close()
+    os.makedirs(osp.join(base_dir, 'dataset', 'rawMicroscopy'))
+    submission = {'experiment_name': 'sample', 'mxif_dataset_dir_path': {'class': 'Directory', 'path': 'dataset'},
+                  'region': region}
+    path = osp.join(base_dir, 'submission.yaml')
+    with open(path, 'w') as s:
+        yaml.safe_dump(submission, s)
+    return path
+
+
+def test_every_region_becomes_job(tmp_path):
+    submission = run_batch.read_submission(write_submission(str(tmp_path)))
+    assert submission['mxif_dataset_dir_path'] == str(tmp_path / 'dataset')
+
+    expanded = run_batch.expand_regions(submission)
+    assert [s['region'] for s in expanded] == [1, 2]
+    assert [run_batch.get_job_name(s) for s in expanded] == ['sample_reg1', 'sample_reg2']
+    assert submission['region'] is None
+
+
+def test_selected_region_is_kept(tmp_path):
+    submission = run_batch.read_submission(write_submission(str(tmp_path), region=2))
+    assert run_batch.expand_regions(submission) == [submission]
+
+
+def test_stages_wait_for_dependencies():
+    done = set()
+    submitted = set()
+    order = []
+    while len(done) < len(run_batch.STAGES):
+        ready = run_batch.get_ready_stages(done, submitted)
+        assert ready != []
+        order.append(set(ready))
+        submitted.update(ready)
+        done.update(ready)
+    assert order == [{'initiate'}, {'slice', 'combine_mxif'}, {'segment'}, {'stitch'}]
+
+
+def test_ims_is_combined_once_per_experiment(tmp_path):
+    submission = run_batch.read_submission(write_submission(str(tmp_path)))
+    assert run_batch.get_ims_jobs(run_batch.expand_regions(submission)) == {}
+
+    submission['multichannel_ims_ometiff_positive_path'] = str(tmp_path / 'ims_pos.ome.tiff')
+    ims_jobs = run_batch.get_ims_jobs(run_batch.expand_regions(submission))
+    assert list(ims_jobs.keys()) == ['sample_ims']
+    assert run_batch.get_ready_stages(set(), set(), run_batch.IMS_STAGES) == ['combine_ims']
@@ -0,0 +1,87 @@
+import os
+import os.path as osp
+
+import numpy as np
+import pytest
+import tifffile as tif
+
+import segmentation
+import slicer
+from boundaries import get_boundaries
+from tile_manifest import MANIFEST_NAME, CYTOKIT_TILE_NAME, read_manifest
+
+
+def make_nuclei_image(shape: tuple, centers: list, radius: int = 6) -> np.ndarray:
+    rng = np.random.default_rng(0)
+    img = rng.normal(200, 10, size=shape)
+    yy, xx = np.mgrid[0:shape[0], 0:shape[1]]
+    for y, x in centers:
+        img[(yy - y) ** 2 + (xx - x) ** 2 <= radius ** 2] = 2000
+    return img.astype(np.uint16)
+
+
+def test_cpu_backend_finds_every_nucleus():
+    centers = [(15, 15), (15, 45), (45, 20), (50, 50)]
+    img = make_nuclei_image((64, 64), centers)
+    cells, nuclei = segmentation.segment_cpu(img, {})
+
+    assert len(np.unique(nuclei[nuclei > 0])) == len(centers)
+    for y, x in centers:
+        assert nuclei[y, x] > 0 and cells[y, x] == nuclei[y, x]
+    # cells are nuclei expanded without overlap
+    assert (cells[nuclei > 0] == nuclei[nuclei > 0]).all()
+    assert (cells > 0).sum() > (nuclei > 0).sum()
+
+    noise = make_nuclei_image((64, 64), [])
+    assert segmentation.segment_cpu(noise, {})[0].max() == 0
+
+
+def test_main_writes_cytokit_tiles(tmp_path):
+    img = make_nuclei_image((100, 100), [(20, 20), (20, 70), (70, 30), (75, 75)])
+    img_path = str(tmp_path / 'img.tif')
+    tif.imwrite(img_path, img[None], photometric='minisblack')
+    slicer.main(img_path, str(tmp_path / 'tiles'), 50, 0, 8, 1, 1, 1, 1, [0], empty_tiles=[4])
+
+    segmentation.main(str(tmp_path / 'tiles'), str(tmp_path / 'out'), nworkers=1)
+    tile_dir = str(tmp_path / 'out' / 'cytometry' / 'tile')
+    manifest = read_manifest(str(tmp_path / 'tiles' / MANIFEST_NAME))
+    expected = [CYTOKIT_TILE_NAME.format(region=1, x=t['x'], y=t['y']) for t in manifest['tiles'] if not t['empty']]
+    assert sorted(os.listdir(tile_dir)) == sorted(expected)
+
+    stack = tif.imread(osp.join(tile_dir, expected[0]))
+    assert stack.shape == (4, 66, 66) and stack.dtype == np.uint32
+    cells, nuclei, cell_boundaries, nucleus_boundaries = stack
+    assert nuclei.max() == 1
+    assert np.array_equal(cell_boundaries, get_boundaries(cells))
+    assert np.array_equal(nucleus_boundaries, get_boundaries(nuclei))
+    assert 0 < (nucleus_boundaries > 0).sum() < (nuclei > 0).sum()
+
+
+def write_tile_files(data_dir: str, planes: dict) -> dict:
+    """ planes - image of every (channel, z) of tile 1, names as slicer writes them """
+    files = []
+    for (channel, z), img in sorted(planes.items()):
+        name = '1_00001_Z{:03d}_CH{:d}.tif'.format(z, channel)
+        tif.imwrite(osp.join(data_dir, name), img, photometric='minisblack')
+        files.append({'path': name, 'nbytes': 0, 'npages': 1})
+    return {'tile': 1, 'x': 1, 'y': 1, 'empty': False, 'files': files}
+
+
+def test_best_focus_is_selected_from_nuclei_channel(tmp_path):
+    rng = np.random.default_rng(0)
+    blurry = np.full((32, 32), 100, dtype=np.uint16)
+    sharp = rng.integers(0, 1000, size=(32, 32)).astype(np.uint16)
+    sharper = rng.integers(0, 60000, size=(32, 32)).astype(np.uint16)
+    # other channel has the sharpest plane of the tile, it must not be selected
+    tile = write_tile_files(str(tmp_path), {(1, 1): blurry, (1, 2): sharp, (2, 1): sharper, (2, 2): blurry})
+
+    assert (segmentation.read_nuclei_tile(str(tmp_path), tile, nuclei_channel=1) == sharp).all()
+    assert (segmentation.read_nuclei_tile(str(tmp_path), tile, nuclei_channel=2) == sharper).all()
+    with pytest.raises(ValueError):
+        segmentation.read_nuclei_tile(str(tmp_path), tile)
+
+
+def test_single_sliced_channel_needs_no_selection(tmp_path):
+    img = np.arange(32 * 32, dtype=np.uint16).reshape((32, 32))
+    tile = write_tile_files(str(tmp_path), {(3, 1): img})
+    assert (segmentation.read_nuclei_tile(str(tmp_path), tile) == img).all()
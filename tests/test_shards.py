@@ -0,0 +1,47 @@
+import os
+import os.path as osp
+
+import numpy as np
+import tifffile as tif
+
+import slicer
+import stitcher
+from shards import get_shard_rows, SHARD_DIR_NAME
+from tile_manifest import MANIFEST_NAME, CYTOKIT_TILE_NAME, read_manifest
+
+
+def test_shard_rows_are_contiguous_and_balanced():
+    assert get_shard_rows(7, 3) == [(0, 3), (3, 5), (5, 7)]
+    assert get_shard_rows(2, 5) == [(0, 1), (1, 2)]
+    assert get_shard_rows(4, 0) == [(0, 4)]
+
+
+def test_sharded_stitching_equals_single_grid(tmp_path, label_tiles):
+    labels, tile_dir, manifest_path, overlap, padding_str = label_tiles
+    img_path = str(tmp_path / 'labels_sharded.tif')
+    tif.imwrite(img_path, labels[None], photometric='minisblack')
+    block_size = read_manifest(manifest_path)['block_shape']['x'] - 2 * overlap
+    out_dir = str(tmp_path / 'sharded')
+    slicer.main(img_path, out_dir, block_size, 0, overlap, 1, 1, 1, 1, [0], nshards=2)
+    manifest = read_manifest(osp.join(out_dir, MANIFEST_NAME))
+    assert [(s['row_start'], s['row_stop']) for s in manifest['shards']] == [(0, 2), (2, 3)]
+
+    # every shard is segmented separately, tile names restart from the first row of the shard
+    shard_tile_dirs = []
+    for s, shard in enumerate(manifest['shards']):
+        shard_dir = osp.join(out_dir, SHARD_DIR_NAME.format(shard=s))
+        shard_manifest = read_manifest(osp.join(shard_dir, MANIFEST_NAME))
+        assert shard_manifest['nblocks']['y'] == shard['row_stop'] - shard['row_start']
+        shard_tile_dir = str(tmp_path / 'cytokit_sharded' / SHARD_DIR_NAME.format(shard=s))
+        os.makedirs(shard_tile_dir)
+        for tile in shard_manifest['tiles']:
+            tile_labels = tif.imread(osp.join(shard_dir, tile['files'][0]['path'])).astype(np.uint32)
+            name = CYTOKIT_TILE_NAME.format(region=1, x=tile['x'], y=tile['y'])
+            tif.imwrite(osp.join(shard_tile_dir, name), np.stack([tile_labels] * 4), photometric='minisblack')
+        shard_tile_dirs.append(shard_tile_dir)
+
+    sharded_path = str(tmp_path / 'stitched_sharded.tif')
+    single_path = str(tmp_path / 'stitched.tif')
+    stitcher.main(shard_tile_dirs, sharded_path, overlap, padding_str, osp.join(out_dir, MANIFEST_NAME))
+    stitcher.main(tile_dir, single_path, overlap, padding_str, manifest_path)
+    assert np.array_equal(tif.imread(sharded_path, is_ome=False), tif.imread(single_path, is_ome=False))
@@ -0,0 +1,44 @@
+import os
+import os.path as osp
+
+import numpy as np
+import tifffile as tif
+
+import slicer
+from tile_manifest import MANIFEST_NAME, read_manifest
+
+BLOCK_SIZE = 64
+OVERLAP = 10
+
+
+def test_only_best_focus_plane_is_sliced(tmp_path):
+    nzplanes = 3
+    rng = np.random.default_rng(0)
+    shape = (150, 170)
+    planes = np.full((nzplanes,) + shape, 1000, dtype=np.uint16)
+    expected_z = []
+    for i in range(0, 3):
+        for j in range(0, 3):
+            # every tile is sharp in its own z-plane and flat in the others
+            z = (i * 3 + j) % nzplanes
+            expected_z.append(z)
+            window = (slice(i * BLOCK_SIZE, (i + 1) * BLOCK_SIZE), slice(j * BLOCK_SIZE, (j + 1) * BLOCK_SIZE))
+            planes[z][window] = rng.integers(0, 4000, size=planes[z][window].shape)
+    img_path = str(tmp_path / 'img.tif')
+    tif.imwrite(img_path, planes, photometric='minisblack')
+
+    best_focus_z = slicer.get_best_focus_z(img_path, 0, nzplanes, BLOCK_SIZE, BLOCK_SIZE)
+    assert best_focus_z == expected_z
+
+    out_dir = str(tmp_path / 'tiles')
+    slicer.main(img_path, out_dir, BLOCK_SIZE, 0, OVERLAP, 1, 1, nzplanes, 1, [0], best_focus_z=best_focus_z)
+    manifest = read_manifest(osp.join(out_dir, MANIFEST_NAME))
+    assert len(os.listdir(osp.join(out_dir, 'Cyc1_reg1'))) == 9
+    for tile, z in zip(manifest['tiles'], expected_z):
+        assert tile['best_focus_z'] == z
+        assert len(tile['files']) == 1 and '_Z001_' in tile['files'][0]['path']
+        i, j = tile['y'] - 1, tile['x'] - 1
+        tile_img = tif.imread(osp.join(out_dir, tile['files'][0]['path']))
+        expected = planes[z][i * BLOCK_SIZE:(i + 1) * BLOCK_SIZE, j * BLOCK_SIZE:(j + 1) * BLOCK_SIZE]
+        inner = tile_img[OVERLAP:OVERLAP + expected.shape[0], OVERLAP:OVERLAP + expected.shape[1]]
+        assert np.array_equal(inner, expected)
@@ -0,0 +1,196 @@
+import os
+import os.path as osp
+
+import numpy as np
+import tifffile as tif
+
+import incremental_stitcher
+import slicer
+import stitcher
+from tile_manifest import MANIFEST_NAME, CYTOKIT_TILE_NAME, read_manifest
+
+OVERLAP = 10
+BLOCK_SIZE = 64
+
+
+def make_image(shape=(150, 170), seed=0) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    return rng.integers(100, 4000, size=shape).astype(np.uint16)
+
+
+def slice_image(img: np.ndarray, tmp_dir: str) -> str:
+    """ Slices one-page image and returns path to the tile manifest """
+    img_path = osp.join(tmp_dir, 'img.tif')
+    tif.imwrite(img_path, img[None], photometric='minisblack')
+    tiles_dir = osp.join(tmp_dir, 'tiles')
+    slicer.main(img_path, tiles_dir, BLOCK_SIZE, 0, OVERLAP, 1, 1, 1, 1, [0])
+    return osp.join(tiles_dir, MANIFEST_NAME)
+
+
+def test_tile_grid_from_manifest_matches_directory(tmp_path):
+    img = make_image()
+    manifest_path = slice_image(img, str(tmp_path))
+    manifest = read_manifest(manifest_path)
+    assert manifest['nblocks'] == {'x': 3, 'y': 3}
+    assert manifest['block_shape'] == {'x': BLOCK_SIZE + 2 * OVERLAP, 'y': BLOCK_SIZE + 2 * OVERLAP}
+    for tile in manifest['tiles']:
+        path = osp.join(osp.dirname(manifest_path), tile['files'][0]['path'])
+        assert osp.getsize(path) == tile['files'][0]['nbytes']
+
+    # segmentation output with Cytokit names and four mask pages
+    cytokit_dir = str(tmp_path / 'cytokit')
+    os.makedirs(cytokit_dir)
+    tile_shape = (4, BLOCK_SIZE + 2 * OVERLAP, BLOCK_SIZE + 2 * OVERLAP)
+    for tile in manifest['tiles']:
+        name = CYTOKIT_TILE_NAME.format(region=1, x=tile['x'], y=tile['y'])
+        tif.imwrite(osp.join(cytokit_dir, name), np.zeros(tile_shape, dtype=np.uint32), photometric='minisblack')
+
+    from_manifest = stitcher.get_tile_grid_from_manifest(cytokit_dir, manifest_path)
+    from_dir = stitcher.get_tile_grid_from_dir(cytokit_dir)
+    path_list, x_nblocks, y_nblocks, block_shape, npages = from_manifest
+    assert path_list == from_dir[0]
+    assert (x_nblocks, y_nblocks, npages) == (from_dir[1], from_dir[2], from_dir[4])
+    # shape of the first tile read from the directory also contains pages
+    assert list(block_shape) == list(from_dir[3][-2:])
+
+
+def write_intensity_tiles(img: np.ndarray, tmp_dir: str) -> tuple:
+    """ Slices the image and writes two-page tiles with Cytokit names, as processed intensity tiles """
+    manifest_path = slice_image(img, tmp_dir)
+    manifest = read_manifest(manifest_path)
+
+    proc_dir = osp.join(tmp_dir, 'proc')
+    os.makedirs(proc_dir)
+    for tile in manifest['tiles']:
+        tile_img = tif.imread(osp.join(osp.dirname(manifest_path), tile['files'][0]['path']))
+        name = CYTOKIT_TILE_NAME.format(region=1, x=tile['x'], y=tile['y'])
+        tif.imwrite(osp.join(proc_dir, name), np.stack([tile_img, tile_img // 2]), photometric='minisblack')
+
+    x_nblocks, y_nblocks = manifest['nblocks']['x'], manifest['nblocks']['y']
+    padding = [0, x_nblocks * BLOCK_SIZE - img.shape[1], 0, y_nblocks * BLOCK_SIZE - img.shape[0]]
+    return proc_dir, manifest_path, ','.join(str(p) for p in padding)
+
+
+def test_intensity_mode_restores_image(tmp_path):
+    img = make_image()
+    proc_dir, manifest_path, padding_str = write_intensity_tiles(img, str(tmp_path))
+    for blend in ('linear', 'cosine'):
+        out_path = str(tmp_path / ('stitched_' + blend + '.tif'))
+        stitcher.main(proc_dir, out_path, OVERLAP, padding_str, manifest_path, mode='intensity', blend=blend)
+        with tif.TiffFile(out_path) as TF:
+            assert len(TF.pages) == 2
+            pages = [p.asarray() for p in TF.pages]
+        # overlaps of neighbouring tiles have the same values, so blending must give the original image
+        assert pages[0].shape == img.shape
+        assert np.abs(pages[0].astype(int) - img).max() <= 1
+        assert np.abs(pages[1].astype(int) - img // 2).max() <= 1
+
+
+def test_intensity_mode_without_manifest(tmp_path):
+    img = make_image(seed=1)
+    proc_dir, _, padding_str = write_intensity_tiles(img, str(tmp_path))
+    out_path = str(tmp_path / 'stitched.tif')
+    stitcher.main(proc_dir, out_path, OVERLAP, padding_str, mode='intensity')
+    assert np.abs(tif.imread(out_path, key=0).astype(int) - img).max() <= 1
+
+
+def test_remapping_from_tile_edges_equals_full_tiles(tmp_path, label_tiles):
+    _, tile_dir, manifest_path, overlap, _ = label_tiles
+    path_list, x_nblocks, y_nblocks, _, _ = stitcher.get_tile_grid_from_manifest(tile_dir, manifest_path)
+    tiles = [tif.imread(path, key=0) for path in path_list]
+
+    # compressed tiles cannot be memory-mapped and are decoded
+    compressed_path = str(tmp_path / 'compressed.tif')
+    tif.imwrite(compressed_path, tiles[4], compress=6)
+    for path in (path_list[4], compressed_path):
+        edges = stitcher.read_tile_edges(path, overlap)
+        assert np.array_equal(edges['left'], tiles[4][:, :overlap])
+        assert np.array_equal(edges['right'], tiles[4][:, -overlap:])
+        assert np.array_equal(edges['top'], tiles[4][:overlap, :])
+        assert np.array_equal(edges['bottom'], tiles[4][-overlap:, :])
+
+    remap_dict = stitcher.get_remapping_for_border_values(path_list, x_nblocks, y_nblocks, overlap)
+    for n in range(1, len(path_list)):
+        i, j = divmod(n, x_nblocks)
+        hor_remap, ver_remap = stitcher.get_tile_remapping(remap_dict, n)
+        if j > 0:
+            assert hor_remap == stitcher.get_remapping(tiles[n - 1], tiles[n], overlap, 'horizontal')
+        if i > 0:
+            assert ver_remap == stitcher.get_remapping(tiles[n - x_nblocks], tiles[n], overlap, 'vertical')
+
+
+def test_tiles_without_tissue_are_skipped(tmp_path):
+    img = make_image(seed=2) // 40
+    img[:40, :40] = 3000
+    empty_tiles = slicer.get_empty_tiles(img, BLOCK_SIZE, BLOCK_SIZE, OVERLAP)
+    assert empty_tiles == list(range(2, 10))
+
+    img_path = str(tmp_path / 'img.tif')
+    tif.imwrite(img_path, img[None], photometric='minisblack')
+    tiles_dir = str(tmp_path / 'tiles')
+    slicer.main(img_path, tiles_dir, BLOCK_SIZE, 0, OVERLAP, 1, 1, 1, 1, [0], empty_tiles=empty_tiles)
+    manifest_path = osp.join(tiles_dir, MANIFEST_NAME)
+    manifest = read_manifest(manifest_path)
+    assert [tile['empty'] for tile in manifest['tiles']] == [False] + [True] * 8
+    assert [len(tile['files']) for tile in manifest['tiles']] == [1] + [0] * 8
+    assert len(os.listdir(osp.join(tiles_dir, 'Cyc1_reg1'))) == 1
+
+    # Cytokit output exists only for the tile with tissue
+    cytokit_dir = str(tmp_path / 'cytokit')
+    os.makedirs(cytokit_dir)
+    tile_img = tif.imread(osp.join(tiles_dir, manifest['tiles'][0]['files'][0]['path']))
+    tile_labels = (tile_img > 1000).astype(np.uint32)
+    tif.imwrite(osp.join(cytokit_dir, CYTOKIT_TILE_NAME.format(region=1, x=1, y=1)),
+                np.stack([tile_labels] * 4), photometric='minisblack')
+
+    out_path = str(tmp_path / 'stitched.tif')
+    padding = ','.join(str(p) for p in [0, 3 * BLOCK_SIZE - img.shape[1], 0, 3 * BLOCK_SIZE - img.shape[0]])
+    stitcher.main(cytokit_dir, out_path, OVERLAP, padding, manifest_path)
+    stitched = tif.imread(out_path, key=0, is_ome=False)
+    assert np.array_equal(stitched, (img > 1000).astype(np.uint32))
+
+
+def test_single_tile_padding_is_removed(tmp_path):
+    img = make_image(shape=(50, 60), seed=2)
+    proc_dir, manifest_path, padding_str = write_intensity_tiles(img, str(tmp_path))
+    assert read_manifest(manifest_path)['nblocks'] == {'x': 1, 'y': 1}
+    out_path = str(tmp_path / 'stitched.tif')
+    stitcher.main(proc_dir, out_path, OVERLAP, padding_str, manifest_path, mode='intensity')
+    assert np.abs(tif.imread(out_path, key=0).astype(int) - img).max() <= 1
+
+
+def test_tiles_without_overlap_are_not_merged(tmp_path):
+    rng = np.random.default_rng(3)
+    labels = np.kron(rng.integers(0, 40, size=(15, 17)), np.ones((10, 10), dtype=np.int64)).astype(np.uint16)
+    img_path = str(tmp_path / 'labels.tif')
+    tif.imwrite(img_path, labels[None], photometric='minisblack')
+    slicer.main(img_path, str(tmp_path / 'tiles'), BLOCK_SIZE, 0, 0, 1, 1, 1, 1, [0])
+    manifest_path = str(tmp_path / 'tiles' / MANIFEST_NAME)
+    manifest = read_manifest(manifest_path)
+    tile_dir = str(tmp_path / 'cytokit')
+    os.makedirs(tile_dir)
+    for tile in manifest['tiles']:
+        tile_labels = tif.imread(str(tmp_path / 'tiles' / tile['files'][0]['path'])).astype(np.uint32)
+        name = CYTOKIT_TILE_NAME.format(region=1, x=tile['x'], y=tile['y'])
+        tif.imwrite(osp.join(tile_dir, name), np.stack([tile_labels] * 4), photometric='minisblack')
+    x_nblocks, y_nblocks = manifest['nblocks']['x'], manifest['nblocks']['y']
+    padding_str = '0,{},0,{}'.format(x_nblocks * BLOCK_SIZE - labels.shape[1], y_nblocks * BLOCK_SIZE - labels.shape[0])
+
+    path_list = stitcher.get_tile_grid_from_manifest(tile_dir, manifest_path)[0]
+    assert stitcher.get_remapping_for_border_values(path_list, x_nblocks, y_nblocks, 0) == {}
+    out_path = str(tmp_path / 'stitched.tif')
+    table_path = str(tmp_path / 'labels.json')
+    stitcher.main(tile_dir, out_path, 0, padding_str, manifest_path, label_table_path=table_path)
+    stitched = tif.imread(out_path, key=0, is_ome=False)
+
+    # every object keeps one label inside a tile and gets different labels in different tiles
+    tile_ids = np.kron(np.arange(y_nblocks * x_nblocks).reshape((y_nblocks, x_nblocks)),
+                       np.ones((BLOCK_SIZE, BLOCK_SIZE), dtype=np.int64))[:labels.shape[0], :labels.shape[1]]
+    expected = np.where(labels > 0, tile_ids * 100 + labels, 0)
+    pairs = np.unique(np.stack([stitched.ravel(), expected.ravel()]), axis=1)
+    assert len(np.unique(pairs[0])) == pairs.shape[1] == len(np.unique(pairs[1]))
+
+    incremental_stitcher.main(tile_dir, out_path, table_path, [5], manifest_path)
+    restitched = tif.imread(out_path, key=0, is_ome=False)
+    assert np.array_equal(restitched > 0, labels > 0)
+    assert np.array_equal(restitched[tile_ids != 4], stitched[tile_ids != 4])
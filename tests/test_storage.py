@@ -0,0 +1,45 @@
+import io
+import os.path as osp
+
+import numpy as np
+import tifffile as tif
+
+import storage
+
+
+def put_tiff(path: str, img: np.ndarray):
+    buffer = io.BytesIO()
+    tif.imwrite(buffer, img, photometric='minisblack')
+    with storage.open_file(path, 'wb') as f:
+        f.write(buffer.getvalue())
+
+
+def test_remote_tiff_pages_are_read(tmp_path):
+    img = np.arange(3 * 20 * 30, dtype=np.uint16).reshape((3, 20, 30))
+    remote_dir = 'memory://' + tmp_path.name
+    path = storage.join(remote_dir, 'img.ome.tiff')
+    put_tiff(path, img)
+
+    assert storage.exists(path)
+    assert storage.listdir(remote_dir) == ['img.ome.tiff']
+    assert np.array_equal(storage.imread(path, key=1), img[1])
+    with storage.open_tiff(path) as TF:
+        assert len(TF.pages) == 3
+    local_path = storage.get_local_copy(path, str(tmp_path))
+    assert np.array_equal(tif.imread(local_path), img)
+
+
+def test_local_output_uploads_sidecars(tmp_path):
+    remote_path = 'memory://' + tmp_path.name + '/out/combined.ome.tiff'
+    with storage.local_output(remote_path) as local_path:
+        assert not storage.is_remote(local_path)
+        tif.imwrite(local_path, np.ones((10, 10), dtype=np.uint8))
+        with open(local_path.replace('.ome.tiff', '.channel_index.json'), 'w') as s:
+            s.write('{}')
+    assert sorted(storage.listdir('memory://' + tmp_path.name + '/out')) == ['combined.channel_index.json',
+                                                                             'combined.ome.tiff']
+    assert not osp.exists(local_path)
+
+    local_out = str(tmp_path / 'local.tif')
+    with storage.local_output(local_out) as path:
+        assert path == local_out
@@ -0,0 +1,48 @@
+import numpy as np
+import pytest
+import tifffile as tif
+import yaml
+
+import tiling_planner
+
+MACHINE = {'ram_gb': 64.0, 'gpu_memory_gb': 11.0, 'ngpus': 1, 'ncpus': 8}
+
+
+def test_plan_counts_tiles_and_redundancy():
+    plan = tiling_planner.estimate_plan((1000, 1500), 1, 2, 500, 50, MACHINE, tiling_planner.DEFAULT_COST_MODEL)
+    assert plan['nblocks'] == {'x': 3, 'y': 2}
+    assert plan['ntiles'] == 6
+    assert plan['redundant_fraction'] == round(1 - 1000 * 1500 / (6 * 600 ** 2), 4)
+    assert plan['fits']
+
+
+def test_fastest_plan_within_gpu_memory_is_selected():
+    model = tiling_planner.DEFAULT_COST_MODEL
+    plans = tiling_planner.get_plans((8000, 8000), 1, 2, 50, MACHINE, model)
+    selected = tiling_planner.select_plan(plans)
+    assert selected['fits']
+    assert selected['total_runtime_s'] == min(p['total_runtime_s'] for p in plans if p['fits'])
+
+    small_gpu = dict(MACHINE, gpu_memory_gb=0.5)
+    plans = tiling_planner.get_plans((8000, 8000), 1, 2, 50, small_gpu, model)
+    limited = tiling_planner.select_plan(plans)
+    assert limited['fits']
+    assert limited['block_size'] < selected['block_size']
+    assert limited['gpu_memory_gb'] <= 0.5
+
+
+def test_profile_overrides_cost_model(tmp_path):
+    profile_path = str(tmp_path / 'profile.yaml')
+    with open(profile_path, 'w') as s:
+        yaml.safe_dump({'cost_model': {'segmentation_s_per_tile': 30.0}}, s)
+    model = tiling_planner.load_cost_model(profile_path)
+    assert model['segmentation_s_per_tile'] == 30.0
+    assert model['slicer_s_per_mpx'] == tiling_planner.DEFAULT_COST_MODEL['slicer_s_per_mpx']
+    with pytest.raises(FileNotFoundError):
+        tiling_planner.load_cost_model(str(tmp_path / 'missing.yaml'))
+
+
+def test_image_params_are_read_from_first_page(tmp_path):
+    img_path = str(tmp_path / 'img.tif')
+    tif.imwrite(img_path, np.zeros((3, 40, 50), dtype=np.uint16), photometric='minisblack')
+    assert tiling_planner.get_image_params(img_path) == {'plane_shape': [40, 50], 'num_z': 1, 'itemsize': 2}